@@ -0,0 +1,78 @@
+"""Benchmark for fetching the video data for a votes CSV, as done by vote
+processing. Run from the project root directory:
+
+    poetry run python -m benchmarks.fetch_benchmark VOTES_CSV [--mode MODE]
+
+First record the responses for a votes CSV with `--mode record` (which needs
+network access and a YouTube Data API key in the YOUTUBE_API_KEY environment
+variable), then benchmark it offline with `--mode replay`. Other options
+override the "fetch_mode" section of config/config.json; see
+`functions.services.wrap_fetch_services`.
+
+The top 10 calculator and post-processing fetch via `get_fetcher` too, so they
+can also be run offline by setting the fetch mode in config/config.json.
+"""
+
+import argparse, os, time
+from functions.config import load_config_json
+from functions.services import get_fetcher, fetch_metrics
+from functions.voting import (
+    load_votes_csv,
+    normalize_voting_data,
+    process_voting_data,
+    fetch_video_data_for_ballots,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("votes_csv", help="Path to a votes CSV file")
+    parser.add_argument("--mode", choices=["record", "replay"], default="replay")
+    parser.add_argument("--fixtures", help="Fixture directory")
+    parser.add_argument("--latency", type=float, help="Replay latency in seconds")
+    parser.add_argument("--jitter", type=float, help="Replay jitter in seconds")
+    parser.add_argument("--error-rate", type=float, help="Replay error rate")
+    parser.add_argument("--seed", type=int, help="Replay random seed")
+    parser.add_argument("--runs", type=int, default=1, help="Number of runs")
+    args = parser.parse_args()
+
+    config = load_config_json("config/config.json")
+    fetch_mode_config = config.setdefault("fetch_mode", {})
+    fetch_mode_config["mode"] = args.mode
+    for option in ["fixtures", "latency", "jitter", "error_rate", "seed"]:
+        if (value := getattr(args, option)) is not None:
+            fetch_mode_config[option] = value
+
+    voting_data = load_votes_csv(args.votes_csv)
+
+    timings = []
+    for run in range(1, args.runs + 1):
+        fetch_metrics.reset()
+        fetcher = get_fetcher(os.environ.get("YOUTUBE_API_KEY"), config)
+
+        start_time = time.perf_counter()
+        normalized_voting_data = normalize_voting_data(
+            voting_data, fetcher.resolve_short_link
+        )
+        ballots = process_voting_data(normalized_voting_data)
+        videos = fetch_video_data_for_ballots(ballots, fetcher)
+        timings.append(time.perf_counter() - start_time)
+
+        fetcher.close()
+
+        num_failed = sum(1 for video in videos.values() if video.data is None)
+        print(
+            f"Run {run}: fetched {len(videos)} videos ({num_failed} failed) in {timings[-1]:.3f}s"
+        )
+
+    print(f"Best: {min(timings):.3f}s, mean: {sum(timings) / len(timings):.3f}s")
+    for service_name, summary in fetch_metrics.to_dict().items():
+        print(
+            f"  {service_name}: {summary['requests']} requests, p50 {summary['latency_seconds']['p50']}s"
+        )
+    for tier, summary in fetch_metrics.cache_tiers_to_dict().items():
+        print(f"  Cache {tier} tier: {summary['hits']} hits, {summary['misses']} misses")
+
+
+if __name__ == "__main__":
+    main()
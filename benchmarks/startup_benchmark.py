@@ -0,0 +1,82 @@
+"""Benchmark for the application's cold start time, from launching Python to
+the main menu being shown. Run from the project root directory (a display is
+needed, as the main menu window is created):
+
+    poetry run python -m benchmarks.startup_benchmark [--runs RUNS] [--max-seconds SECONDS]
+
+Each run starts the application in a new Python process. As well as the time
+taken, the benchmark reports any heavy dependencies which were imported before
+the main menu was shown; these should only be imported once a process is opened
+(see `main.show_main_menu`). The benchmark exits with a nonzero status if any
+were imported, or if the best run took longer than `--max-seconds`.
+"""
+
+import argparse, json, subprocess, sys, time
+
+
+# Modules which shouldn't be imported at startup.
+heavy_modules = ["pandas", "aiohttp", "yt_dlp", "googleapiclient", "fuzzywuzzy"]
+
+# Run in a new process to start the application, show the main menu and report
+# the time at which it was shown and the heavy modules imported.
+startup_code = f"""
+import json, sys, time
+import main
+from classes.gui import GUI
+
+main.show_main_menu()
+GUI.root.update()
+shown_time = time.time()
+imported = [name for name in {heavy_modules!r} if name in sys.modules]
+GUI.root.destroy()
+
+print(json.dumps({{"shown_time": shown_time, "imported": imported}}))
+"""
+
+
+def run_startup() -> tuple[float, list[str]]:
+    """Start the application in a new process, and return the number of seconds
+    it took to show the main menu, and the heavy modules it imported."""
+    start_time = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", startup_code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    return report["shown_time"] - start_time, report["imported"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs")
+    parser.add_argument(
+        "--max-seconds", type=float, default=2, help="Maximum acceptable start time"
+    )
+    args = parser.parse_args()
+
+    timings = []
+    imported = set()
+    for run in range(1, args.runs + 1):
+        timing, run_imported = run_startup()
+        timings.append(timing)
+        imported.update(run_imported)
+        print(f"Run {run}: main menu shown after {timing:.3f}s")
+
+    print(f"Best: {min(timings):.3f}s, mean: {sum(timings) / len(timings):.3f}s")
+
+    failed = False
+    if imported:
+        print(f"Heavy modules imported at startup: {', '.join(sorted(imported))}")
+        failed = True
+    if min(timings) > args.max_seconds:
+        print(f"Start time is over the maximum of {args.max_seconds:.3f}s")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,38 +3,1126 @@ the need to keep sending requests to the API, which can help with avoiding API
 quota limits.
 """
 
-import json
+import atexit, gzip, hashlib, json, os, sqlite3, tempfile, threading, time
+from collections import OrderedDict
 from pathlib import Path
 
 
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """An advisory lock shared between processes, held on the given lock file
+    (which is created if it doesn't exist). Use as a context manager; entering
+    it blocks until the lock is acquired.
+
+    The lock is only advisory, so it only excludes other processes that also
+    take it. It's held on an open file description, so separate `FileLock`s on
+    the same path exclude each other even within a process.
+    """
+
+    def __init__(self, lock_path: Path):
+        self.lock_path = lock_path
+        self._file = None
+
+    def __enter__(self):
+        self._file = self.lock_path.open("a+b")
+
+        if os.name == "nt":
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 attempts; keep waiting.
+                    pass
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+        return self
+
+    def __exit__(self, *args):
+        if os.name == "nt":
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+        self._file.close()
+        self._file = None
+
+
 class FileCache:
     """A file-based cache that stores new information at the given file path in
     JSON format. If the file doesn't exist, or is corrupt JSON, a new file will
     be created in its place. To clear the cache, delete the file.
+
+    Several processes can share the same cache file. Writers take an advisory
+    lock (on the cache file path with a `.lock` suffix), re-read the file if
+    another process has replaced it since it was last read, apply their own
+    changes on top, and write the result to a temporary file which is renamed
+    into place. Entries stored by other processes are therefore kept, and a
+    reader never sees a partially-written file.
     """
 
+    # All of the entries are kept in memory, so lookups never touch the disk.
+    in_memory = True
+
     def __init__(self, file_path_str: str):
         self.file_path = Path(file_path_str)
+        self.lock_path = self.file_path.with_name(f"{self.file_path.name}.lock")
         self.items = {}
 
+        # Identifies the version of the file that `items` was last read from or
+        # written to, so that it's only re-read when another process has
+        # replaced it.
+        self._file_stat = None
+        self._lock = threading.RLock()
+
+        self.reload()
+
+    @staticmethod
+    def get_file_stat(stat: os.stat_result) -> tuple:
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def read_file(self, file) -> dict:
+        return json.load(file)
+
+    def write_file(self, file):
+        json.dump(self.items, file)
+
+    def open_file(self, file_path: Path, mode: str):
+        return file_path.open(mode, encoding="utf-8")
+
+    def reload(self):
+        """Re-read the file if it has changed since it was last read or
+        written. If the file has been deleted, the cache is cleared; if it
+        can't be read, the current items are kept."""
+        try:
+            with self.open_file(self.file_path, "r") as file:
+                file_stat = self.get_file_stat(os.fstat(file.fileno()))
+                if file_stat == self._file_stat:
+                    return
+
+                self.items = self.read_file(file)
+                self._file_stat = file_stat
+        except FileNotFoundError:
+            self.items = {}
+            self._file_stat = None
+        except (EOFError, OSError, ValueError):
+            pass
+
+    def get(self, key: str) -> str:
+        return self.items[key]
+
+    def set(self, key: str, value: str):
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        """Store several entries at once, rewriting the file only once."""
+        # Serialize before touching any state; if a value isn't
+        # JSON-serializable this raises a TypeError and the cache is unchanged.
+        json.dumps(items)
+
+        self.write_changes(items, [])
+
+    def has(self, key: str) -> bool:
+        return key in self.items
+
+    def delete_many(self, keys: list[str]):
+        """Remove several entries at once, rewriting the file only once."""
+        self.write_changes({}, keys)
+
+    def write_changes(self, items: dict, deleted_keys: list[str]):
+        """Merge the given changes into the entries currently on disk, and
+        write the result."""
+        with self._lock, FileLock(self.lock_path):
+            self.reload()
+
+            self.items.update(items)
+            for key in deleted_keys:
+                self.items.pop(key, None)
+
+            self.write()
+
+    def write(self):
+        """Atomically replace the file with the current items. The caller must
+        hold the file lock."""
+        temp_path = self.file_path.with_name(f"{self.file_path.name}.tmp")
+
+        with self.open_file(temp_path, "w") as file:
+            self.write_file(file)
+
+        os.replace(temp_path, self.file_path)
+        self._file_stat = self.get_file_stat(os.stat(self.file_path))
+
+    def iter_items(self):
+        """Iterate over all (key, value) pairs in the cache."""
+        return iter(list(self.items.items()))
+
+    def __getitem__(self, item):
+        return self.get(item)
+
+    def __setitem__(self, item, value):
+        return self.set(item, value)
+
+    def __contains__(self, item):
+        return self.has(item)
+
+
+class JournaledFileCache:
+    """A file-based cache that appends each new entry to a journal file rather
+    than rewriting the whole cache file on every `set`.
+
+    The cache file itself is a JSON snapshot in the same format used by
+    `FileCache`, so either class can read it. Alongside it sits a journal file
+    (the cache file path with a `.journal` suffix) containing one JSON record
+    per line: either a `[key, value]` pair, or `[key]` for a deleted entry. On load, the snapshot is read and the journal is replayed on top
+    of it. Once the journal grows past `compact_threshold` records, it is
+    compacted into a new snapshot on a background thread; the cache is also
+    compacted when it is closed, which happens automatically at interpreter
+    exit.
+
+    Every record is flushed and fsynced before `set` returns, so nothing that
+    was stored is lost if the application is killed mid-run. A record that was
+    only partially written when the process died is detected on the next load
+    and discarded, and snapshots are written to a temporary file and renamed
+    into place, so a reader never sees a torn cache file.
+
+    Several caches, in the same or different processes, can use the same file.
+    Loading and appending are done while holding the same advisory lock as
+    `FileCache`. Compaction only holds the locks long enough to copy the items
+    and read the journal, and to swap the new snapshot in; the snapshot itself
+    is written without holding either lock, so that readers and writers aren't
+    held up. Records appended while it's being written are kept in a
+    `.journal.compacting` file, which is replayed before the journal. The
+    journal is emptied in place rather than replaced, so the other caches can
+    keep appending to it.
+    """
+
+    # All of the entries are kept in memory, so lookups never touch the disk.
+    in_memory = True
+
+    def __init__(self, file_path_str: str, compact_threshold: int = 500):
+        self.file_path = Path(file_path_str)
+        self.journal_path = self.file_path.with_name(f"{self.file_path.name}.journal")
+        self.compacting_path = self.file_path.with_name(
+            f"{self.file_path.name}.journal.compacting"
+        )
+        self.lock_path = self.file_path.with_name(f"{self.file_path.name}.lock")
+        self.compact_threshold = compact_threshold
+        self.items = {}
+
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
+        self._journal = None
+
+        with FileLock(self.lock_path):
+            self._journal_records = self.load()
+            self._snapshot_id = self.get_snapshot_id()
+
+        self._journal = self.journal_path.open("a", encoding="utf-8")
+        atexit.register(self.close)
+
+    def load(self) -> int:
+        """Read the snapshot, and replay the journals on top of it. Returns the
+        number of journal records replayed. The caller must hold the file
+        lock."""
+        self.items, num_records = self.read()
+
+        return num_records
+
+    def read(self) -> tuple[dict, int]:
+        """Read the snapshot and replay the journals on top of it, without
+        changing the cache. Returns the items and the number of journal records
+        replayed. The caller must hold the file lock."""
         try:
             with self.file_path.open("r") as file:
-                self.items = json.load(file)
+                items = json.load(file)
         except (FileNotFoundError, json.decoder.JSONDecodeError):
-            pass
+            items = {}
+
+        # Records appended while the snapshot was last being written (see
+        # `compact`) are older than the ones in the journal, so they're replayed
+        # first.
+        num_records = self.replay_journal(self.compacting_path, items)
+        num_records += self.replay_journal(self.journal_path, items)
+
+        return items, num_records
+
+    def replay_journal(self, journal_path: Path, items: dict) -> int:
+        """Apply the records in the given journal file to the given items, and
+        return the number of records applied. If the journal ends with a torn
+        (partially-written) record, the journal is truncated to the last
+        complete record so that new records can be appended cleanly. The caller
+        must hold the file lock.
+        """
+        try:
+            with journal_path.open("rb") as file:
+                content = file.read()
+        except FileNotFoundError:
+            return 0
+
+        num_records = 0
+        valid_length = 0
+        for line in content.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+                if len(record) == 1:
+                    items.pop(record[0], None)
+                else:
+                    key, value = record
+                    items[key] = value
+            except (ValueError, TypeError):
+                break
+            num_records += 1
+            valid_length += len(line)
+
+        if valid_length < len(content):
+            os.truncate(journal_path, valid_length)
+
+        return num_records
 
     def get(self, key: str) -> str:
         return self.items[key]
 
     def set(self, key: str, value: str):
-        self.items[key] = value
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        """Store several entries at once, syncing the journal only once."""
+        # Serialize before touching any state; if a value isn't
+        # JSON-serializable this raises a TypeError and the cache is unchanged.
+        records = "".join(json.dumps([key, value]) + "\n" for key, value in items.items())
+
+        with self._lock:
+            self.items.update(items)
+            self.append_records(records, len(items))
+
+    def delete_many(self, keys: list[str]):
+        """Remove several entries at once, syncing the journal only once."""
+        records = "".join(json.dumps([key]) + "\n" for key in keys)
+
+        with self._lock:
+            for key in keys:
+                self.items.pop(key, None)
+            self.append_records(records, len(keys))
 
-        with self.file_path.open("w") as file:
-            json.dump(self.items, file)
+    def append_records(self, records: str, num_records: int):
+        """Append records to the journal, and compact it if it's grown too
+        large."""
+        with FileLock(self.lock_path):
+            self._journal.write(records)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        self._journal_records += num_records
+
+        if self._journal_records >= self.compact_threshold:
+            self.compact_in_background()
 
     def has(self, key: str) -> bool:
         return key in self.items
 
+    def iter_items(self):
+        """Iterate over all (key, value) pairs in the cache."""
+        with self._lock:
+            return iter(list(self.items.items()))
+
+    def compact_in_background(self):
+        """Start compacting the journal into the snapshot on a background
+        thread, unless a compaction is already running."""
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+
+            self._compaction_thread = threading.Thread(target=self.compact, daemon=True)
+            self._compaction_thread.start()
+
+    def compact(self):
+        """Merge the snapshot and journal on disk (which include any records
+        appended by other caches using the same file) into a new snapshot, and
+        empty the journal. If the application is killed at any point, replaying
+        the files that are left gives the same items."""
+        with self._compaction_lock:
+            if self._journal is None:
+                return
+
+            with self._lock:
+                items = dict(self.items)
+
+            with FileLock(self.lock_path):
+                snapshot_id = self.get_snapshot_id()
+                if snapshot_id != self._snapshot_id:
+                    # Another cache has compacted the file since this one last
+                    # read it, so its snapshot has records this one doesn't.
+                    items, _ = self.read()
+                else:
+                    # The items already include the snapshot, so only the
+                    # records appended since then need to be replayed.
+                    self.replay_journal(self.compacting_path, items)
+                    self.replay_journal(self.journal_path, items)
+                journal_length = self.get_journal_length()
+
+            temp_path = self.write_snapshot(items)
+
+            with self._lock, FileLock(self.lock_path):
+                if (
+                    self.get_snapshot_id() != snapshot_id
+                    or self.get_journal_length() < journal_length
+                ):
+                    # Another cache compacted the file while the snapshot was
+                    # being written, and its snapshot has everything in this
+                    # one.
+                    os.unlink(temp_path)
+                    return
+
+                self._journal_records = self.replace_snapshot(temp_path, journal_length)
+                self._snapshot_id = self.get_snapshot_id()
+
+                # Pick up the records appended by other caches as well, along
+                # with any appended while the snapshot was being written.
+                self.replay_journal(self.compacting_path, items)
+                self.items = items
+
+    def write_snapshot(self, items: dict) -> Path:
+        """Write the given items to a new temporary snapshot file, and return
+        its path."""
+        fd, temp_path = tempfile.mkstemp(
+            prefix=f"{self.file_path.name}.", suffix=".tmp", dir=self.file_path.parent
+        )
+
+        with os.fdopen(fd, "w") as file:
+            json.dump(items, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        return Path(temp_path)
+
+    def replace_snapshot(self, temp_path: Path, journal_length: int) -> int:
+        """Atomically replace the snapshot with the given temporary snapshot,
+        which includes the first `journal_length` bytes of the journal, and
+        empty the journal. Records appended to the journal after those are
+        moved to the compacting file. Returns the number of records moved. The
+        caller must hold the file lock."""
+        with self.journal_path.open("rb") as file:
+            file.seek(journal_length)
+            remaining_records = file.read()
+
+        os.replace(temp_path, self.file_path)
+
+        # Until the journal is emptied, it still holds the remaining records,
+        # which are replayed after (and so take precedence over) the compacting
+        # file, whichever version of it is there.
+        if len(remaining_records) > 0:
+            compacting_temp_path = self.compacting_path.with_name(
+                f"{self.compacting_path.name}.tmp"
+            )
+            with compacting_temp_path.open("wb") as file:
+                file.write(remaining_records)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(compacting_temp_path, self.compacting_path)
+        else:
+            self.compacting_path.unlink(missing_ok=True)
+
+        os.truncate(self.journal_path, 0)
+
+        return remaining_records.count(b"\n")
+
+    def get_snapshot_id(self) -> tuple | None:
+        """Return a value identifying the current snapshot file, which changes
+        whenever it's replaced, or None if there's no snapshot."""
+        try:
+            stat = self.file_path.stat()
+        except FileNotFoundError:
+            return None
+
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def get_journal_length(self) -> int:
+        try:
+            return self.journal_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def close(self):
+        """Compact the journal and close the cache. Further calls to `set` are
+        not permitted once the cache is closed."""
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+
+        if self._journal is None:
+            return
+
+        if self._journal_records > 0:
+            self.compact()
+
+        with self._lock:
+            if self._journal is None:
+                return
+
+            self._journal.close()
+            self._journal = None
+
+        atexit.unregister(self.close)
+
+    def __getitem__(self, item):
+        return self.get(item)
+
+    def __setitem__(self, item, value):
+        return self.set(item, value)
+
+    def __contains__(self, item):
+        return self.has(item)
+
+
+class SqliteCache:
+    """A cache backed by an SQLite database at the given file path, with one
+    row per cache key. Unlike the JSON-based caches, entries are looked up by
+    key on demand rather than being loaded into memory up front, so startup
+    time and memory use don't grow with the size of the cache.
+
+    The database uses write-ahead logging, and writes are committed in batches:
+    once `commit_every` entries are pending, or when the cache is flushed or
+    closed (which happens automatically at interpreter exit).
+    """
+
+    def __init__(self, file_path_str: str, commit_every: int = 50):
+        self.file_path = Path(file_path_str)
+        self.commit_every = commit_every
+        self._pending = 0
+        self._lock = threading.RLock()
+
+        self._connection = sqlite3.connect(self.file_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._connection.commit()
+
+        atexit.register(self.close)
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            raise KeyError(key)
+
+        return json.loads(row[0])
+
+    def set(self, key: str, value: str):
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        """Store several entries at once."""
+        rows = [(key, json.dumps(value)) for key, value in items.items()]
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", rows
+            )
+            self._pending += len(rows)
+
+            if self._pending >= self.commit_every:
+                self.flush()
+
+    def has(self, key: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+
+        return row is not None
+
+    def delete_many(self, keys: list[str]):
+        """Remove several entries at once."""
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM cache WHERE key = ?", [(key,) for key in keys]
+            )
+            self._pending += len(keys)
+
+            if self._pending >= self.commit_every:
+                self.flush()
+
+    def iter_items(self):
+        """Iterate over all (key, value) pairs in the cache."""
+        with self._lock:
+            rows = self._connection.execute("SELECT key, value FROM cache").fetchall()
+
+        return ((key, json.loads(value)) for key, value in rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def flush(self):
+        """Commit any pending writes to the database."""
+        with self._lock:
+            self._connection.commit()
+            self._pending = 0
+
+    def close(self):
+        """Commit any pending writes and close the database connection."""
+        with self._lock:
+            if self._connection is None:
+                return
+
+            self.flush()
+            self._connection.close()
+            self._connection = None
+
+        atexit.unregister(self.close)
+
+    def __getitem__(self, item):
+        return self.get(item)
+
+    def __setitem__(self, item, value):
+        return self.set(item, value)
+
+    def __contains__(self, item):
+        return self.has(item)
+
+
+class CompressedFileCache(FileCache):
+    """As `FileCache`, but the JSON file is gzip-compressed."""
+
+    def open_file(self, file_path: Path, mode: str):
+        return gzip.open(file_path, f"{mode}t", encoding="utf-8")
+
+
+class ShardedFileCache:
+    """A cache split across `num_shards` compressed JSON files (shards) in the
+    given directory. Each key is assigned to a shard by its hash, and each
+    shard is only loaded the first time one of its keys is looked up, so a run
+    which only needs a few entries only loads a few shards. Storing an entry
+    only rewrites the shard that it's in.
+
+    If `wrap_shard` is given, each shard is passed through it when it's loaded
+    (eg. to wrap it with a `PolicyCache`, so that each shard is expired and
+    evicted independently).
+    """
+
+    def __init__(self, dir_path_str: str, num_shards: int = 64, wrap_shard=None):
+        self.dir_path = Path(dir_path_str)
+        self.num_shards = num_shards
+        self.wrap_shard = wrap_shard
+
+        self._shards = {}
+        self._lock = threading.RLock()
+
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+
+    def get_shard_index(self, key: str) -> int:
+        key_hash = hashlib.sha1(key.encode("utf-8")).digest()
+
+        return int.from_bytes(key_hash[:4], "big") % self.num_shards
+
+    def get_shard(self, index: int):
+        """Return the shard with the given index, loading it if necessary."""
+        with self._lock:
+            if index not in self._shards:
+                shard = CompressedFileCache(self.dir_path / f"shard-{index:03d}.json.gz")
+                if self.wrap_shard is not None:
+                    shard = self.wrap_shard(shard)
+                self._shards[index] = shard
+
+            return self._shards[index]
+
+    def get_shard_for_key(self, key: str):
+        return self.get_shard(self.get_shard_index(key))
+
+    def get_num_loaded_shards(self) -> int:
+        with self._lock:
+            return len(self._shards)
+
+    def get(self, key: str):
+        with self._lock:
+            return self.get_shard_for_key(key).get(key)
+
+    def set(self, key: str, value):
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        """Store several entries at once, rewriting each affected shard once."""
+        with self._lock:
+            for index, shard_items in self.group_by_shard(items).items():
+                self.get_shard(index).set_many(
+                    {key: items[key] for key in shard_items}
+                )
+
+    def has(self, key: str) -> bool:
+        with self._lock:
+            return self.get_shard_for_key(key).has(key)
+
+    def delete_many(self, keys: list[str]):
+        """Remove several entries at once, rewriting each affected shard once."""
+        with self._lock:
+            for index, shard_keys in self.group_by_shard(keys).items():
+                self.get_shard(index).delete_many(shard_keys)
+
+    def group_by_shard(self, keys) -> dict[int, list[str]]:
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.get_shard_index(key), []).append(key)
+
+        return groups
+
+    def iter_items(self):
+        """Iterate over all (key, value) pairs in the cache. This loads every
+        shard."""
+        for index in range(self.num_shards):
+            yield from self.get_shard(index).iter_items()
+
+    def __len__(self):
+        return sum(1 for _ in self.iter_items())
+
+    def flush(self):
+        with self._lock:
+            for shard in self._shards.values():
+                if hasattr(shard, "flush"):
+                    shard.flush()
+
+    def close(self):
+        """Close all of the loaded shards."""
+        with self._lock:
+            for shard in self._shards.values():
+                if hasattr(shard, "close"):
+                    shard.close()
+            self._shards = {}
+
+    def __getitem__(self, item):
+        return self.get(item)
+
+    def __setitem__(self, item, value):
+        return self.set(item, value)
+
+    def __contains__(self, item):
+        return self.has(item)
+
+
+class TieredCache:
+    """Wraps a persistent cache (the store) with a bounded in-memory tier,
+    holding up to `max_entries` of the most recently used entries. Lookups are
+    answered from memory where possible, so that entries which are looked up
+    again and again (eg. popular videos, which appear in many ballots) only
+    pay the store's lookup cost once. Writes go through to the store
+    immediately.
+
+    If a `FetchMetrics` object is given, the hits and misses in each tier
+    ("memory" and "store") are recorded in it.
+    """
+
+    def __init__(self, store, max_entries: int = 1000, metrics=None):
+        self.store = store
+        self.max_entries = max_entries
+        self.metrics = metrics
+
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+
+    def record_lookup(self, tier: str, hit: bool):
+        if self.metrics is not None:
+            self.metrics.record_cache_tier_lookup(tier, hit)
+
+    def remember(self, key: str, value):
+        """Add an entry to the memory tier, evicting the least recently used
+        entries if it's full."""
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.record_lookup("memory", True)
+                return self._memory[key]
+
+        self.record_lookup("memory", False)
+
+        try:
+            value = self.store.get(key)
+        except KeyError:
+            self.record_lookup("store", False)
+            raise
+
+        self.record_lookup("store", True)
+
+        with self._lock:
+            self.remember(key, value)
+
+        return value
+
+    def set(self, key: str, value):
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        """Store several entries at once."""
+        self.store.set_many(items)
+
+        with self._lock:
+            for key, value in items.items():
+                self.remember(key, value)
+
+    def has(self, key: str) -> bool:
+        with self._lock:
+            if key in self._memory:
+                return True
+
+        return self.store.has(key)
+
+    def delete_many(self, keys: list[str]):
+        """Remove several entries at once."""
+        with self._lock:
+            for key in keys:
+                self._memory.pop(key, None)
+
+        self.store.delete_many(keys)
+
+    def iter_items(self):
+        """Iterate over all (key, value) pairs in the store."""
+        return self.store.iter_items()
+
+    def flush(self):
+        if hasattr(self.store, "flush"):
+            self.store.flush()
+
+    def close(self):
+        """Close the store."""
+        with self._lock:
+            self._memory.clear()
+
+        if hasattr(self.store, "close"):
+            self.store.close()
+
+    def __getitem__(self, item):
+        return self.get(item)
+
+    def __setitem__(self, item, value):
+        return self.set(item, value)
+
+    def __contains__(self, item):
+        return self.has(item)
+
+
+class PolicyCache:
+    """Wraps another cache (of any of the above kinds) to expire and evict
+    entries, so that the cache doesn't grow forever or serve stale data.
+
+    Each value is stored in the wrapped cache inside an envelope recording when
+    it was stored and when it was last accessed:
+
+        {"value": ..., "stored": 1700000000.0, "accessed": 1700000000.0}
+
+    Entries expire once they're older than the TTL (in seconds) for their cache
+    key, looked up in `ttls` by the longest matching key prefix (eg. "youtube"
+    for "youtube-9RT4lfvVFhA"), or `default_ttl` if no prefix matches. Expired
+    entries are treated as missing, and removed when they're next looked up. If
+    there are more than `max_entries` entries, or they take up more than
+    `max_bytes` bytes (as JSON), the least recently accessed entries are
+    evicted. Any limit can be None to disable it.
+
+    Lookups are passed through to the wrapped cache, and an entry's envelope is
+    only read when the entry is first looked up, so the policy never needs to
+    load the whole wrapped cache just to be used. Enforcing the size limits does
+    require reading every entry, so it's only done by `evict`, which is called
+    when the cache is closed if any entries were stored since it was opened.
+    Expired entries that haven't been looked up are also removed then.
+
+    To keep lookups cheap, access times are kept in memory and only written
+    back when the cache is flushed or closed (which happens automatically at
+    interpreter exit), and only if they've changed by at least
+    `access_resolution` seconds. Values stored before the policy was in use
+    are wrapped in envelopes when they're next written back, as if they had
+    just been stored.
+    """
+
+    access_resolution = 3600
+
+    def __init__(
+        self,
+        cache,
+        max_entries: int = None,
+        max_bytes: int = None,
+        ttls: dict[str, float] = None,
+        default_ttl: float = None,
+        clock=time.time,
+    ):
+        self.cache = cache
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.clock = clock
+
+        # When each entry that's been looked up or stored was stored and last
+        # accessed, read from its envelope the first time it's needed, from
+        # least to most recently accessed.
+        self._entries = OrderedDict()
+        self._dirty_keys = set()
+        self._needs_eviction = False
+        self._lock = threading.RLock()
+
+        atexit.register(self.close)
+
+    @staticmethod
+    def is_envelope(value) -> bool:
+        return isinstance(value, dict) and value.keys() == {
+            "value",
+            "stored",
+            "accessed",
+        }
+
+    @staticmethod
+    def create_envelope(value, now: float) -> dict:
+        return {"value": value, "stored": now, "accessed": now}
+
+    def get_ttl(self, key: str) -> float | None:
+        """Return the TTL in seconds for entries with the given key."""
+        matching_prefixes = [
+            prefix for prefix in self.ttls if key.startswith(f"{prefix}-")
+        ]
+        if len(matching_prefixes) == 0:
+            return self.default_ttl
+
+        return self.ttls[max(matching_prefixes, key=len)]
+
+    def is_expired(self, key: str, stored: float, now: float) -> bool:
+        ttl = self.get_ttl(key)
+
+        return ttl is not None and now - stored > ttl
+
+    def get_envelope(self, key: str) -> dict:
+        """Return the envelope for an entry in the wrapped cache (see
+        `to_envelope`)."""
+        return self.to_envelope(key, self.cache.get(key))
+
+    def to_envelope(self, key: str, value) -> dict:
+        """Return the envelope for a value read from the wrapped cache, wrapping
+        the value in one if it was stored without the policy. Values without
+        envelopes are treated as stored when they were first looked up."""
+        if self.is_envelope(value):
+            return value
+
+        if key not in self._entries:
+            self._entries[key] = {"stored": self.clock(), "accessed": self.clock()}
+            self._dirty_keys.add(key)
+        entry = self._entries[key]
+
+        return {"value": value, "stored": entry["stored"], "accessed": entry["accessed"]}
+
+    def forget(self, key: str):
+        """Forget the metadata for an entry that's no longer in the wrapped
+        cache."""
+        self._entries.pop(key, None)
+        self._dirty_keys.discard(key)
+
+    def check_expiry(self, key: str) -> dict | None:
+        """Return the metadata for an entry whose metadata has already been
+        read, or remove the entry from the wrapped cache and return None if it
+        has expired."""
+        entry = self._entries[key]
+        if self.is_expired(key, entry["stored"], self.clock()):
+            self.delete_many([key])
+            return None
+
+        return entry
+
+    def lookup(self, key: str) -> dict | None:
+        """Read an entry from the wrapped cache (once), and return its envelope
+        if it hasn't expired. The entry's metadata is read from the envelope if
+        it hasn't been looked up before. Expired entries are removed from the
+        wrapped cache, and None is returned."""
+        try:
+            value = self.cache.get(key)
+        except KeyError:
+            self.forget(key)
+            return None
+
+        envelope = self.to_envelope(key, value)
+        if key not in self._entries:
+            self._entries[key] = {
+                "stored": envelope["stored"],
+                "accessed": envelope["accessed"],
+            }
+
+        if self.check_expiry(key) is None:
+            return None
+
+        return envelope
+
+    def has(self, key: str) -> bool:
+        with self._lock:
+            # Once an entry's metadata is known, its value doesn't need to be
+            # read to check it.
+            if key in self._entries:
+                if not self.cache.has(key):
+                    self.forget(key)
+                    return False
+
+                return self.check_expiry(key) is not None
+
+            return self.lookup(key) is not None
+
+    def get(self, key: str):
+        with self._lock:
+            if (envelope := self.lookup(key)) is None:
+                raise KeyError(key)
+
+            value = envelope["value"]
+            entry = self._entries[key]
+
+            # Mark the entry as the most recently accessed.
+            self._entries.move_to_end(key)
+            now = self.clock()
+            if now - entry["accessed"] >= self.access_resolution:
+                entry["accessed"] = now
+                self._dirty_keys.add(key)
+
+            return value
+
+    def set(self, key: str, value):
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        """Store several entries at once."""
+        now = self.clock()
+        envelopes = {
+            key: self.create_envelope(value, now) for key, value in items.items()
+        }
+
+        with self._lock:
+            self.cache.set_many(envelopes)
+
+            for key in envelopes:
+                self._entries.pop(key, None)
+                self._entries[key] = {"stored": now, "accessed": now}
+                self._dirty_keys.discard(key)
+            self._needs_eviction = True
+
+    def delete_many(self, keys: list[str]):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._dirty_keys.discard(key)
+
+            if len(keys) > 0:
+                self.cache.delete_many(keys)
+
+    def evict(self):
+        """Remove expired entries, and evict the least recently accessed entries
+        until the cache is within its limits. This reads every entry in the
+        wrapped cache."""
+        with self._lock:
+            now = self.clock()
+            expired_keys = []
+            entries = []
+            total_bytes = 0
+
+            # Entries with the same access time are ordered by when they were
+            # last accessed in this session, if they have been.
+            session_order = {key: index for index, key in enumerate(self._entries)}
+
+            for key, value in self.cache.iter_items():
+                value = self.to_envelope(key, value)
+                entry = self._entries.get(key, value)
+
+                if self.is_expired(key, entry["stored"], now):
+                    expired_keys.append(key)
+                    continue
+
+                size = len(json.dumps(value))
+                entries.append(
+                    (entry["accessed"], session_order.get(key, -1), key, size)
+                )
+                total_bytes += size
+
+            # Evict from the least recently accessed entry onwards.
+            entries.sort()
+            num_evicted = 0
+            while num_evicted < len(entries) and (
+                (
+                    self.max_entries is not None
+                    and len(entries) - num_evicted > self.max_entries
+                )
+                or (self.max_bytes is not None and total_bytes > self.max_bytes)
+            ):
+                total_bytes -= entries[num_evicted][3]
+                num_evicted += 1
+            evicted_keys = [entry[2] for entry in entries[:num_evicted]]
+
+            self.delete_many(expired_keys + evicted_keys)
+            self._needs_eviction = False
+
+    def iter_items(self):
+        """Iterate over the (key, value) pairs of entries which haven't
+        expired, without marking them as accessed. This reads every entry in
+        the wrapped cache."""
+        with self._lock:
+            keys = [key for key, _ in self.cache.iter_items()]
+
+        for key in keys:
+            with self._lock:
+                if (envelope := self.lookup(key)) is None:
+                    continue
+
+            yield key, envelope["value"]
+
+    def __len__(self):
+        return sum(1 for _ in self.iter_items())
+
+    def flush(self):
+        """Write any changed access times back to the wrapped cache, and flush
+        it."""
+        with self._lock:
+            envelopes = {}
+            for key in self._dirty_keys:
+                if not self.cache.has(key):
+                    continue
+                envelope = dict(self.get_envelope(key))
+                envelope["accessed"] = self._entries[key]["accessed"]
+                envelopes[key] = envelope
+
+            if len(envelopes) > 0:
+                self.cache.set_many(envelopes)
+            self._dirty_keys.clear()
+
+            if hasattr(self.cache, "flush"):
+                self.cache.flush()
+
+    def close(self):
+        """Evict entries if any were stored, then flush and close the wrapped
+        cache."""
+        with self._lock:
+            if self.cache is None:
+                return
+
+            if self._needs_eviction and (
+                self.max_entries is not None or self.max_bytes is not None
+            ):
+                self.evict()
+
+            self.flush()
+            if hasattr(self.cache, "close"):
+                self.cache.close()
+            self.cache = None
+
+        atexit.unregister(self.close)
+
     def __getitem__(self, item):
         return self.get(item)
 
@@ -35,3 +35,14 @@ class VideoUnavailableError(Exception):
     """
 
     pass
+
+
+class RateLimitedError(FetchRequestError):
+    """Raised when a service refuses a request because too many requests have
+    been made to it (eg. with an HTTP 429 response). `retry_after` is the number
+    of seconds the service asked us to wait before trying again, if it said.
+    """
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -1,28 +1,114 @@
 """Video data fetching services. To add a new service (eg. to fetch from a
 different site), create a class that implements the `can_fetch`, `request`,
-and `parse` methods."""
-
-import re, pytz, hashlib, requests
+and `parse` methods.
+
+The fetcher caches the parsed video data along with the service's
+`cache_version`. If the output of a service's `parse` method changes, increase
+its `cache_version`, and implement `migrate(video_data, version)` to convert
+parsed video data cached by an older version; otherwise, cached video data for
+the service is requested again."""
+
+import re, json, pytz, hashlib, requests, atexit, queue, threading, multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import cached_property
 from datetime import datetime
 from urllib.parse import urlparse
-from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from yt_dlp import YoutubeDL
 from functions.date import convert_iso8601_duration_to_seconds
-from functions.url import normalize_youtube_url, normalize_derpibooru_url
+from functions.url import (
+    normalize_youtube_url,
+    normalize_derpibooru_url,
+    is_url_on_domain,
+)
 from functions.messages import err
 from data.globals import ydl_opts
-from classes.exceptions import FetchRequestError, FetchParseError, VideoUnavailableError
+from classes.exceptions import (
+    FetchRequestError,
+    FetchParseError,
+    VideoUnavailableError,
+    RateLimitedError,
+)
 from classes.typing import VideoData
 from functions.messages import inf
+from functions import ytdlp_workers
+
+
+# HTTP status codes which indicate that a service is refusing our requests
+# because we've made too many of them.
+rate_limit_statuses = [403, 429]
+
+# Reasons given in YouTube Data API error responses for requests refused because
+# too many were made in a short time. The API also refuses requests with a 403
+# status once the daily quota is used up ("quotaExceeded",
+# "dailyLimitExceeded"), or if the API key is invalid or restricted, which
+# retrying won't fix.
+youtube_rate_limit_reasons = ["rateLimitExceeded", "userRateLimitExceeded"]
+
+
+def get_youtube_error_reason(content) -> str | None:
+    """Return the reason given by a YouTube Data API error response's body (as
+    bytes, text or decoded JSON), or None if it doesn't give one."""
+    try:
+        if isinstance(content, (bytes, str)):
+            content = json.loads(content)
+
+        return content["error"]["errors"][0]["reason"]
+    except (ValueError, TypeError, KeyError, IndexError):
+        return None
+
+
+def get_retry_after(headers) -> float | None:
+    """Return the number of seconds to wait given by a Retry-After header, if
+    there is one (and it's given in seconds rather than as a date)."""
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
 
 
 class YouTubeFetchService:
     """Fetch service for YouTube video data. Requires a YouTube Data API key when fetching video data."""
 
+    max_concurrency = 8
+    domains = ["youtube.com", "youtu.be"]
+    cache_version = 1
+
+    # Maximum number of video ids the YouTube Data API accepts in a single
+    # videos.list request.
+    batch_size = 50
+
+    api_parts = "status,snippet,contentDetails"
+
+    # Number of units of API quota used by a videos.list request, however many
+    # videos it's for.
+    quota_cost = 1
+    quota_ledger = None
+
     def __init__(self, api_key: str = None):
-        # Create the YouTube Data API service.
-        if api_key:
-            self.yt_service = build("youtube", "v3", developerKey=api_key)
+        self.api_key = api_key
+
+    @cached_property
+    def yt_service(self):
+        """The YouTube Data API service, created when it's first used (the API
+        client library is slow to import). The API's discovery document is
+        loaded from the copy bundled with the client library, rather than being
+        downloaded."""
+        from googleapiclient.discovery import build
+
+        if not self.api_key:
+            raise FetchRequestError(
+                "Could not create the YouTube Data API service; no API key was given"
+            )
+
+        return build(
+            "youtube",
+            "v3",
+            developerKey=self.api_key,
+            static_discovery=True,
+            cache_discovery=False,
+        )
 
     def extract_video_id(self, url: str) -> str:
         """Given a YouTube video URL, extract the video id from it, or None if
@@ -36,7 +122,53 @@ class YouTubeFetchService:
         return video_id
 
     def can_fetch(self, url: str) -> bool:
-        return "youtube.com" in url or "youtu.be" in url
+        return is_url_on_domain(url, self.domains)
+
+    def set_quota_ledger(self, quota_ledger):
+        """Record the API quota used by requests in the given ledger."""
+        self.quota_ledger = quota_ledger
+
+    def spend_quota(self):
+        if self.quota_ledger is not None:
+            self.quota_ledger.spend(self.quota_cost)
+
+    def execute(self, request, description: str) -> dict:
+        """Execute a YouTube Data API request, recording the quota it uses."""
+        self.spend_quota()
+
+        try:
+            return request.execute()
+        except HttpError as e:
+            self.check_error_status(e.resp.status, e.resp, e.content, description)
+
+            raise FetchRequestError(
+                f"Could not request {description} via the YouTube Data API; error while executing request: {e}"
+            ) from e
+        except Exception as e:
+            raise FetchRequestError(
+                f"Could not request {description} via the YouTube Data API; error while executing request: {e}"
+            ) from e
+
+    def check_error_status(self, status: int, headers, content, description: str):
+        """Raise a `RateLimitedError` if a YouTube Data API error response shows
+        that we're being rate limited, so the request can be retried later, or
+        a `FetchRequestError` if it shows that the request was refused for
+        another reason that retrying won't fix (eg. the quota being used up,
+        or an invalid API key)."""
+        if status not in rate_limit_statuses:
+            return
+
+        reason = get_youtube_error_reason(content)
+
+        if status == 429 or reason in youtube_rate_limit_reasons:
+            raise RateLimitedError(
+                f"Could not request {description} via the YouTube Data API; rate limited (status code {status})",
+                get_retry_after(headers),
+            )
+
+        raise FetchRequestError(
+            f"Could not request {description} via the YouTube Data API; request refused (status code {status}, reason: {reason})"
+        )
 
     def request(self, url: str) -> VideoData:
         """Query the YouTube Data API for the given URL."""
@@ -46,19 +178,14 @@ class YouTubeFetchService:
                 f'Could not request URL "{url}" via the YouTube Data API; unable to determine video id from URL'
             )
 
-        request = self.yt_service.videos().list(
-            part="status,snippet,contentDetails", id=video_id
-        )
-
-        response = None
+        request = self.yt_service.videos().list(part=self.api_parts, id=video_id)
+        response = self.execute(request, f'URL "{url}"')
 
-        try:
-            response = request.execute()
-        except Exception as e:
-            raise FetchRequestError(
-                f'Could not request URL "{url}" via the YouTube Data API; error while executing request: {e}'
-            ) from e
+        return self.get_response_video_data(url, response)
 
+    def get_response_video_data(self, url: str, response: dict) -> VideoData:
+        """Return video data from a YouTube Data API response to a request for a
+        single video."""
         if response is None:
             raise FetchRequestError(
                 f'Could not request URL "{url}" via the YouTube Data API; no API response'
@@ -69,7 +196,79 @@ class YouTubeFetchService:
                 f"Response from YouTube Data API does not contain any items"
             )
 
-        response_item = response["items"][0]
+        return self.get_video_data(response["items"][0])
+
+    def request_batch(self, urls: list[str]) -> dict[str, VideoData | Exception]:
+        """Query the YouTube Data API for up to `batch_size` URLs with a single
+        request, which costs the same amount of quota as requesting just one.
+        Returns a dictionary mapping each URL to its video data, or to the
+        exception for that URL if its data couldn't be retrieved."""
+        results, video_ids = self.get_batch_video_ids(urls)
+        unique_video_ids = list(dict.fromkeys(video_ids.values()))
+
+        if len(unique_video_ids) == 0:
+            return results
+
+        request = self.yt_service.videos().list(
+            part=self.api_parts,
+            id=",".join(unique_video_ids),
+            maxResults=self.batch_size,
+        )
+        response = self.execute(request, f"{len(unique_video_ids)} videos")
+
+        return self.get_batch_results(results, video_ids, response)
+
+    def get_batch_video_ids(
+        self, urls: list[str]
+    ) -> tuple[dict[str, Exception], dict[str, str]]:
+        """Extract the video ids for a batch request. Returns a dictionary of
+        errors for URLs without video ids, and a dictionary mapping the other
+        URLs to their video ids."""
+        results = {}
+        video_ids = {}
+
+        for url in urls:
+            video_id = self.extract_video_id(url)
+            if video_id is None:
+                results[url] = ValueError(
+                    f'Could not request URL "{url}" via the YouTube Data API; unable to determine video id from URL'
+                )
+            else:
+                video_ids[url] = video_id
+
+        unique_video_ids = set(video_ids.values())
+        if len(unique_video_ids) > self.batch_size:
+            raise ValueError(
+                f"Could not request {len(unique_video_ids)} videos via the YouTube Data API; at most {self.batch_size} can be requested at once"
+            )
+
+        return results, video_ids
+
+    def get_batch_results(
+        self, results: dict, video_ids: dict[str, str], response: dict
+    ) -> dict[str, VideoData | Exception]:
+        """Add the video data from a YouTube Data API response to a batch
+        request to the given results, and return them."""
+        if response is None:
+            raise FetchRequestError(
+                f"Could not request {len(video_ids)} videos via the YouTube Data API; no API response"
+            )
+
+        response_items = {item["id"]: item for item in response.get("items", [])}
+
+        for url, video_id in video_ids.items():
+            if video_id in response_items:
+                results[url] = self.get_video_data(response_items[video_id])
+            else:
+                results[url] = VideoUnavailableError(
+                    f'Response from YouTube Data API does not contain an item for video id "{video_id}"'
+                )
+
+        return results
+
+    def get_video_data(self, response_item: dict) -> VideoData:
+        """Return video data from an item in a YouTube Data API videos.list
+        response."""
         snippet = response_item["snippet"]
         iso8601_duration = response_item["contentDetails"]["duration"]
 
@@ -98,11 +297,26 @@ class YouTubeFetchService:
 class DerpibooruFetchService:
     """Fetch service for Derpibooru video data."""
 
+    max_concurrency = 4
+    domains = ["derpibooru.org"]
+    cache_version = 1
+    metrics = None
+    http_session = None
+
+    def set_http_session(self, http_session: requests.Session):
+        """Make requests with the given session, reusing its connections."""
+        self.http_session = http_session
+
+    def set_metrics(self, metrics, service_name: str):
+        """Record the size of API responses in the given fetch metrics."""
+        self.metrics = metrics
+        self.service_name = service_name
+
     def can_fetch(self, url: str) -> bool:
-        return "derpibooru.org" in url
+        return is_url_on_domain(url, self.domains)
 
-    def request(self, url: str) -> VideoData:
-        """Query the Derpibooru API for the given URL."""
+    def get_post_id(self, url: str) -> str:
+        """Return the post id from a Derpibooru URL."""
         url = normalize_derpibooru_url(url)
 
         id_match = re.search("derpibooru.org/images/([0-9]+)", url)
@@ -111,12 +325,18 @@ class DerpibooruFetchService:
             raise ValueError(
                 f'Could not request URL "{url}" via the Derpibooru Data API; unable to determine video id from URL'
             )
-        
-        post_id = id_match.group(1)
+
+        return id_match.group(1)
+
+    def request(self, url: str) -> VideoData:
+        """Query the Derpibooru API for the given URL."""
+        post_id = self.get_post_id(url)
         response = None
 
         try:
-            response = requests.get(f"https://derpibooru.org/api/v1/json/images/{post_id}")
+            response = (self.http_session or requests).get(
+                f"https://derpibooru.org/api/v1/json/images/{post_id}"
+            )
         except requests.exceptions.ContentDecodingError as e:
             raise FetchRequestError(
                 f'Could not request URL "{url}" via the Derpibooru API; invalid post id'
@@ -126,13 +346,24 @@ class DerpibooruFetchService:
                 f'Could not request URL "{url}" via the Derpibooru API'
             ) from e
         
+        if self.metrics is not None:
+            self.metrics.record_bytes(self.service_name, len(response.content))
+
+        if response.status_code in rate_limit_statuses:
+            raise RateLimitedError(
+                f'Could not request URL "{url}" via the Derpibooru API; rate limited (status code {response.status_code})',
+                get_retry_after(response.headers),
+            )
+
         if response.status_code != 200:
             raise FetchRequestError(
                 f'Could not request URL "{url}" via the Derpibooru API; received status code {response.status_code}'
             )
 
-        response = response.json()["image"]
+        return self.get_video_data(post_id, response.json()["image"])
 
+    def get_video_data(self, post_id: str, response: dict) -> VideoData:
+        """Return video data from the image in a Derpibooru API response."""
         return {
             "title": f"Derpibooru post #{post_id}",
             "uploader": response.get("uploader"),
@@ -155,19 +386,148 @@ class DerpibooruFetchService:
         }
 
 
+class YoutubeDLPool:
+    """A pool of long-lived `YoutubeDL` instances. Creating a `YoutubeDL`
+    instance involves validating its options, loading the cookie jar and
+    initializing extractors, so instances are reused between requests rather
+    than created for each one. Each instance is only used by one thread at a
+    time; use `checkout` to borrow an instance from the pool.
+
+    Instances are created as they're needed, up to `size`; if all of them are in
+    use, `checkout` waits for one to be returned. The pool is closed at
+    interpreter exit.
+    """
+
+    def __init__(self, options: dict, size: int):
+        self.options = options
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._instances = []
+        self._lock = threading.Lock()
+
+        atexit.register(self.close)
+
+    @contextmanager
+    def checkout(self):
+        """Context manager which borrows a `YoutubeDL` instance from the pool
+        and returns it when the block exits."""
+        ydl = self.acquire()
+        try:
+            yield ydl
+        finally:
+            self.release(ydl)
+
+    def acquire(self) -> YoutubeDL:
+        """Take a `YoutubeDL` instance from the pool, creating one if none are
+        idle and the pool isn't full. Instances taken with `acquire` must be
+        given back with `release`."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._instances) < self.size:
+                ydl = YoutubeDL(self.options)
+                self._instances.append(ydl)
+                return ydl
+
+        return self._idle.get()
+
+    def release(self, ydl: YoutubeDL):
+        """Return a `YoutubeDL` instance to the pool."""
+        self._idle.put(ydl)
+
+    def extract_info(self, url: str) -> dict:
+        """Extract video info for the given URL using one of the pool's
+        instances."""
+        with self.checkout() as ydl:
+            return ydl.extract_info(url, download=False)
+
+    def close(self):
+        """Close all of the pool's `YoutubeDL` instances."""
+        with self._lock:
+            for ydl in self._instances:
+                ydl.close()
+
+            self._instances = []
+            self._idle = queue.LifoQueue()
+
+        atexit.unregister(self.close)
+
+
+class YoutubeDLProcessPool:
+    """A pool of worker processes which run yt-dlp extraction. Much of yt-dlp's
+    extraction work is CPU-bound and holds the GIL, so unlike `YoutubeDLPool`,
+    this allows extraction to make use of multiple cores. Each worker process
+    has its own `YoutubeDL` instance, and sends results back as plain
+    (sanitized) dictionaries.
+
+    Worker processes are started with the "spawn" method on all platforms, so
+    the application's entry point must not create any windows at import time.
+    The pool is shut down at interpreter exit.
+    """
+
+    def __init__(self, options: dict, workers: int):
+        self.options = options
+        self.size = workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=ytdlp_workers.init_worker,
+            initargs=(options,),
+        )
+
+        atexit.register(self.close)
+
+    def submit(self, url: str) -> Future:
+        """Start extracting video info for the given URL in a worker process,
+        and return a future for the result."""
+        return self._executor.submit(ytdlp_workers.extract_info, url)
+
+    def extract_info(self, url: str) -> dict:
+        """Extract video info for the given URL in a worker process, waiting for
+        the result."""
+        return self.submit(url).result()
+
+    def close(self):
+        """Shut down the worker processes."""
+        self._executor.shutdown(cancel_futures=True)
+        atexit.unregister(self.close)
+
+
 class YtDlpFetchService:
     """Fetch service which makes requests for video data via yt-dlp."""
 
-    def __init__(self, accepted_domains: list[str]):
+    # yt-dlp scrapes the sites it fetches from, which are quicker to throttle
+    # or block us than an API would be, so keep the number of simultaneous
+    # requests low.
+    max_concurrency = 2
+    cache_version = 1
+
+    def __init__(
+        self,
+        accepted_domains: list[str],
+        ydl_pool: YoutubeDLPool | YoutubeDLProcessPool = None,
+    ):
         self.accepted_domains = accepted_domains
+
+        # The pool is shared with services that delegate to this one (eg.
+        # bilibili), so by default it's sized to allow for their requests too.
+        self.ydl_pool = ydl_pool if ydl_pool is not None else YoutubeDLPool(ydl_opts, 4)
+
         if "cookiefile" not in ydl_opts:
             inf("Note: Couldn't find data/cookies.txt file. Some requests may yield no data.")
 
+    @property
+    def domains(self) -> list[str]:
+        return self.accepted_domains
+
     def can_fetch(self, url: str) -> bool:
-        """Return True if the URL contains an accepted domain (other than
+        """Return True if the URL is on an accepted domain (other than
         YouTube)."""
 
-        return any(domain in url for domain in self.accepted_domains)
+        return is_url_on_domain(url, self.accepted_domains)
 
     def request(self, url: str) -> VideoData:
         """Query yt-dlp for the given URL."""
@@ -177,13 +537,22 @@ class YtDlpFetchService:
         site = site[0] if len(site) == 2 else site[1]
 
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                response = ydl.extract_info(url, download=False)
+            response = self.ydl_pool.extract_info(url)
 
-                if "entries" in response:
-                    response = response["entries"][0]
+            if "entries" in response:
+                response = response["entries"][0]
 
         except Exception as e:
+            if self.is_rate_limit_error(e):
+                raise RateLimitedError(
+                    f'Could not fetch URL "{url}" via yt-dlp; rate limited: {e}'
+                ) from e
+
+            if self.is_unavailable_error(e):
+                raise VideoUnavailableError(
+                    f'Could not fetch URL "{url}" via yt-dlp; video is unavailable: {e}'
+                ) from e
+
             raise FetchRequestError(
                 f'Could not fetch URL "{url}" via yt-dlp; error while extracting video info: {e}'
             ) from e
@@ -249,6 +618,25 @@ class YtDlpFetchService:
             "platform": site.capitalize(),
         }
 
+    def is_rate_limit_error(self, error: Exception) -> bool:
+        """Return True if a yt-dlp extraction error was caused by the site rate
+        limiting us. (403 responses aren't counted, since sites also use them
+        for private or region-blocked videos.)"""
+        return re.search(r"HTTP Error 429|rate.?limit", str(error), re.IGNORECASE) is not None
+
+    def is_unavailable_error(self, error: Exception) -> bool:
+        """Return True if a yt-dlp extraction error means that the video can't
+        be fetched at all (eg. it's private or has been removed), rather than
+        that the request failed."""
+        return (
+            re.search(
+                r"Video unavailable|Private video|video is private|removed|HTTP Error 404",
+                str(error),
+                re.IGNORECASE,
+            )
+            is not None
+        )
+
     def parse(self, video_data) -> VideoData:
         # yt-dlp doesn't provide any timezone information with its timestamps,
         # but according to its source code, it looks like it uses UTC:
@@ -277,33 +665,83 @@ class YtDlpFetchService:
 class BilibiliFetchService:
     """Fetch service for bilibili and variant links."""
 
+    max_concurrency = 2
+    domains = ["b23.tv", "bilibili.com"]
+    cache_version = 1
+    metrics = None
+    http_session = None
+
     def __init__(self, ytdlp_fetch_service: YtDlpFetchService):
         self.ytdlp_fetch_service = ytdlp_fetch_service
 
+    def set_http_session(self, http_session: requests.Session):
+        """Resolve b23.tv links with the given session, reusing its
+        connections."""
+        self.http_session = http_session
+
+    def set_metrics(self, metrics, service_name: str):
+        """Record the size of b23.tv redirect responses in the given fetch
+        metrics."""
+        self.metrics = metrics
+        self.service_name = service_name
+
     def can_fetch(self, url: str) -> bool:
-        return "b23.tv" in url or "bilibili.com" in url
+        return is_url_on_domain(url, self.domains)
 
     def request(self, url: str) -> VideoData:
         """Perform an intermediary step of getting the true video url from the
         b23.tv redirects or from playlist links before requesting using yt-dlp."""
 
+        if self.is_short_link(url):
+            video_url = self.resolve_short_link(url)
+        else:
+            video_url = self.get_video_url(url)
+
+        return self.ytdlp_fetch_service.request(video_url)
+
+    def is_short_link(self, url: str) -> bool:
+        """Return True if the URL is a b23.tv share link, which must be resolved
+        to find the video it links to."""
+        return re.search(r"b23\.tv/([0-9a-zA-Z]+)", url) is not None
+
+    def resolve_short_link(self, url: str) -> str:
+        """Return the bilibili video URL that a b23.tv share link redirects
+        to."""
         if id_match := re.search(r"b23\.tv/([0-9a-zA-Z]+)", url):
             share_id = id_match.group(1)
 
-            response = requests.get(f"https://b23.tv/{share_id}", allow_redirects=False)
+            response = (self.http_session or requests).get(
+                f"https://b23.tv/{share_id}", allow_redirects=False
+            )
+
+            if self.metrics is not None:
+                self.metrics.record_bytes(self.service_name, len(response.content))
+
+            if response.status_code in rate_limit_statuses:
+                raise RateLimitedError(
+                    f"Could not resolve {url}; rate limited (status code {response.status_code})",
+                    get_retry_after(response.headers),
+                )
 
             if response.status_code != 302:
                 raise VideoUnavailableError(f"No video link was returned by {url}")
             
-            video_url = re.sub(r"\?.+", "", response.next.url) # remove unnecessary tracking params
-        elif id_match := re.search(r"bilibili\.com/video/([a-zA-Z0-9]+)", url) or re.search(r"bvid=([A-Za-z0-9]+)", url):
-            video_url = f"https://www.bilibili.com/video/{id_match.group(1)}"
-        else:
-            raise ValueError(
-                f'Could not request URL "{url}"; unable to determine video id from URL'
-            )
+            return self.strip_tracking_params(response.next.url)
 
-        return self.ytdlp_fetch_service.request(video_url)
+        raise ValueError(f'Could not resolve URL "{url}"; not a b23.tv share link')
+
+    def get_video_url(self, url: str) -> str:
+        """Return the bilibili video URL for a video or playlist link."""
+        if id_match := re.search(r"bilibili\.com/video/([a-zA-Z0-9]+)", url) or re.search(r"bvid=([A-Za-z0-9]+)", url):
+            return f"https://www.bilibili.com/video/{id_match.group(1)}"
+
+        raise ValueError(
+            f'Could not request URL "{url}"; unable to determine video id from URL'
+        )
+
+    def strip_tracking_params(self, url: str) -> str:
+        """Remove the unnecessary tracking parameters from a b23.tv redirect."""
+        return re.sub(r"\?.+", "", url)
 
     def parse(self, video_data) -> VideoData:
         """Parse video data using the yt-dlp fetch service."""
@@ -1,5 +1,17 @@
-from classes.exceptions import UnsupportedHostError
-from functions.manual_input import resolve
+import threading, time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from classes.exceptions import (
+    UnsupportedHostError,
+    VideoUnavailableError,
+    RateLimitedError,
+)
+from functions.manual_input import resolve_many
+from functions.url import get_video_identity, get_domain_suffixes, get_url_host
+from classes.metrics import FetchMetrics
+from classes.single_flight import SingleFlight
+from classes.http_session import PooledSession
 
 
 class Fetcher:
@@ -7,16 +19,95 @@ class Fetcher:
     runtime. To configure the fetcher, use `add_service` to register
     `FetchService` objects; the fetcher will then use these to handle fetch
     requests.
+
+    Services which declare the domains they handle (as a `domains` attribute)
+    are found by looking up the URL's hostname in an index, rather than by
+    asking every service whether it can fetch the URL. Other services are
+    queried with their `can_fetch` method as before.
+
+    The fetcher is safe to use from multiple threads. Each service has a limit
+    on the number of requests that may be in progress for it at once, which can
+    be given when the service is added, or declared by the service itself as a
+    `max_concurrency` attribute. If a video is requested while a request for
+    the same video (ie. with the same cache key) is already in progress, the
+    second caller waits for the first request's result rather than making
+    another one.
+
+    Short links (eg. b23.tv share links) are resolved to the canonical URLs
+    they redirect to before fetching, by services which have
+    `is_short_link` and `resolve_short_link` methods. Resolved links are stored
+    in the cache, so each short link only needs to be resolved once.
+
+    Services which make plain HTTP requests (ie. which have a
+    `set_http_session` method) are given the fetcher's HTTP session, so that
+    they all reuse the same pool of keep-alive connections. The session's pool
+    is sized to fit the number of requests that can be in progress at once.
+
+    Services can also be given a rate limiter (see `set_rate_limiter`), which
+    limits how quickly requests are made via the service, and retries requests
+    after a delay if the service reports that it's being rate limited.
     """
 
+    default_max_concurrency = 4
+
+    # Number of times a request is retried after the service reports that it's
+    # being rate limited, if the service has a rate limiter.
+    rate_limit_retries = 3
+
+    # The version of the format of cached video data. Entries without a
+    # version hold the unparsed video data returned by a service's `request`
+    # method, which has to be parsed every time it's loaded. Current entries
+    # hold the parsed video data in compact form (see `encode_video_data`),
+    # along with the version of the service that produced it (its
+    # `cache_version` attribute, or 1 if it has none).
+    cache_schema_version = 2
+
+    # The fields of parsed video data, in the order they're stored in cache
+    # entries.
+    video_data_fields = ["title", "uploader", "upload_date", "duration", "platform"]
+
+    # Number of migrated cache entries to collect before writing them to the
+    # cache together.
+    migration_batch_size = 100
+
+    # Errors which can be recorded in the cache as negative entries, so that
+    # known-bad URLs aren't requested again until the entry expires. Only
+    # errors which say that the video itself can't be fetched are included;
+    # errors that may be temporary or caused by the configuration (eg. a
+    # timeout, a server error or a missing API key) are never cached.
+    negative_cacheable_errors = {
+        "VideoUnavailableError": VideoUnavailableError,
+    }
+
     def __init__(self):
         self._services = {}
+        self._domain_index = {}
+        self._unindexed_services = []
+        self._routes = {}
+        self._service_limits = {}
+        self._service_semaphores = {}
+        self._rate_limiters = {}
+        self._http_session = PooledSession()
         self._cache = None
         self._printer = None
+        self._metrics = FetchMetrics()
         self._prompt_on_missing_data = False
+        self._negative_ttls = {}
+        self._recheck_keys = set()
+        self._short_link_errors = {}
+        self._in_flight = SingleFlight()
 
-    def add_service(self, name: str, fetch_service):
-        """Add a fetch service to the fetcher."""
+        self._cache_lock = threading.RLock()
+        self._missing_data = {}
+        self._missing_data_lock = threading.Lock()
+        self._migrated_entries = {}
+
+    def add_service(self, name: str, fetch_service, max_concurrency: int = None):
+        """Add a fetch service to the fetcher. `max_concurrency` limits the
+        number of requests that can be made via the service at the same time;
+        if not given, the service's own `max_concurrency` attribute is used, if
+        it has one.
+        """
 
         required_methods = ["can_fetch", "request", "parse"]
         missing_methods = [
@@ -28,15 +119,77 @@ class Fetcher:
             )
         self._services[name] = fetch_service
 
+        if hasattr(fetch_service, "domains"):
+            for domain in fetch_service.domains:
+                self._domain_index.setdefault(domain.lower(), []).append(name)
+        else:
+            self._unindexed_services.append(name)
+
+        self._routes = {}
+        self.bind_metrics(name, fetch_service)
+
+        if max_concurrency is None:
+            max_concurrency = getattr(
+                fetch_service, "max_concurrency", self.default_max_concurrency
+            )
+        self._service_limits[name] = max_concurrency
+        self._service_semaphores[name] = threading.BoundedSemaphore(max_concurrency)
+
+        self.bind_http_session(name, fetch_service)
+
     def get_capable_services(self, url: str) -> dict:
         """Return a dictionary of services that are capable of fetching data for
-        the given URL.
+        the given URL, in the order they were added. Results are memoized per
+        URL.
         """
-        return {
-            name: service
-            for name, service in self._services.items()
-            if service.can_fetch(url)
-        }
+        if url not in self._routes:
+            capable_names = set()
+
+            for suffix in get_domain_suffixes(url):
+                capable_names.update(self._domain_index.get(suffix, []))
+
+            for name in self._unindexed_services:
+                if self._services[name].can_fetch(url):
+                    capable_names.add(name)
+
+            self._routes[url] = [
+                name for name in self._services if name in capable_names
+            ]
+
+        return {name: self._services[name] for name in self._routes[url]}
+
+    def get_service(self, url: str) -> tuple[str, object]:
+        """Return the name of the service that will be used to fetch the given
+        URL, and the service itself. If multiple services are capable of
+        fetching the same URL, the first service found is used.
+
+        If the fetcher has no services capable of handling the URL, an
+        UnsupportedHostError is raised.
+        """
+        capable_services = self.get_capable_services(url)
+        if len(capable_services) == 0:
+            raise UnsupportedHostError(
+                f'Cannot fetch data for URL "{url}"; no services are capable of handling this URL'
+            )
+
+        service_name = [name for name in capable_services][0]
+
+        return service_name, capable_services[service_name]
+
+    def is_cached(self, url: str) -> bool:
+        """Return True if video data for the given URL is available from the
+        cache, ie. fetching it won't require a request."""
+        if self._cache is None:
+            return False
+
+        url = self.resolve_short_link(url, lookup=False)
+
+        try:
+            service_name, _ = self.get_service(url)
+        except UnsupportedHostError:
+            return False
+
+        return self.load_from_cache(service_name, url) is not None
 
     def fetch(self, url: str) -> dict:
         """Multi-service fetch. `url` can be a URL for any service recognized by
@@ -51,62 +204,593 @@ class Fetcher:
         service found is used.
         """
 
+        # Short link check: if the URL is a short link, fetch the URL it
+        # redirects to instead.
+        requested_url = url
+        url = self.resolve_short_link(url)
+
         # Service check: check each registered service to see which can handle
         # the URL.
-        capable_services = self.get_capable_services(url)
-        if len(capable_services) == 0:
-            raise UnsupportedHostError(
-                f'Cannot fetch data for URL "{url}"; no services are capable of handling this URL'
-            )
-
-        service_name = [name for name in capable_services][0]
-        service = capable_services[service_name]
-        video_data = None
+        service_name, service = self.get_service(url)
 
         # Cache check: If using a cache, and the video data for this service
         # and URL is already cached, skip the request phase.
         cache_key = self.generate_cache_key(service_name, url)
-        cached_video_data = None
+        cache_entry = self.check_cache(service_name, url)
 
-        if self._cache is not None and self._cache.has(cache_key):
-            cached_video_data = self._cache.get(cache_key)
-            self.print(f"[cache]: Video data for {url} loaded from cache.", "suc")
+        if cache_entry is not None:
+            video_data = self.parse_cache_entry(
+                service_name, service, cache_key, cache_entry, url, requested_url
+            )
+            if video_data is not None:
+                return video_data
 
-        if cached_video_data is not None:
-            video_data = cached_video_data
+        video_data = self.request_once(service_name, service, url, cache_key)
 
-            if self._prompt_on_missing_data and not self.is_complete_video_data(
-                video_data
-            ):
-                resolve(video_data)
-                self.save_to_cache(video_data, cache_key, url)
+        self.collect_missing_data(
+            service_name, video_data, cache_key, url, requested_url
+        )
 
-        else:
-            # Request phase: Use a capable service to request video data
-            # from the URL.
-            try:
+        return self.parse(service_name, service, video_data)
+
+    def request_once(self, service_name: str, service, url: str, cache_key: str):
+        """Request and cache video data for the given URL, unless a request for
+        the same cache key is already in flight, in which case wait for it and
+        share its result (or error) instead."""
+        future, is_leader = self.get_in_flight().begin(cache_key)
+        if not is_leader:
+            self.record_coalesced_request(service_name, url)
+            return self.get_in_flight().wait(future)
+
+        try:
+            video_data = self.request(service_name, service, url)
+        except Exception as e:
+            self.save_negative_entry_to_cache(e, cache_key, url)
+            self.get_in_flight().finish(cache_key, error=e)
+            raise e
+
+        try:
+            self.save_requested_video_data(service_name, video_data, cache_key, url)
+        finally:
+            self.get_in_flight().finish(cache_key, result=video_data)
+
+        return video_data
+
+    def get_in_flight(self) -> SingleFlight:
+        """Return the single-flight group tracking the fetcher's in-flight
+        requests."""
+        return self._in_flight
+
+    def record_coalesced_request(self, service_name: str, url: str):
+        """Record a request which wasn't made because an identical one was
+        already in flight."""
+        self._metrics.record_coalesced_request(service_name)
+        self.print(f"[{service_name}]: Waiting for in-flight request for {url}...")
+
+    def resolve_short_link(self, url: str, lookup: bool = True) -> str:
+        """If the given URL is a short link, return the canonical URL it
+        redirects to; otherwise, return the URL unchanged. Previously resolved
+        links are loaded from the cache; others are resolved by the service
+        that handles the short link (unless `lookup` is False), and cached.
+
+        If the short link can't be resolved, the error is raised. Errors that
+        won't go away (see `negative_cacheable_errors`) are remembered, and
+        raised again without resolving the link again if it's looked up or
+        fetched later."""
+        short_link_service = self.get_short_link_service(url)
+        if short_link_service is None:
+            return url
+
+        if (resolved_url := self.load_resolved_short_link(url)) is not None:
+            return resolved_url
+
+        if not lookup:
+            return url
+
+        self.check_short_link_error(url)
+
+        service_name, service = short_link_service
+
+        try:
+            with self._service_semaphores[service_name]:
+                self.print(f"[{service_name}]: Resolving short link {url}...")
+                resolved_url = self.call_service(
+                    service_name, service.resolve_short_link, url
+                )
+        except Exception as e:
+            self.handle_short_link_error(service_name, url, e)
+            raise e
+
+        self.save_resolved_short_link(url, resolved_url)
+
+        return resolved_url
+
+    def check_short_link_error(self, url: str):
+        """Raise the error remembered for a short link which couldn't be
+        resolved before, if there is one."""
+        error = self._short_link_errors.get(self.generate_short_link_cache_key(url))
+        if error is not None:
+            raise error
+
+    def handle_short_link_error(self, service_name: str, url: str, error: Exception):
+        """Record an error resolving a short link, and remember it if it won't
+        go away (see `resolve_short_link`)."""
+        self._metrics.record_error(service_name, error)
+        self.print(f"[{service_name}]: Could not resolve {url}: {error}", "err")
+
+        if type(error).__name__ in self.negative_cacheable_errors:
+            self._short_link_errors[self.generate_short_link_cache_key(url)] = error
+
+    def is_short_link(self, url: str) -> bool:
+        return self.get_short_link_service(url) is not None
+
+    def get_short_link_service(self, url: str) -> tuple[str, object] | None:
+        """Return the name of the service which can resolve the given URL, and
+        the service itself, if the URL is a short link; otherwise return
+        None."""
+        try:
+            service_name, service = self.get_service(url)
+        except UnsupportedHostError:
+            return None
+
+        if hasattr(service, "is_short_link") and service.is_short_link(url):
+            return service_name, service
+
+        return None
+
+    def generate_short_link_cache_key(self, url: str) -> str:
+        """Generate the cache key under which the URL that a short link
+        redirects to is stored. Only the host and path are used, since they
+        identify the link."""
+        return f"short-link-{get_url_host(url)}{urlparse(url).path}"
+
+    def load_resolved_short_link(self, url: str) -> str | None:
+        """Return the cached URL that a short link redirects to, or None if
+        the link hasn't been resolved before."""
+        if self._cache is None:
+            return None
+
+        cache_key = self.generate_short_link_cache_key(url)
+
+        with self._cache_lock:
+            if not self._cache.has(cache_key):
+                return None
+
+            return self._cache.get(cache_key)["resolved_url"]
+
+    def save_resolved_short_link(self, url: str, resolved_url: str):
+        """Cache the URL that a short link redirects to."""
+        cache_key = self.generate_short_link_cache_key(url)
+        self.save_to_cache({"resolved_url": resolved_url}, cache_key, url)
+
+    def check_cache(self, service_name: str, url: str) -> dict | None:
+        """Cache check phase: Return the cached video data for the given URL,
+        or None if it needs to be requested. If the URL is cached as a failed
+        fetch, the recorded error is raised instead."""
+        cached_video_data = self.load_from_cache(service_name, url)
+
+        if cached_video_data is None:
+            if self._cache is not None:
+                self._metrics.record_cache_miss(service_name)
+            return None
+
+        if self.is_negative_entry(cached_video_data):
+            self._metrics.record_cache_negative_hit(service_name)
+            error = self.get_negative_entry_error(cached_video_data)
+            self.print(f"[cache]: Skipping {url}; cached as failed: {error}", "err")
+            raise error
+
+        self._metrics.record_cache_hit(service_name)
+        self.print(f"[cache]: Video data for {url} loaded from cache.", "suc")
+
+        return cached_video_data
+
+    def request(self, service_name: str, service, url: str) -> dict:
+        """Request phase: Use a capable service to request video data from the
+        URL, waiting if the service is already handling as many requests as
+        it's allowed to."""
+        try:
+            with self._service_semaphores[service_name]:
                 self.print(f"[{service_name}]: Requesting data from {url}...")
-                video_data = service.request(url)
-            except Exception as e:
-                self.print(f"[{service_name}]: Request error: {e}", "err")
-                raise e
+                return self.call_service(service_name, service.request, url)
+        except Exception as e:
+            self._metrics.record_error(service_name, e)
+            self.print(f"[{service_name}]: Request error: {e}", "err")
+            raise e
+
+    def call_service(self, service_name: str, request_method, *args):
+        """Call one of a service's request methods with the given arguments,
+        and record how long it took. If the service has a rate limiter, wait
+        until the request is allowed first, and if the service reports that
+        it's being rate limited, back off and try again (up to
+        `rate_limit_retries` times)."""
+        rate_limiter = self._rate_limiters.get(service_name)
 
-            if self._prompt_on_missing_data and not self.is_complete_video_data(
-                video_data
-            ):
-                resolve(video_data)
+        for attempt in range(self.rate_limit_retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.acquire()
 
-            self.save_to_cache(video_data, cache_key, url)
+            start_time = time.perf_counter()
+            try:
+                response = request_method(*args)
+            except RateLimitedError as e:
+                if rate_limiter is None or attempt == self.rate_limit_retries:
+                    raise e
+
+                self.handle_rate_limited(service_name, rate_limiter, e)
+                continue
+            finally:
+                self._metrics.record_request(
+                    service_name, time.perf_counter() - start_time
+                )
+
+            if rate_limiter is not None:
+                rate_limiter.recover()
+
+            return response
+
+    def handle_rate_limited(self, service_name: str, rate_limiter, error: Exception):
+        """Back off after a service reports that it's being rate limited."""
+        self._metrics.record_error(service_name, error)
+        delay = rate_limiter.back_off(error.retry_after)
+        self.print(
+            f"[{service_name}]: Rate limited; retrying in {delay:.0f} seconds...",
+            "err",
+        )
 
-        # Parse phase: If the service managed to retrieve video data, use it
-        # to parse any fields into objects that couldn't have been serialized during the request phase.
+    def save_requested_video_data(
+        self, service_name: str, video_data: dict, cache_key: str, url: str
+    ):
+        """Cache newly requested video data, replacing any cached failure."""
+        cache_entry = self.create_cache_entry(service_name, video_data)
+        self.save_to_cache(cache_entry, cache_key, url)
+        self._recheck_keys.discard(self.get_dedupe_key(url))
+
+    def parse(self, service_name: str, service, video_data: dict) -> dict:
+        """Parse phase: If the service managed to retrieve video data, use it to
+        parse any fields into objects that couldn't have been serialized during
+        the request phase."""
         try:
-            parsed_video_data = service.parse(video_data)
+            return service.parse(video_data)
         except Exception as e:
+            self._metrics.record_error(service_name, e)
             self.print(f"[{service_name}]: Parse error: {e}", "err")
             raise e
 
-        return parsed_video_data
+    def fetch_batch(self, service_name: str, urls: list[str]) -> dict:
+        """Fetch several URLs with a single request, using a service that
+        supports batch requests (ie. one that has a `request_batch` method).
+        The cache is not checked, but the fetched video data is cached as
+        normal.
+
+        Returns a dictionary mapping each URL to its fetched video data, or to
+        the exception that was raised while trying to fetch it.
+        """
+        service = self._services[service_name]
+
+        if self._cache is not None:
+            for url in urls:
+                self._metrics.record_cache_miss(service_name)
+
+        # URLs which are already being requested elsewhere are left out of the
+        # batch, and share the other request's result.
+        leader_urls, follower_futures = self.begin_batch(service_name, urls)
+        results = {}
+
+        if len(leader_urls) > 0:
+            try:
+                with self._service_semaphores[service_name]:
+                    self.print(
+                        f"[{service_name}]: Requesting data for {len(leader_urls)} URLs in one batch..."
+                    )
+                    responses = self.call_service(
+                        service_name, service.request_batch, leader_urls
+                    )
+            except Exception as e:
+                self._metrics.record_error(service_name, e)
+                self.print(f"[{service_name}]: Batch request error: {e}", "err")
+                for url in leader_urls:
+                    cache_key = self.generate_cache_key(service_name, url)
+                    self.get_in_flight().finish(cache_key, error=e)
+                    results[url] = e
+            else:
+                for url in leader_urls:
+                    results[url] = self.handle_batch_response(
+                        service_name, service, url, responses[url]
+                    )
+
+        for url, future in follower_futures.items():
+            try:
+                video_data = self.get_in_flight().wait(future)
+            except Exception as e:
+                results[url] = e
+                continue
+
+            results[url] = self.parse_or_exception(service_name, service, video_data)
+
+        return results
+
+    def begin_batch(self, service_name: str, urls: list[str]) -> tuple[list, dict]:
+        """Start a batch request for the given URLs. Returns the URLs which
+        should be requested, and a dictionary of futures for the URLs which
+        are already in flight."""
+        leader_urls = []
+        follower_futures = {}
+
+        for url in urls:
+            cache_key = self.generate_cache_key(service_name, url)
+            future, is_leader = self.get_in_flight().begin(cache_key)
+
+            if is_leader:
+                leader_urls.append(url)
+            else:
+                self.record_coalesced_request(service_name, url)
+                follower_futures[url] = future
+
+        return leader_urls, follower_futures
+
+    def handle_batch_response(self, service_name: str, service, url: str, video_data):
+        """Cache and parse the video data for a URL that was requested as part
+        of a batch, and finish its in-flight request. Returns the parsed video
+        data, or the exception for the URL if it couldn't be fetched."""
+        cache_key = self.generate_cache_key(service_name, url)
+
+        if isinstance(video_data, Exception):
+            self.handle_batch_error(service_name, video_data, cache_key, url)
+            self.get_in_flight().finish(cache_key, error=video_data)
+            return video_data
+
+        try:
+            self.save_requested_video_data(service_name, video_data, cache_key, url)
+        finally:
+            self.get_in_flight().finish(cache_key, result=video_data)
+
+        self.collect_missing_data(service_name, video_data, cache_key, url)
+
+        return self.parse_or_exception(service_name, service, video_data)
+
+    def handle_batch_error(
+        self, service_name: str, error: Exception, cache_key: str, url: str
+    ):
+        """Record the error for a URL which couldn't be fetched as part of a
+        batch request."""
+        self._metrics.record_error(service_name, error)
+        self.print(f"[{service_name}]: Request error: {error}", "err")
+        self.save_negative_entry_to_cache(error, cache_key, url)
+
+    def parse_cache_entry(
+        self, service_name: str, service, cache_key: str, cache_entry: dict, *urls
+    ) -> dict | None:
+        """Parse phase for cached video data. Current cache entries already
+        hold parsed video data, so they're only decoded. Entries stored by an
+        older version of the service are migrated with the service's `migrate`
+        method, and older unversioned entries are parsed as usual; either way,
+        the result is stored back in the current format (see
+        `save_migrated_entries`), without making any requests.
+
+        Returns None if the entry can't be used (ie. it was stored by a newer
+        version of the fetcher or service, or by an older version of a service
+        that can't migrate it), in which case the video should be requested
+        again.
+        """
+        if not self.is_versioned_entry(cache_entry):
+            self.collect_missing_data(service_name, cache_entry, cache_key, *urls)
+            video_data = self.parse(service_name, service, cache_entry)
+
+            if self.is_complete_video_data(cache_entry):
+                self.queue_migrated_entry(cache_key, service, video_data)
+
+            return video_data
+
+        entry_service_version = cache_entry["service_version"]
+        service_version = self.get_service_cache_version(service)
+
+        if (
+            cache_entry["schema"] != self.cache_schema_version
+            or entry_service_version > service_version
+        ):
+            return None
+
+        video_data = self.decode_video_data(cache_entry["video_data"])
+        if entry_service_version == service_version:
+            return video_data
+
+        if not hasattr(service, "migrate"):
+            return None
+
+        try:
+            video_data = service.migrate(video_data, entry_service_version)
+        except Exception as e:
+            self.print(f"[{service_name}]: Unable to migrate cached data: {e}", "err")
+            return None
+
+        self.queue_migrated_entry(cache_key, service, video_data)
+
+        return video_data
+
+    def parse_or_exception(self, service_name: str, service, video_data: dict):
+        """Parse the given video data, returning the exception instead of
+        raising it if parsing fails."""
+        try:
+            return self.parse(service_name, service, video_data)
+        except Exception as e:
+            return e
+
+    def fetch_many(
+        self, urls: list[str], max_workers: int = None, progress=None
+    ) -> list:
+        """Fetch video data for several URLs at once. Cached URLs are fetched
+        first, then the remaining URLs are requested concurrently, subject to
+        each service's concurrency limit. URLs handled by services that support
+        batch requests are grouped into batches of up to the service's
+        `batch_size`. Each video is only fetched once, even if it appears in
+        `urls` more than once, or under several different URLs.
+
+        If `progress` is given, it's called as fetching proceeds with the number
+        of distinct videos fetched so far and the total number to fetch (from
+        whichever thread fetched them).
+
+        Returns a list with one item per URL in `urls`, in the same order. Each
+        item is either the fetched video data, or the exception that was raised
+        while trying to fetch it.
+        """
+        plan = self.plan_fetch_many(urls)
+        self.check_quota(plan)
+        results = plan.results
+
+        # URLs which can't be fetched at all already have their results.
+        num_to_fetch = len(plan.representative_urls)
+        num_fetched = len(results)
+        progress_lock = threading.Lock()
+
+        def report_progress(num_urls: int):
+            nonlocal num_fetched
+            if progress is None:
+                return
+            with progress_lock:
+                num_fetched += num_urls
+                progress(num_fetched, num_to_fetch)
+
+        def fetch_batch(service_name: str, batch_urls: list[str]) -> dict:
+            batch_results = self.fetch_batch(service_name, batch_urls)
+            report_progress(len(batch_urls))
+            return batch_results
+
+        def fetch_or_exception(url: str):
+            result = self.fetch_or_exception(url)
+            report_progress(1)
+            return result
+
+        report_progress(0)
+
+        for url in plan.cached_urls:
+            results[url] = fetch_or_exception(url)
+
+        if len(plan.batches) > 0 or len(plan.unbatched_urls) > 0:
+            if max_workers is None:
+                max_workers = sum(self._service_limits.values())
+
+            with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+                batch_futures = [
+                    executor.submit(fetch_batch, service_name, batch_urls)
+                    for service_name, batch_urls in plan.batches
+                ]
+
+                fetched = executor.map(fetch_or_exception, plan.unbatched_urls)
+                results.update(zip(plan.unbatched_urls, fetched))
+
+                for future in batch_futures:
+                    results.update(future.result())
+
+        self.save_migrated_entries()
+
+        return plan.get_results(urls)
+
+    def plan_fetch_many(self, urls: list[str]):
+        """Work out how to fetch several URLs at once (see `fetch_many`): which
+        are cached, which can be requested in batches (by services that have a
+        `request_batch` method), and which must be requested individually. URLs
+        that can't be fetched at all have their errors recorded in the plan's
+        results."""
+        plan = FetchPlan()
+
+        # Only fetch one URL for each distinct video; the other URLs for the
+        # same video share its result.
+        for url in urls:
+            representative_url = plan.representative_urls.setdefault(
+                self.get_dedupe_key(url), url
+            )
+            plan.url_representatives[url] = representative_url
+
+        batches = {}
+        for url in plan.representative_urls.values():
+            if self.is_cached(url):
+                plan.cached_urls.append(url)
+                continue
+
+            try:
+                service_name, service = self.get_service(url)
+            except UnsupportedHostError as e:
+                plan.results[url] = e
+                continue
+
+            # Short links are fetched individually, as they may need to be
+            # resolved first.
+            if hasattr(service, "request_batch") and not self.is_short_link(url):
+                batches.setdefault(service_name, []).append(url)
+            else:
+                plan.unbatched_urls.append(url)
+
+        for service_name, batch_urls in batches.items():
+            batch_size = getattr(
+                self._services[service_name], "batch_size", len(batch_urls)
+            )
+            for i in range(0, len(batch_urls), batch_size):
+                plan.batches.append((service_name, batch_urls[i : i + batch_size]))
+
+        return plan
+
+    def check_quota(self, plan: "FetchPlan"):
+        """Warn if the planned fetches would use more API quota than is left
+        for today, for services which keep a quota ledger (ie. have a
+        `quota_ledger` attribute that isn't None)."""
+        num_requests = {}
+        for service_name, _ in plan.batches:
+            num_requests[service_name] = num_requests.get(service_name, 0) + 1
+        for url in plan.unbatched_urls:
+            service_name, _ = self.get_service(url)
+            num_requests[service_name] = num_requests.get(service_name, 0) + 1
+
+        for service_name, count in num_requests.items():
+            service = self._services[service_name]
+            quota_ledger = getattr(service, "quota_ledger", None)
+            if quota_ledger is None:
+                continue
+
+            units = count * getattr(service, "quota_cost", 1)
+            if quota_ledger.would_exceed(units):
+                self.print(
+                    f"[{service_name}]: WARNING: Fetching may need up to {units} units of API quota, but only {quota_ledger.get_remaining()} of today's {quota_ledger.daily_budget} are left.",
+                    "err",
+                )
+
+    def fetch_or_exception(self, url: str):
+        """Fetch the given URL, returning the exception instead of raising it if
+        the fetch fails."""
+        try:
+            return self.fetch(url)
+        except Exception as e:
+            return e
+
+    def set_rate_limiter(self, service_name: str, rate_limiter):
+        """Set a rate limiter (eg. a `TokenBucket`) for the service with the
+        given name."""
+        self._rate_limiters[service_name] = rate_limiter
+
+    def set_http_session(self, http_session: PooledSession):
+        """Set the HTTP session used by the fetcher's services (eg. to configure
+        its timeouts and retries)."""
+        self._http_session = http_session
+
+        for name, service in self._services.items():
+            self.bind_http_session(name, service)
+
+    def get_http_session(self) -> PooledSession:
+        return self._http_session
+
+    def bind_http_session(self, name: str, fetch_service):
+        """Give the fetcher's HTTP session to a service which makes HTTP
+        requests, if it has a `set_http_session` method, and make sure the
+        session's connection pool is large enough for the service."""
+        if hasattr(fetch_service, "set_http_session"):
+            self._http_session.resize(self._service_limits[name])
+            fetch_service.set_http_session(self._http_session)
+
+    def close(self):
+        """Save any migrated cache entries, and close the fetcher's HTTP
+        session and any connections it has open."""
+        self.save_migrated_entries()
+        self._http_session.close()
 
     def set_cache(self, cache):
         """Set the fetcher to use a cache object. Fetched video data will be
@@ -119,9 +803,165 @@ class Fetcher:
         us to cache successful responses from a given service for a given URL.
         (It would be nice if we could use tuple keys, but JSON doesn't support
         them).
+
+        If the video can be identified from its URL (see
+        `functions.url.get_video_identity`), the key is generated from the
+        video's platform and id instead, so that all variants of the URL share
+        the same cache entry.
         """
+        if (identity := get_video_identity(url)) is not None:
+            platform, video_id = identity
+            return f"{platform}-{video_id}"
+
+        return self.generate_url_cache_key(service_name, url)
+
+    def generate_url_cache_key(self, service_name: str, url: str):
+        """Generate a cache key from the exact URL, as was done for all URLs
+        before cache keys were based on video identities. Cached data stored
+        under these keys is still used."""
         return f"{service_name}-{url}"
 
+    def load_from_cache(self, service_name: str, url: str) -> dict | None:
+        """Return the cached video data for the given service and URL, or None
+        if there is none. The cached data may be a negative entry (see
+        `is_negative_entry`); expired negative entries, negative entries for
+        URLs that are due to be rechecked, and negative entries for errors that
+        are no longer cached, are ignored."""
+        if self._cache is None:
+            return None
+
+        cache_keys = dict.fromkeys(
+            [
+                self.generate_cache_key(service_name, url),
+                self.generate_url_cache_key(service_name, url),
+            ]
+        )
+
+        with self._cache_lock:
+            for cache_key in cache_keys:
+                if self._cache.has(cache_key):
+                    video_data = self._cache.get(cache_key)
+                    break
+            else:
+                return None
+
+        if self.is_negative_entry(video_data) and (
+            self.get_dedupe_key(url) in self._recheck_keys
+            or video_data["negative"]["expires"] <= time.time()
+            or video_data["negative"]["error"] not in self.negative_cacheable_errors
+        ):
+            return None
+
+        return video_data
+
+    def get_service_cache_version(self, service) -> int:
+        """Return the version of the video data produced by the given service.
+        Services should increase their `cache_version` whenever the output of
+        `parse` changes."""
+        return getattr(service, "cache_version", 1)
+
+    def is_versioned_entry(self, cache_entry: dict) -> bool:
+        """Return True if the given cache entry holds parsed video data with a
+        version number, rather than unparsed video data."""
+        return "schema" in cache_entry
+
+    def create_cache_entry(self, service_name: str, video_data: dict) -> dict:
+        """Return the cache entry to store for video data requested from the
+        given service: a versioned entry holding the parsed video data if it's
+        complete and can be parsed, or otherwise the unparsed video data, so
+        that it can still be filled in by `resolve_missing_data`."""
+        if not self.is_complete_video_data(video_data):
+            return video_data
+
+        service = self._services[service_name]
+        try:
+            parsed_video_data = service.parse(video_data)
+        except Exception:
+            return video_data
+
+        return self.create_versioned_entry(service, parsed_video_data) or video_data
+
+    def create_versioned_entry(self, service, video_data: dict) -> dict | None:
+        """Return a versioned cache entry holding the given parsed video data,
+        or None if it can't be stored in compact form."""
+        encoded_video_data = self.encode_video_data(video_data)
+        if encoded_video_data is None:
+            return None
+
+        return {
+            "schema": self.cache_schema_version,
+            "service_version": self.get_service_cache_version(service),
+            "video_data": encoded_video_data,
+        }
+
+    def encode_video_data(self, video_data: dict) -> list | None:
+        """Return parsed video data in compact form, as a list of the values of
+        `video_data_fields`, with the upload date as a UTC timestamp. Returns
+        None if the video data has other fields, or its upload date isn't in
+        UTC."""
+        if video_data.keys() != set(self.video_data_fields):
+            return None
+
+        upload_date = video_data["upload_date"]
+        if (
+            not isinstance(upload_date, datetime)
+            or upload_date.utcoffset() != timedelta(0)
+        ):
+            return None
+
+        timestamp = upload_date.timestamp()
+        if timestamp.is_integer():
+            timestamp = int(timestamp)
+
+        return [
+            timestamp if field == "upload_date" else video_data[field]
+            for field in self.video_data_fields
+        ]
+
+    def decode_video_data(self, encoded_video_data: list) -> dict:
+        """Return parsed video data from its compact form (see
+        `encode_video_data`)."""
+        video_data = dict(zip(self.video_data_fields, encoded_video_data))
+        video_data["upload_date"] = datetime.fromtimestamp(
+            video_data["upload_date"], timezone.utc
+        )
+
+        return video_data
+
+    def queue_migrated_entry(self, cache_key: str, service, video_data: dict):
+        """Set aside a cache entry for the given parsed video data, to replace
+        an outdated entry. Migrated entries are written in batches, so that
+        loading a cache full of outdated entries doesn't rewrite the cache once
+        per entry."""
+        cache_entry = self.create_versioned_entry(service, video_data)
+        if cache_entry is None or self._cache is None:
+            return
+
+        with self._cache_lock:
+            self._migrated_entries[cache_key] = cache_entry
+            num_migrated = len(self._migrated_entries)
+
+        if num_migrated >= self.migration_batch_size:
+            self.save_migrated_entries()
+
+    def save_migrated_entries(self):
+        """Write any migrated cache entries to the cache."""
+        with self._cache_lock:
+            migrated_entries = self._migrated_entries
+            self._migrated_entries = {}
+
+            if len(migrated_entries) > 0:
+                self.save_many_to_cache(migrated_entries)
+
+    def get_dedupe_key(self, url: str):
+        """Return a key which is the same for all URLs that refer to the same
+        video, used to avoid fetching the same video more than once. (Short
+        links are only recognized as referring to the same video as other URLs
+        once they've been resolved.)"""
+        url = self.resolve_short_link(url, lookup=False)
+
+        return get_video_identity(url) or url
+
     def save_to_cache(self, video_data, cache_key, url):
         # If using a cache, and if the response object is JSON-serializable,
         # cache the response object so we don't need to retrieve it again.
@@ -129,7 +969,8 @@ class Fetcher:
             return
 
         try:
-            self._cache.set(cache_key, video_data)
+            with self._cache_lock:
+                self._cache.set(cache_key, video_data)
         except TypeError as e:
             # If we can't cache the response (because the response isn't
             # JSON-serializable), give a warning, but continue.
@@ -137,12 +978,194 @@ class Fetcher:
                 f"[cache]: Unable to cache video data from URL {url}; {e}", "err"
             )
 
+    def set_negative_ttls(self, negative_ttls: dict[str, int]):
+        """Set how long failed fetches are remembered in the cache, as a
+        dictionary mapping error class names (see `negative_cacheable_errors`)
+        to times in seconds. Failures with errors that aren't listed aren't
+        cached."""
+        self._negative_ttls = negative_ttls
+
+    def recheck(self, url: str):
+        """Ignore any cached failure for the given URL (or any other URL for the
+        same video) next time it's fetched, and request it again."""
+        self._recheck_keys.add(self.get_dedupe_key(url))
+        self._short_link_errors.pop(self.generate_short_link_cache_key(url), None)
+
+    def is_negative_entry(self, cache_entry: dict) -> bool:
+        """Return True if the given cache entry records a failed fetch rather
+        than video data."""
+        return "negative" in cache_entry
+
+    def get_negative_entry_error(self, cache_entry: dict) -> Exception:
+        """Recreate the error recorded by a negative cache entry."""
+        negative = cache_entry["negative"]
+        error_class = self.negative_cacheable_errors[negative["error"]]
+
+        return error_class(negative["message"])
+
+    def save_negative_entry_to_cache(self, error: Exception, cache_key: str, url: str):
+        """If configured to, record a failed fetch in the cache so that the URL
+        isn't requested again until the entry expires."""
+        error_name = type(error).__name__
+
+        if (
+            error_name not in self.negative_cacheable_errors
+            or error_name not in self._negative_ttls
+        ):
+            return
+
+        negative_entry = {
+            "negative": {
+                "error": error_name,
+                "message": str(error),
+                "expires": time.time() + self._negative_ttls[error_name],
+            }
+        }
+        self.save_to_cache(negative_entry, cache_key, url)
+        self._recheck_keys.discard(self.get_dedupe_key(url))
+
     def is_complete_video_data(self, video_data: dict):
         return all(val is not None for val in video_data.values())
 
+    def needs_missing_data(self, video_data: dict) -> bool:
+        """Return True if the user should be asked to fill in the given video
+        data."""
+        return self._prompt_on_missing_data and not self.is_complete_video_data(
+            video_data
+        )
+
+    def collect_missing_data(
+        self, service_name: str, video_data: dict, cache_key: str, *urls: str
+    ):
+        """If the user should be asked to fill in the given video data, set it
+        aside to be filled in by `resolve_missing_data` once fetching is done,
+        so that fetching never has to wait for the user."""
+        if not self.needs_missing_data(video_data):
+            return
+
+        with self._missing_data_lock:
+            record = self._missing_data.setdefault(
+                cache_key,
+                {"service_name": service_name, "video_data": video_data, "urls": set()},
+            )
+            record["urls"].update(urls)
+
+    def has_missing_data(self) -> bool:
+        """Return True if any fetched video data is waiting to be filled in by
+        `resolve_missing_data`."""
+        with self._missing_data_lock:
+            return len(self._missing_data) > 0
+
+    def resolve_missing_data(self, resolve=resolve_many) -> dict[str, dict]:
+        """Ask the user to fill in all of the incomplete video data collected
+        while fetching, all at once. The completed video data is saved to the
+        cache in a single write.
+
+        `resolve` is given a dictionary mapping a URL for each video to its
+        incomplete video data, and should fill in the missing values (by
+        default, by prompting in the console). Returns a dictionary mapping each URL that was fetched with
+        incomplete data to its completed, parsed video data (or the exception
+        raised while parsing it).
+        """
+        with self._missing_data_lock:
+            records = self._missing_data
+            self._missing_data = {}
+
+        if len(records) == 0:
+            return {}
+
+        resolve(
+            {min(record["urls"]): record["video_data"] for record in records.values()}
+        )
+
+        self.save_many_to_cache(
+            {
+                cache_key: self.create_cache_entry(
+                    record["service_name"], record["video_data"]
+                )
+                for cache_key, record in records.items()
+            }
+        )
+
+        resolved = {}
+        for record in records.values():
+            service_name = record["service_name"]
+            video_data = self.parse_or_exception(
+                service_name, self._services[service_name], record["video_data"]
+            )
+            for url in record["urls"]:
+                resolved[url] = video_data
+
+        return resolved
+
+    def complete_fetch_results(
+        self, urls: list[str], fetch_results: list, resolve=resolve_many
+    ) -> list:
+        """Given a list of URLs and the results of fetching them, have the user
+        fill in any incomplete video data (see `resolve_missing_data`), and
+        return the results with the completed video data in place of the
+        incomplete data. Results for other URLs of the same videos are replaced
+        as well."""
+        if not self.has_missing_data():
+            return fetch_results
+
+        resolved = {
+            self.get_dedupe_key(url): video_data
+            for url, video_data in self.resolve_missing_data(resolve).items()
+        }
+
+        return [
+            resolved.get(self.get_dedupe_key(url), fetch_result)
+            for url, fetch_result in zip(urls, fetch_results)
+        ]
+
+    def save_many_to_cache(self, items: dict):
+        """Cache several video data dictionaries, by cache key, at once."""
+        if self._cache is None:
+            return
+
+        try:
+            with self._cache_lock:
+                if hasattr(self._cache, "set_many"):
+                    self._cache.set_many(items)
+                else:
+                    for cache_key, video_data in items.items():
+                        self._cache.set(cache_key, video_data)
+
+                if hasattr(self._cache, "flush"):
+                    self._cache.flush()
+        except TypeError as e:
+            self.print(f"[cache]: Unable to cache video data; {e}", "err")
+
     def set_prompt_on_missing_data(self, value: bool):
+        """Set whether incomplete video data should be collected, to be filled
+        in by the user with `resolve_missing_data`."""
         self._prompt_on_missing_data = value
 
+    def get_prompt_on_missing_data(self) -> bool:
+        """Return whether incomplete video data is being collected (see
+        `set_prompt_on_missing_data`)."""
+        return self._prompt_on_missing_data
+
+    def set_metrics(self, metrics: FetchMetrics):
+        """Set the fetcher to record its metrics in the given metrics object
+        (eg. to share one set of metrics between several fetchers)."""
+        self._metrics = metrics
+
+        for name, service in self._services.items():
+            self.bind_metrics(name, service)
+
+    def get_metrics(self) -> FetchMetrics:
+        """Return the fetcher's metrics."""
+        return self._metrics
+
+    def bind_metrics(self, name: str, fetch_service):
+        """Give the fetcher's metrics object to a service which can record
+        metrics of its own (eg. the size of its responses), if it has a
+        `set_metrics` method."""
+        if hasattr(fetch_service, "set_metrics"):
+            fetch_service.set_metrics(self._metrics, name)
+
     def set_printer(self, printer):
         """Set the fetcher to use a printer. Output will be sent to the printer."""
         self._printer = printer
@@ -151,3 +1174,27 @@ class Fetcher:
         """Output a message to the printer, if available."""
         if self._printer is not None:
             self._printer.print(text, msg_type)
+
+
+class FetchPlan:
+    """The plan for fetching several URLs at once, as worked out by
+    `Fetcher.plan_fetch_many`."""
+
+    def __init__(self):
+        # The URL that will be fetched for each distinct video.
+        self.representative_urls = {}
+
+        # The representative URL for each URL to fetch. (This is recorded when
+        # the plan is made, since fetching a short link can change which video
+        # it's recognized as.)
+        self.url_representatives = {}
+
+        self.cached_urls = []
+        self.batches = []
+        self.unbatched_urls = []
+        self.results = {}
+
+    def get_results(self, urls: list[str]) -> list:
+        """Return the results for the given URLs, in the same order, once all of
+        the planned fetches have been made."""
+        return [self.results[self.url_representatives[url]] for url in urls]
@@ -1,4 +1,4 @@
-import tkinter as tk, dotenv, os
+import tkinter as tk, dotenv, os, importlib
 from PIL import Image, ImageTk
 
 dotenv.load_dotenv()
@@ -15,6 +15,13 @@ class GUI:
     # other via this dictionary.
     instances = {}
 
+    # Static dictionary mapping the class names of GUI subclasses which haven't
+    # been initialized yet to the modules they're defined in. The modules are
+    # only imported (and the classes initialized) when the GUI is first run, so
+    # that the dependencies of every process don't have to be loaded before the
+    # main menu can be shown.
+    registered = {}
+
     # Stores the GUI currently being shown to the user.
     active_gui = None
 
@@ -53,6 +60,22 @@ class GUI:
             GUI._frame_api_key, textvariable=GUI._var_yt_api_key, width=15, show="*"
         ).grid(row=1, column=0)
 
+    @staticmethod
+    def register(gui_name: str, module_name: str):
+        """Register a GUI subclass, to be imported from the given module and
+        initialized (with no arguments) when it's first run."""
+        GUI.registered[gui_name] = module_name
+
+    @staticmethod
+    def get_instance(gui_name: str) -> "GUI":
+        """Return the instance of the GUI subclass with the given class name,
+        initializing it first if it's registered but not yet initialized."""
+        if gui_name not in GUI.instances and gui_name in GUI.registered:
+            module = importlib.import_module(GUI.registered[gui_name])
+            getattr(module, gui_name)()
+
+        return GUI.instances[gui_name]
+
     @staticmethod
     def run(gui_name: str):
         """Clear the current window and build the gui from the provided class
@@ -66,7 +89,7 @@ class GUI:
                 widget.destroy()
 
         # Switch the active GUI to the new instance.
-        GUI.active_gui = GUI.instances[gui_name]
+        GUI.active_gui = GUI.get_instance(gui_name)
 
         # Call the new GUI's interface builder and construct the requested GUI.
         GUI.active_gui.ready = False
@@ -91,10 +114,11 @@ class GUI:
         GUI.active_gui.ready = True
     
     @staticmethod
-    def get_api_key() -> str | None:
+    def get_api_key(show_error: bool = True) -> str | None:
         """Get the Youtube API key from the key entry box or, if not present,
         from the .env file. Failure to find a key results in a message box
-        prompting the user to input a key"""
+        prompting the user to input a key, unless `show_error` is False, in
+        which case None is returned instead."""
 
         youtube_api_key = GUI._var_yt_api_key.get().strip()
 
@@ -102,6 +126,8 @@ class GUI:
             youtube_api_key = os.getenv("apikey", "").strip()
 
         if not youtube_api_key or youtube_api_key == "YOUR_API_KEY":
+            if not show_error:
+                return None
             tk.messagebox.showinfo("Error", "Please provide a Youtube API key.")
 
         return youtube_api_key
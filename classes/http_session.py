@@ -0,0 +1,71 @@
+"""HTTP session shared by the fetch services that make plain HTTP requests."""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PooledSession(requests.Session):
+    """A `requests.Session` which keeps connections alive between requests,
+    so that each request to the same host doesn't need a new TCP connection
+    and TLS handshake. Requests that fail because of connection errors or
+    server errors are retried with exponential backoff, and requests time out
+    after `connect_timeout`/`read_timeout` seconds unless another timeout is
+    given.
+
+    Rate-limiting responses (429/403) aren't retried here; the fetcher deals
+    with those (see `Fetcher.call_service`).
+    """
+
+    retry_statuses = [500, 502, 503, 504]
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+    ):
+        super().__init__()
+        self.pool_size = 0
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.resize(pool_size)
+
+    def resize(self, pool_size: int):
+        """Make sure the session can keep at least `pool_size` connections to
+        each host open at once (eg. one for each request that can be in
+        progress)."""
+        if pool_size <= self.pool_size:
+            return
+
+        self.pool_size = pool_size
+
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.retry_statuses,
+            allowed_methods=["GET", "HEAD"],
+            raise_on_status=False,
+        )
+
+        for prefix in ["https://", "http://"]:
+            if prefix in self.adapters:
+                self.adapters[prefix].close()
+
+            self.mount(
+                prefix,
+                HTTPAdapter(
+                    pool_connections=pool_size,
+                    pool_maxsize=pool_size,
+                    max_retries=retry,
+                ),
+            )
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        return super().request(method, url, **kwargs)
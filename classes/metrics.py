@@ -0,0 +1,302 @@
+"""Instrumentation for the video data fetcher. Records per-service request
+latencies, coalesced requests, cache lookups, errors and bytes received, as
+well as lookups in each tier of a tiered cache, and exports them as JSON or in
+the Prometheus text exposition format."""
+
+import json, math, threading
+from pathlib import Path
+
+
+class ServiceMetrics:
+    """Metrics recorded for a single fetch service."""
+
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_negative_hits = 0
+        self.coalesced_requests = 0
+        self.errors: dict[str, int] = {}
+        self.bytes_received = 0
+
+
+class FetchMetrics:
+    """Thread-safe collection of fetch metrics, grouped by service name."""
+
+    # Upper bounds (in seconds) of the request latency histogram buckets.
+    latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+    def __init__(self):
+        self._services: dict[str, ServiceMetrics] = {}
+        # Hits and misses in each tier of a tiered cache (see
+        # `classes.caching.TieredCache`), by tier name.
+        self._cache_tiers: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _service(self, service_name: str) -> ServiceMetrics:
+        if service_name not in self._services:
+            self._services[service_name] = ServiceMetrics()
+
+        return self._services[service_name]
+
+    def record_request(self, service_name: str, latency: float):
+        """Record a request made via a service, and how long it took in
+        seconds."""
+        with self._lock:
+            self._service(service_name).latencies.append(latency)
+
+    def record_cache_hit(self, service_name: str):
+        with self._lock:
+            self._service(service_name).cache_hits += 1
+
+    def record_cache_miss(self, service_name: str):
+        with self._lock:
+            self._service(service_name).cache_misses += 1
+
+    def record_cache_negative_hit(self, service_name: str):
+        """Record a cache lookup that found a cached failure."""
+        with self._lock:
+            self._service(service_name).cache_negative_hits += 1
+
+    def record_coalesced_request(self, service_name: str):
+        """Record a request that wasn't made because an identical request was
+        already in flight."""
+        with self._lock:
+            self._service(service_name).coalesced_requests += 1
+
+    def record_error(self, service_name: str, error: Exception):
+        """Record an error raised while fetching via a service, by exception
+        type."""
+        error_name = type(error).__name__
+
+        with self._lock:
+            errors = self._service(service_name).errors
+            errors[error_name] = errors.get(error_name, 0) + 1
+
+    def record_bytes(self, service_name: str, num_bytes: int):
+        """Record the size of a response received by a service."""
+        with self._lock:
+            self._service(service_name).bytes_received += num_bytes
+
+    def record_cache_tier_lookup(self, tier: str, hit: bool):
+        """Record a lookup in one tier of a tiered cache, and whether the entry
+        was found in that tier."""
+        with self._lock:
+            counts = self._cache_tiers.setdefault(tier, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
+
+    def reset(self):
+        """Discard all recorded metrics."""
+        with self._lock:
+            self._services = {}
+            self._cache_tiers = {}
+
+    def to_dict(self) -> dict:
+        """Return a summary of the recorded metrics, indexed by service name."""
+        summary = {}
+
+        with self._lock:
+            for service_name, metrics in sorted(self._services.items()):
+                latencies = sorted(metrics.latencies)
+                num_lookups = (
+                    metrics.cache_hits
+                    + metrics.cache_misses
+                    + metrics.cache_negative_hits
+                )
+
+                summary[service_name] = {
+                    "requests": len(latencies),
+                    "coalesced_requests": metrics.coalesced_requests,
+                    "latency_seconds": {
+                        "mean": sum(latencies) / len(latencies) if latencies else None,
+                        "p50": percentile(latencies, 50),
+                        "p90": percentile(latencies, 90),
+                        "p99": percentile(latencies, 99),
+                        "max": latencies[-1] if latencies else None,
+                    },
+                    "cache": {
+                        "hits": metrics.cache_hits,
+                        "misses": metrics.cache_misses,
+                        "negative_hits": metrics.cache_negative_hits,
+                        "hit_ratio": (
+                            (metrics.cache_hits + metrics.cache_negative_hits)
+                            / num_lookups
+                            if num_lookups
+                            else None
+                        ),
+                    },
+                    "errors": dict(sorted(metrics.errors.items())),
+                    "bytes_received": metrics.bytes_received,
+                }
+
+        return summary
+
+    def cache_tiers_to_dict(self) -> dict:
+        """Return a summary of the lookups in each tier of a tiered cache,
+        indexed by tier name."""
+        with self._lock:
+            return {
+                tier: {
+                    "hits": counts["hits"],
+                    "misses": counts["misses"],
+                    "hit_ratio": counts["hits"] / (counts["hits"] + counts["misses"]),
+                }
+                for tier, counts in self._cache_tiers.items()
+            }
+
+    def to_prometheus(self) -> str:
+        """Return the recorded metrics in the Prometheus text exposition
+        format."""
+        lines = []
+
+        def add_metric(name: str, metric_type: str, help_text: str, samples: list):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_name, labels, value in samples:
+                label_str = ",".join(
+                    f'{key}="{escape_label_value(str(val))}"'
+                    for key, val in labels.items()
+                )
+                lines.append(f"{sample_name}{{{label_str}}} {format_value(value)}")
+
+        with self._lock:
+            services = sorted(self._services.items())
+
+            add_metric(
+                "fetch_requests_total",
+                "counter",
+                "Number of requests made via each fetch service.",
+                [
+                    ("fetch_requests_total", {"service": name}, len(m.latencies))
+                    for name, m in services
+                ],
+            )
+
+            add_metric(
+                "fetch_coalesced_requests_total",
+                "counter",
+                "Number of requests saved by waiting for an identical in-flight request.",
+                [
+                    ("fetch_coalesced_requests_total", {"service": name}, m.coalesced_requests)
+                    for name, m in services
+                ],
+            )
+
+            histogram_samples = []
+            for name, m in services:
+                for bucket in self.latency_buckets:
+                    count = sum(1 for latency in m.latencies if latency <= bucket)
+                    histogram_samples.append(
+                        (
+                            "fetch_request_duration_seconds_bucket",
+                            {"service": name, "le": format_value(bucket)},
+                            count,
+                        )
+                    )
+                histogram_samples.append(
+                    (
+                        "fetch_request_duration_seconds_bucket",
+                        {"service": name, "le": "+Inf"},
+                        len(m.latencies),
+                    )
+                )
+                histogram_samples.append(
+                    ("fetch_request_duration_seconds_sum", {"service": name}, sum(m.latencies))
+                )
+                histogram_samples.append(
+                    ("fetch_request_duration_seconds_count", {"service": name}, len(m.latencies))
+                )
+
+            add_metric(
+                "fetch_request_duration_seconds",
+                "histogram",
+                "Time taken by requests made via each fetch service.",
+                histogram_samples,
+            )
+
+            cache_samples = []
+            for name, m in services:
+                for result, count in [
+                    ("hit", m.cache_hits),
+                    ("miss", m.cache_misses),
+                    ("negative_hit", m.cache_negative_hits),
+                ]:
+                    cache_samples.append(
+                        ("fetch_cache_lookups_total", {"service": name, "result": result}, count)
+                    )
+
+            add_metric(
+                "fetch_cache_lookups_total",
+                "counter",
+                "Number of cache lookups for each fetch service, by result.",
+                cache_samples,
+            )
+
+            add_metric(
+                "fetch_cache_tier_lookups_total",
+                "counter",
+                "Number of lookups in each tier of the cache, by result.",
+                [
+                    ("fetch_cache_tier_lookups_total", {"tier": tier, "result": result}, count)
+                    for tier, counts in self._cache_tiers.items()
+                    for result, count in [("hit", counts["hits"]), ("miss", counts["misses"])]
+                ],
+            )
+
+            add_metric(
+                "fetch_errors_total",
+                "counter",
+                "Number of errors raised while fetching via each fetch service, by exception type.",
+                [
+                    ("fetch_errors_total", {"service": name, "error": error}, count)
+                    for name, m in services
+                    for error, count in sorted(m.errors.items())
+                ],
+            )
+
+            add_metric(
+                "fetch_received_bytes_total",
+                "counter",
+                "Number of response bytes received by each fetch service, where known.",
+                [
+                    ("fetch_received_bytes_total", {"service": name}, m.bytes_received)
+                    for name, m in services
+                ],
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, output_path_prefix: str):
+        """Write the recorded metrics to a JSON file and a Prometheus text file,
+        at the given path prefix with ".json" and ".prom" appended."""
+        json_path = Path(f"{output_path_prefix}.json")
+        prometheus_path = Path(f"{output_path_prefix}.prom")
+
+        with json_path.open("w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=4)
+
+        with prometheus_path.open("w", encoding="utf-8") as file:
+            file.write(self.to_prometheus())
+
+        return json_path, prometheus_path
+
+
+def percentile(sorted_values: list[float], percent: float) -> float | None:
+    """Return the given percentile of a sorted list of values, using the
+    nearest-rank method, or None if the list is empty."""
+    if len(sorted_values) == 0:
+        return None
+
+    rank = math.ceil(percent / 100 * len(sorted_values))
+
+    return sorted_values[max(rank, 1) - 1]
+
+
+def escape_label_value(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    """Format a number for the Prometheus text format."""
+    return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,104 @@
+"""Background prefetching of the video data for a votes CSV, so that the video
+data is already cached by the time the checks are run on it."""
+
+import os, threading
+from typing import Callable
+from classes.fetcher import Fetcher
+from functions.voting import load_votes_csv, normalize_voting_data, process_voting_data
+
+
+class VotesPrefetch:
+    """Loads and normalizes a votes CSV on a worker thread, then fetches the data
+    for every video voted on, warming the fetcher's cache. Call `start` to begin
+    prefetching and `join` to wait for it to finish.
+
+    The fetcher is created by calling `get_fetcher` with the YouTube API key on
+    the worker thread, since creating it (loading the cache in particular) can
+    take a while. The prefetch's progress can be read from any thread via
+    `get_status`.
+    """
+
+    def __init__(
+        self,
+        csv_file_path_str: str,
+        youtube_api_key: str,
+        get_fetcher: Callable[[str], Fetcher],
+    ):
+        self.csv_file_path_str = csv_file_path_str
+        self.youtube_api_key = youtube_api_key
+        self.get_fetcher = get_fetcher
+        self.fetcher: Fetcher = None
+
+        self.voting_data = None
+        self.normalized_voting_data = None
+        self.modified_time = None
+        self.error = None
+
+        self._status = "Waiting to prefetch"
+        self._status_lock = threading.Lock()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self):
+        """Wait for the prefetch to finish."""
+        self._thread.join()
+
+    def is_done(self) -> bool:
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    def is_current(self, csv_file_path_str: str, youtube_api_key: str) -> bool:
+        """Return True if the prefetch is for the given votes CSV (as it is now)
+        and YouTube API key, and hasn't failed."""
+        try:
+            modified_time = os.path.getmtime(csv_file_path_str)
+        except OSError:
+            return False
+
+        return (
+            csv_file_path_str == self.csv_file_path_str
+            and youtube_api_key == self.youtube_api_key
+            and self.error is None
+            and self.modified_time in [None, modified_time]
+        )
+
+    def get_status(self) -> str:
+        with self._status_lock:
+            return self._status
+
+    def set_status(self, status: str):
+        with self._status_lock:
+            self._status = status
+
+    def report_progress(self, num_fetched: int, num_to_fetch: int):
+        self.set_status(f"Prefetching: {num_fetched}/{num_to_fetch} videos fetched")
+
+    def run(self):
+        try:
+            self.set_status("Prefetching: preparing fetcher")
+            self.fetcher = self.get_fetcher(self.youtube_api_key)
+
+            self.set_status("Prefetching: loading votes")
+            self.modified_time = os.path.getmtime(self.csv_file_path_str)
+            self.voting_data = load_votes_csv(self.csv_file_path_str)
+
+            self.set_status("Prefetching: normalizing URLs")
+            self.normalized_voting_data = normalize_voting_data(
+                self.voting_data, self.fetcher.resolve_short_link
+            )
+
+            ballots = process_voting_data(self.normalized_voting_data)
+            urls = [vote.url for ballot in ballots for vote in ballot.votes]
+
+            self.fetcher.fetch_many(
+                list(dict.fromkeys(urls)), progress=self.report_progress
+            )
+        except Exception as e:
+            # The checks will run into the same error and report it, so it's
+            # only recorded here.
+            self.error = e
+            self.set_status(f"Prefetching failed: {e}")
+            return
+
+        self.set_status(f"Prefetching complete: {len(set(urls))} videos fetched")
@@ -0,0 +1,154 @@
+"""Rate limiting for the video data fetcher. Each fetch service can be given a
+token bucket, which limits how quickly requests are made via the service, and
+backs off when the service reports that it's being rate limited. YouTube Data
+API usage is also recorded in a quota ledger, so that runs which would use up
+the daily quota can be warned about before they start.
+"""
+
+import json, os, threading, time
+from datetime import datetime
+from pathlib import Path
+import pytz
+
+
+class TokenBucket:
+    """Token bucket rate limiter. Tokens are added at `rate` per second, up to
+    `burst` tokens; each request takes one token, waiting for one to become
+    available if there are none left. This allows short bursts of requests
+    while keeping the long-term rate at `rate`.
+
+    When a service reports that it's being rate limited, call `back_off`: no
+    more requests are allowed until the backoff delay has passed, and the delay
+    doubles each time it happens again (up to `max_backoff` seconds). Call
+    `recover` after each successful request to shrink the delay again.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        initial_backoff: float = 5,
+        max_backoff: float = 300,
+        clock=time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+
+        self.backoff = 0
+        self._tokens = burst
+        self._updated = clock()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, and return how long in seconds the caller must wait
+        before using it. Tokens can be reserved ahead of time, in which case
+        later callers wait longer."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0
+
+            return max(wait_time, self._blocked_until - now)
+
+    def acquire(self):
+        """Wait until a request can be made."""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def back_off(self, retry_after: float = None) -> float:
+        """Stop requests for a while after the service reports that it's being
+        rate limited. If the service said how long to wait (eg. with a
+        Retry-After header), wait at least that long. Returns the delay in
+        seconds."""
+        with self._lock:
+            self.backoff = min(
+                self.max_backoff, self.backoff * 2 if self.backoff else self.initial_backoff
+            )
+            delay = max(self.backoff, retry_after or 0)
+            self._blocked_until = max(self._blocked_until, self.clock() + delay)
+
+            return delay
+
+    def recover(self):
+        """Shrink the backoff delay after a successful request."""
+        with self._lock:
+            self.backoff /= 2
+            if self.backoff < self.initial_backoff:
+                self.backoff = 0
+
+
+class QuotaLedger:
+    """Persistent record of the API quota units spent each day, stored as a JSON
+    file mapping dates to units. Days start at midnight in the given timezone;
+    the YouTube Data API's quota resets at midnight Pacific Time.
+
+    Only the most recent `days_kept` days are kept in the file.
+    """
+
+    days_kept = 30
+
+    def __init__(
+        self,
+        file_path_str: str,
+        daily_budget: int,
+        timezone: str = "America/Los_Angeles",
+    ):
+        self.file_path = Path(file_path_str)
+        self.daily_budget = daily_budget
+        self.timezone = pytz.timezone(timezone)
+        self.days = {}
+
+        self._lock = threading.Lock()
+
+        try:
+            with self.file_path.open("r") as file:
+                self.days = json.load(file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            pass
+
+    def get_day(self) -> str:
+        """Return the current date in the ledger's timezone."""
+        return datetime.now(self.timezone).date().isoformat()
+
+    def get_spent(self) -> int:
+        """Return the number of units spent today."""
+        with self._lock:
+            return self.days.get(self.get_day(), 0)
+
+    def get_remaining(self) -> int:
+        """Return the number of units left in today's budget."""
+        return self.daily_budget - self.get_spent()
+
+    def would_exceed(self, units: int) -> bool:
+        """Return True if spending the given number of units would exceed
+        today's budget."""
+        return units > self.get_remaining()
+
+    def spend(self, units: int):
+        """Record that the given number of units have been spent, and save the
+        ledger."""
+        with self._lock:
+            day = self.get_day()
+            self.days[day] = self.days.get(day, 0) + units
+            self.days = dict(sorted(self.days.items())[-self.days_kept :])
+            self.save()
+
+    def save(self):
+        # Write to a temporary file and rename it into place, so that the
+        # ledger isn't lost if the application is killed while saving.
+        temp_path = self.file_path.with_name(f"{self.file_path.name}.tmp")
+
+        with temp_path.open("w") as file:
+            json.dump(self.days, file, indent=4)
+
+        os.replace(temp_path, self.file_path)
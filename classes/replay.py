@@ -0,0 +1,197 @@
+"""Record/replay wrappers for fetch services. A recording service passes
+requests through to a real service, saving each raw response (or error) to a
+fixture directory; a replaying service serves the saved responses instead of
+making requests, optionally with synthetic latency and errors. Together they
+allow the processes to be run and benchmarked without network access.
+
+Fixtures are JSON files, one per request, stored in a subdirectory of the
+fixture directory named after the service.
+"""
+
+import hashlib, json, random, threading, time
+from pathlib import Path
+from classes.exceptions import (
+    FetchRequestError,
+    VideoUnavailableError,
+    RateLimitedError,
+)
+
+
+# Errors which can be recorded and replayed. Other errors are replayed as
+# `FetchRequestError`s.
+replayable_errors = {
+    "FetchRequestError": FetchRequestError,
+    "VideoUnavailableError": VideoUnavailableError,
+    "RateLimitedError": RateLimitedError,
+    "ValueError": ValueError,
+}
+
+
+class FixtureStore:
+    """Directory of recorded responses for a single fetch service."""
+
+    def __init__(self, fixture_dir: str, service_name: str):
+        self.dir_path = Path(fixture_dir) / service_name
+        self._lock = threading.Lock()
+
+    def get_path(self, kind: str, url: str) -> Path:
+        url_hash = hashlib.sha256(f"{kind}:{url}".encode()).hexdigest()[:32]
+
+        return self.dir_path / f"{url_hash}.json"
+
+    def save(self, kind: str, url: str, response=None, error: Exception = None):
+        """Save the response to (or error raised by) a request of the given kind
+        for the given URL."""
+        fixture = {"kind": kind, "url": url}
+
+        if error is not None:
+            fixture["error"] = {"type": type(error).__name__, "message": str(error)}
+        else:
+            fixture["response"] = response
+
+        with self._lock:
+            self.dir_path.mkdir(parents=True, exist_ok=True)
+            with self.get_path(kind, url).open("w", encoding="utf-8") as file:
+                json.dump(fixture, file, indent=4)
+
+    def load(self, kind: str, url: str):
+        """Return the recorded response to a request of the given kind for the
+        given URL, or raise the recorded error. If nothing was recorded, a
+        `FetchRequestError` is raised."""
+        try:
+            with self.get_path(kind, url).open("r", encoding="utf-8") as file:
+                fixture = json.load(file)
+        except FileNotFoundError:
+            raise FetchRequestError(
+                f'Could not replay URL "{url}"; no response was recorded for it'
+            )
+
+        if "error" in fixture:
+            error_class = replayable_errors.get(
+                fixture["error"]["type"], FetchRequestError
+            )
+            raise error_class(fixture["error"]["message"])
+
+        return fixture["response"]
+
+
+class ServiceWrapper:
+    """Base class for wrappers around fetch services. Attributes that the
+    wrapper doesn't define are taken from the wrapped service."""
+
+    def __init__(self, service, fixture_store: FixtureStore):
+        self.service = service
+        self.fixture_store = fixture_store
+
+        # Only offer batch requests and short link resolution if the wrapped
+        # service does, as the fetcher checks for these methods.
+        if hasattr(service, "request_batch"):
+            self.request_batch = self.wrapped_request_batch
+        if hasattr(service, "resolve_short_link"):
+            self.resolve_short_link = self.wrapped_resolve_short_link
+
+    def __getattr__(self, name: str):
+        if name == "service":
+            raise AttributeError(name)
+
+        return getattr(self.service, name)
+
+    def can_fetch(self, url: str) -> bool:
+        return self.service.can_fetch(url)
+
+    def parse(self, video_data):
+        return self.service.parse(video_data)
+
+
+class RecordingFetchService(ServiceWrapper):
+    """Fetch service which makes requests via another service, and records the
+    raw responses (and errors) in a fixture directory."""
+
+    def record(self, kind: str, url: str, request_method, *args):
+        try:
+            response = request_method(*args)
+        except Exception as e:
+            self.fixture_store.save(kind, url, error=e)
+            raise e
+
+        self.fixture_store.save(kind, url, response=response)
+
+        return response
+
+    def request(self, url: str):
+        return self.record("request", url, self.service.request, url)
+
+    def wrapped_request_batch(self, urls: list[str]) -> dict:
+        responses = self.service.request_batch(urls)
+
+        for url, response in responses.items():
+            if isinstance(response, Exception):
+                self.fixture_store.save("request", url, error=response)
+            else:
+                self.fixture_store.save("request", url, response=response)
+
+        return responses
+
+    def wrapped_resolve_short_link(self, url: str) -> str:
+        return self.record("short_link", url, self.service.resolve_short_link, url)
+
+
+class ReplayFetchService(ServiceWrapper):
+    """Fetch service which serves responses recorded by a
+    `RecordingFetchService`, without making any requests.
+
+    Each request takes `latency` seconds, plus up to `jitter` seconds more, and
+    fails with a `FetchRequestError` with probability `error_rate`. The random
+    jitter and errors are seeded, so that replays are repeatable.
+    """
+
+    def __init__(
+        self,
+        service,
+        fixture_store: FixtureStore,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        seed: int = 0,
+    ):
+        super().__init__(service, fixture_store)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def simulate_request(self, description: str):
+        """Wait for the synthetic latency, and raise a synthetic error if one
+        is due."""
+        with self._random_lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fails = self._random.random() < self.error_rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+        if fails:
+            raise FetchRequestError(f"Could not replay {description}; synthetic error")
+
+    def request(self, url: str):
+        self.simulate_request(f'URL "{url}"')
+
+        return self.fixture_store.load("request", url)
+
+    def wrapped_request_batch(self, urls: list[str]) -> dict:
+        self.simulate_request(f"{len(urls)} URLs")
+
+        responses = {}
+        for url in urls:
+            try:
+                responses[url] = self.fixture_store.load("request", url)
+            except Exception as e:
+                responses[url] = e
+
+        return responses
+
+    def wrapped_resolve_short_link(self, url: str) -> str:
+        self.simulate_request(f'short link "{url}"')
+
+        return self.fixture_store.load("short_link", url)
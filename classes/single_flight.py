@@ -0,0 +1,52 @@
+"""Request coalescing for the video data fetchers. When several callers want
+the result of the same operation at the same time, only the first caller (the
+"leader") performs it; the others wait for the leader's result, or its error,
+instead of repeating the operation."""
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Thread-safe single-flight group. Call `begin` with a key before
+    performing an operation; if the operation is already in flight for that
+    key, wait for its result with `wait`, otherwise perform it and pass its
+    result to `finish`."""
+
+    def __init__(self):
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: str) -> tuple[Future, bool]:
+        """Start an operation for the given key. Returns a future for the
+        operation's result, and True if the caller is the leader (and so must
+        perform the operation and call `finish`), or False if the operation is
+        already in flight."""
+        with self._lock:
+            if key in self._calls:
+                return self._calls[key], False
+
+            future = Future()
+            self._calls[key] = future
+
+            return future, True
+
+    def finish(self, key: str, result=None, error: Exception = None):
+        """Finish the operation for the given key, passing its result (or
+        error) to any callers waiting for it."""
+        with self._lock:
+            future = self._calls.pop(key)
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def wait(self, future: Future):
+        """Wait for an in-flight operation, returning its result or raising its
+        error."""
+        return future.result()
+
+    def is_in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
@@ -35,7 +35,6 @@ ydl_opts = {
     "quiet": True,
     "no_warnings": True,
     "retries": 3,
-    "sleep_interval": 2,
     "allowed_extractors": [
         "BiliBili",
         "Bluesky",
@@ -38,3 +38,16 @@ def resolve(video_data: dict):
         if value is None:
             err(f"Please manually enter the {key}:")
             video_data[key] = n[key]()
+
+
+def resolve_many(videos_data: dict[str, dict]):
+    """Given a dictionary mapping URLs to video data, list all of the missing
+    values, then prompt for each of them in turn."""
+    err(f"Data is missing for {len(videos_data)} videos:")
+    for url, video_data in videos_data.items():
+        missing_keys = [key for key, value in video_data.items() if value is None]
+        err(f"* {url}: {', '.join(missing_keys)}")
+
+    for url, video_data in videos_data.items():
+        err(f"For {url}:")
+        resolve(video_data)
@@ -1,45 +1,398 @@
+import atexit, threading
+from pathlib import Path
 from functions.general import load_text_data
 from functions.config import load_config_json
 from functions.messages import suc, inf, err
 from classes.fetcher import Fetcher
-from classes.fetch_services import YouTubeFetchService, YtDlpFetchService, DerpibooruFetchService, BilibiliFetchService
-from classes.caching import FileCache
+from classes.fetch_services import (
+    YouTubeFetchService,
+    YtDlpFetchService,
+    DerpibooruFetchService,
+    BilibiliFetchService,
+    YoutubeDLPool,
+    YoutubeDLProcessPool,
+)
+from classes.caching import (
+    FileCache,
+    JournaledFileCache,
+    SqliteCache,
+    ShardedFileCache,
+    TieredCache,
+    PolicyCache,
+)
 from classes.printers import ConsolePrinter
+from classes.metrics import FetchMetrics
+from classes.rate_limiting import TokenBucket, QuotaLedger
+from classes.http_session import PooledSession
+from classes.replay import FixtureStore, RecordingFetchService, ReplayFetchService
+from data.globals import ydl_opts
 
 
-def get_fetcher(youtube_api_key: str = None) -> Fetcher:
+# Fetch metrics shared by all fetchers created with `get_fetcher`, so that a
+# process which fetches in several steps can report on all of them at once.
+fetch_metrics = FetchMetrics()
+
+# Fetchers shared by all of the processes, by YouTube Data API key, and the
+# video data cache they share (see `get_shared_fetcher`).
+shared_fetchers = {}
+shared_cache = None
+shared_lock = threading.RLock()
+
+
+def get_fetcher(
+    youtube_api_key: str = None, config: dict = None, cache=None
+) -> Fetcher:
     """Return a video fetcher instance preconfigured for
     fetching the required video data needed for processing."""
 
     inf("* Configuring video data fetcher...")
-    config = load_config_json("config/config.json")
 
-    fetcher = Fetcher()
+    return configure_fetcher(Fetcher(), youtube_api_key, config, cache)
+
+
+def get_shared_fetcher(youtube_api_key: str = None) -> Fetcher:
+    """Return the fetcher shared by all of the processes for the given YouTube
+    Data API key, creating it the first time it's needed. Reusing one fetcher
+    (and one cache, whose contents stay in memory between fetches) saves
+    reloading the configuration, cache and fetch services every time video data
+    is fetched. The shared fetchers are closed, and the cache flushed, on exit.
+
+    Shared fetchers are created without prompting for missing data. Getting the
+    fetcher doesn't change its settings, as another thread (eg. a background
+    prefetch) may be using it; callers which want prompting must enable it
+    themselves with `Fetcher.set_prompt_on_missing_data`.
+    """
+    with shared_lock:
+        fetcher = shared_fetchers.get(youtube_api_key)
+
+        if fetcher is None:
+            fetcher = get_fetcher(youtube_api_key, cache=get_shared_cache())
+            fetcher.set_prompt_on_missing_data(False)
+            shared_fetchers[youtube_api_key] = fetcher
+
+    return fetcher
+
+
+def get_shared_cache():
+    """Return the video data cache configured by config/config.json, creating it
+    the first time it's needed. All fetchers in the application should use this
+    cache (rather than one of their own created with `get_cache`), so that they
+    don't overwrite each other's changes to the cache file."""
+    global shared_cache
+
+    with shared_lock:
+        if shared_cache is None:
+            shared_cache = get_cache(load_config_json("config/config.json"))
+
+        return shared_cache
+
+
+def close_shared_fetchers():
+    """Close the shared fetchers and the shared cache."""
+    global shared_cache
+
+    with shared_lock:
+        for fetcher in shared_fetchers.values():
+            fetcher.close()
+        shared_fetchers.clear()
+
+        if shared_cache is not None and hasattr(shared_cache, "close"):
+            shared_cache.close()
+        shared_cache = None
+
+
+atexit.register(close_shared_fetchers)
+
+
+def configure_fetcher(
+    fetcher: Fetcher, youtube_api_key: str = None, config: dict = None, cache=None
+) -> Fetcher:
+    """Configure the given fetcher with the cache and fetch services selected by
+    the configuration (or by config/config.json, if no configuration is given),
+    and return it. If a cache is given, it's used instead of creating one."""
+    if config is None:
+        config = load_config_json("config/config.json")
+    fetch_mode = config.get("fetch_mode", {}).get("mode", "live")
+
     fetcher.set_printer(ConsolePrinter())
+    fetcher.set_metrics(fetch_metrics)
+    fetcher.set_http_session(PooledSession(**config.get("http", {})))
 
-    # If configured, set up a cache file for video data
-    if (cache_file := config["paths"]["cache"]) is not None:
-        inf(f"  * Fetched video data will be cached in {cache_file}.")
-        fetcher.set_cache(FileCache(cache_file))
+    # If configured, set up a cache for video data. Failed fetches are also
+    # cached for a short time, so that reruns don't have to wait for known-bad
+    # URLs to fail again. (When recording or replaying, the cache isn't used,
+    # so that every fetch goes through the fetch services.)
+    if fetch_mode != "live":
+        inf(f'  * Fetch mode is "{fetch_mode}"; video data will not be cached.')
+    elif cache is not None or (cache := get_cache(config)) is not None:
+        fetcher.set_cache(cache)
+
+        cache_config = config.get("cache", {})
+        fetcher.set_negative_ttls(cache_config.get("negative_ttl", {}))
+        for url in cache_config.get("recheck_urls", []):
+            fetcher.recheck(url)
 
     # Configure fetch services
     inf("  * Adding fetch services...")
 
     accepted_domains = load_text_data(config["paths"]["accepted_domains"])
 
-    ytdlp_fetch_service = YtDlpFetchService(accepted_domains)
+    ytdlp_fetch_service = YtDlpFetchService(accepted_domains, get_ydl_pool(config))
+
+    youtube_fetch_service = YouTubeFetchService(youtube_api_key)
 
     fetch_services = {
-        "YouTube": YouTubeFetchService(youtube_api_key),
+        "YouTube": youtube_fetch_service,
         "Bilibili": BilibiliFetchService(ytdlp_fetch_service),
         "Derpibooru": DerpibooruFetchService(),
         "yt-dlp": ytdlp_fetch_service,
     }
 
+    if fetch_mode != "live":
+        fetch_services = wrap_fetch_services(fetch_services, config["fetch_mode"])
+
     for name, service in fetch_services.items():
         inf(f'    * Adding "{name}" fetch service.')
         fetcher.add_service(name, service)
 
     suc(f"  * {len(fetch_services)} fetch services added.")
 
+    # Replayed requests aren't rate limited, and don't use any API quota.
+    if fetch_mode == "replay":
+        return fetcher
+
+    # Limit the rate of requests made via each service, as configured.
+    for name, rate_limit in config.get("rate_limits", {}).items():
+        if name in fetch_services:
+            fetcher.set_rate_limiter(name, TokenBucket(**rate_limit))
+
+    # Keep track of how much of the YouTube Data API's daily quota is used.
+    if (quota_ledger_file := config["paths"].get("youtube_quota_ledger")) is not None:
+        quota_config = config.get("youtube_quota", {})
+        quota_ledger = QuotaLedger(
+            quota_ledger_file, quota_config.get("daily_budget", 10000)
+        )
+        youtube_fetch_service.set_quota_ledger(quota_ledger)
+        inf(
+            f"  * {quota_ledger.get_remaining()} units of today's YouTube Data API quota remaining."
+        )
+
     return fetcher
+
+
+def wrap_fetch_services(fetch_services: dict, fetch_mode_config: dict) -> dict:
+    """Wrap each of the given fetch services for recording or replaying, as
+    configured by the "fetch_mode" section of the configuration:
+
+    * "record": Requests are made as normal, and the responses are saved to the
+      "fixtures" directory.
+    * "replay": Responses are loaded from the "fixtures" directory instead of
+      making requests. Each request takes "latency" seconds (plus up to
+      "jitter" seconds), and fails with probability "error_rate"; the random
+      jitter and errors are generated from "seed".
+    """
+    mode = fetch_mode_config["mode"]
+    fixture_dir = fetch_mode_config.get("fixtures", "benchmarks/fixtures")
+
+    if mode == "record":
+        inf(f"  * Recording fetch service responses to {fixture_dir}.")
+        return {
+            name: RecordingFetchService(service, FixtureStore(fixture_dir, name))
+            for name, service in fetch_services.items()
+        }
+
+    if mode == "replay":
+        inf(f"  * Replaying fetch service responses from {fixture_dir}.")
+        return {
+            name: ReplayFetchService(
+                service,
+                FixtureStore(fixture_dir, name),
+                latency=fetch_mode_config.get("latency", 0),
+                jitter=fetch_mode_config.get("jitter", 0),
+                error_rate=fetch_mode_config.get("error_rate", 0),
+                seed=fetch_mode_config.get("seed", 0),
+            )
+            for name, service in fetch_services.items()
+        }
+
+    raise ValueError(f'Unknown fetch mode "{mode}" in configuration')
+
+
+def get_cache(config: dict):
+    """Return the video data cache selected by the "cache" section of the
+    configuration, or None if caching is disabled (ie. the "cache" path is
+    null, whichever backend is selected). If the section has a "memory_tier",
+    the most recently used entries (up to its "max_entries") are also kept in
+    memory, in front of backends which read entries from disk on demand (ie.
+    "sqlite"; the others already keep their entries in memory). If the section
+    has a "policy", the cache is wrapped with a `PolicyCache` to expire and
+    evict entries as configured (see `get_cache_policy`). The following
+    backends are available:
+
+    * "file": The whole cache is stored in a JSON file, which is rewritten every
+      time a new entry is added.
+    * "journal": As "file", but new entries are appended to a journal alongside
+      the JSON file, which is compacted back into it periodically and on exit.
+    * "sqlite": The cache is stored in an SQLite database, and entries are only
+      read from it when they are needed. If the database doesn't exist yet, it
+      is populated from the JSON cache file, if there is one.
+    * "sharded": The cache is split across "num_shards" compressed files in a
+      directory, each of which is only loaded when it's needed. If the
+      directory doesn't exist yet, it's populated from the JSON cache file, if
+      there is one. The policy is applied to each shard separately (with its
+      limits divided between the shards), so that evicting entries only has to
+      read the shards that have been loaded.
+    """
+    cache_config = config.get("cache", {})
+
+    if config["paths"]["cache"] is None:
+        return None
+
+    if cache_config.get("backend") == "sharded":
+        return get_sharded_cache(config)
+
+    cache = get_cache_backend(config)
+    if cache is None:
+        return None
+
+    return wrap_cache(cache, cache_config)
+
+
+def wrap_cache(cache, cache_config: dict, num_shards: int = 1):
+    """Wrap the given cache backend (or one of several shards of it) with the
+    memory tier and policy configured by the "cache" section of the
+    configuration, if any (see `get_cache`). Backends which keep all of their
+    entries in memory anyway aren't given a memory tier."""
+    memory_tier = cache_config.get("memory_tier")
+    if memory_tier is not None and not getattr(cache, "in_memory", False):
+        cache = TieredCache(
+            cache,
+            max(memory_tier.get("max_entries", 1000) // num_shards, 1),
+            metrics=fetch_metrics,
+        )
+
+    if (policy := cache_config.get("policy")) is not None:
+        cache = get_cache_policy(cache, policy, num_shards)
+
+    return cache
+
+
+def get_cache_backend(config: dict):
+    """Return the video data cache backend selected by the "cache" section of
+    the configuration, or None if caching is disabled (see `get_cache`)."""
+    backend = config.get("cache", {}).get("backend", "journal")
+    cache_file = config["paths"]["cache"]
+
+    if cache_file is None:
+        return None
+
+    if backend == "sqlite":
+        sqlite_file = config["paths"]["sqlite_cache"]
+        inf(f"  * Fetched video data will be cached in {sqlite_file}.")
+        is_new = not Path(sqlite_file).exists()
+        cache = SqliteCache(sqlite_file)
+
+        if is_new and Path(cache_file).exists():
+            inf(f"  * Importing existing cached video data from {cache_file}...")
+            json_cache = JournaledFileCache(cache_file)
+            cache.set_many(json_cache.items)
+            cache.flush()
+            json_cache.close()
+
+        return cache
+
+    inf(f"  * Fetched video data will be cached in {cache_file}.")
+
+    if backend == "file":
+        return FileCache(cache_file)
+    if backend == "journal":
+        return JournaledFileCache(cache_file)
+
+    raise ValueError(f'Unknown cache backend "{backend}" in configuration')
+
+
+def get_sharded_cache(config: dict) -> ShardedFileCache:
+    """Return a sharded cache configured by the "cache" section of the
+    configuration (see `get_cache`)."""
+    cache_config = config["cache"]
+    cache_dir = config["paths"]["sharded_cache"]
+    cache_file = config["paths"]["cache"]
+    num_shards = cache_config.get("num_shards", 64)
+
+    wrap_shard = lambda shard: wrap_cache(shard, cache_config, num_shards)
+
+    inf(f"  * Fetched video data will be cached in {cache_dir}.")
+    is_new = not Path(cache_dir).exists()
+    cache = ShardedFileCache(cache_dir, num_shards, wrap_shard)
+
+    if is_new and cache_file is not None and Path(cache_file).exists():
+        inf(f"  * Importing existing cached video data from {cache_file}...")
+        json_cache = JournaledFileCache(cache_file)
+        cache.set_many(json_cache.items)
+        cache.close()
+        json_cache.close()
+
+    return cache
+
+
+def get_cache_policy(cache, policy: dict, num_shards: int = 1) -> PolicyCache:
+    """Wrap the given cache with a `PolicyCache`, configured by the "policy"
+    section of the cache configuration. If the cache is one of several shards,
+    the size limits are divided between them. The options are:
+
+    * "max_entries", "max_bytes": The most entries (or bytes of JSON) to keep;
+      the least recently accessed entries are evicted beyond this.
+    * "ttl": How long, in seconds, entries are kept for, by cache key prefix.
+      Video data is cached under keys beginning with the video's platform (eg.
+      "youtube"; see `functions.url.video_id_extractors`), or with the name of
+      the fetch service for videos that can't be identified from their URLs.
+      Resolved short links are cached under "short-link".
+    * "default_ttl": How long entries whose keys don't match any prefix in
+      "ttl" are kept for.
+    """
+    max_entries = policy.get("max_entries")
+    max_bytes = policy.get("max_bytes")
+
+    return PolicyCache(
+        cache,
+        max_entries=None if max_entries is None else max_entries // num_shards,
+        max_bytes=None if max_bytes is None else max_bytes // num_shards,
+        ttls=policy.get("ttl", {}),
+        default_ttl=policy.get("default_ttl"),
+    )
+
+
+def get_ydl_pool(config: dict) -> YoutubeDLPool | YoutubeDLProcessPool:
+    """Return a pool for running yt-dlp extraction, as configured by the
+    "yt_dlp" section of the configuration. The "executor" setting selects
+    between running extraction on threads ("thread") or in worker processes
+    ("process"), and "workers" sets the size of the pool.
+    """
+    ytdlp_config = config.get("yt_dlp", {})
+    executor = ytdlp_config.get("executor", "thread")
+    workers = ytdlp_config.get("workers", 4)
+
+    if executor == "thread":
+        return YoutubeDLPool(ydl_opts, workers)
+    if executor == "process":
+        inf(f"  * yt-dlp extraction will run in {workers} worker processes.")
+        return YoutubeDLProcessPool(ydl_opts, workers)
+
+    raise ValueError(f'Unknown yt-dlp executor "{executor}" in configuration')
+
+
+def write_fetch_metrics(process_name: str, output_dir: str = "outputs"):
+    """Write the fetch metrics recorded since the last call to this function to
+    JSON and Prometheus text files in the output directory, named after the
+    given process, then reset them."""
+    output_path_prefix = f"{output_dir}/fetch-metrics-{process_name}"
+    json_path, prometheus_path = fetch_metrics.write(output_path_prefix)
+
+    for tier, summary in fetch_metrics.cache_tiers_to_dict().items():
+        inf(
+            f"Cache {tier} tier: {summary['hits']} hits, {summary['misses']} misses."
+        )
+
+    fetch_metrics.reset()
+
+    inf(f"Wrote fetch metrics to {json_path} and {prometheus_path}.")
@@ -52,8 +52,11 @@ def normalize_youtube_url(url: str):
     # Shorts URL                https://www.youtube.com/shorts/{VIDEO ID}
 
     video_id = None
-    
-    if path.split("/")[1] in ["watch", "shorts", "live"]:
+
+    # Bare URLs (eg. https://youtu.be) have no path to take the video id from.
+    first_path_segment = path.split("/")[1] if path.startswith("/") else ""
+
+    if first_path_segment in ["watch", "shorts", "live"]:
         if normal_match := re.match(r"^/watch/?\?(?:.*&)?v=([a-zA-Z0-9_-]+)", f"{path}?{url_components.query}"):
             # Regular YouTube URL: eg. https://www.youtube.com/watch?v=9RT4lfvVFhA
             video_id = normal_match.group(1)
@@ -91,3 +94,169 @@ def normalize_derpibooru_url(url: str):
         raise ValueError(f'Cannot normalize Derpibooru URL {url} - path must begin with "/images/"')
 
     return f"{scheme}://{netloc}{path}"
+
+
+def get_url_host(url: str) -> str:
+    """Return the lowercase hostname of the given URL, without any "www.", "m."
+    or "mobile." prefix. Returns an empty string if the URL has no hostname."""
+    host = urlparse(url).hostname or ""
+
+    for prefix in ["www.", "m.", "mobile."]:
+        host = host.removeprefix(prefix)
+
+    return host
+
+
+def get_domain_suffixes(url: str) -> list[str]:
+    """Return the hostname of the given URL followed by each of its parent
+    domains, most specific first; eg. "https://www.youtube.com/watch?v=..."
+    gives ["www.youtube.com", "youtube.com", "com"]. Returns an empty list if
+    the URL has no hostname."""
+    if "://" not in url:
+        url = f"https://{url}"
+
+    labels = (urlparse(url).hostname or "").split(".")
+
+    return [".".join(labels[i:]) for i in range(len(labels)) if labels[i]]
+
+
+def is_url_on_domain(url: str, domains) -> bool:
+    """Return True if the given URL's hostname is one of the given domains, or
+    a subdomain of one of them. Only the hostname is checked, so a domain
+    appearing elsewhere in the URL (eg. in the query string) doesn't count."""
+    return any(suffix in domains for suffix in get_domain_suffixes(url))
+
+
+def extract_youtube_video_id(url: str) -> str | None:
+    """Return the video id from a YouTube URL."""
+    try:
+        _, video_id = normalize_youtube_url(url)
+    except ValueError:
+        return None
+
+    return video_id
+
+
+def extract_derpibooru_video_id(url: str) -> str | None:
+    """Return the post id from a Derpibooru URL."""
+    if id_match := re.match(r"^/images/([0-9]+)", urlparse(url).path):
+        return id_match.group(1)
+
+
+def extract_twitter_video_id(url: str) -> str | None:
+    """Return the post id from a Twitter/X URL. Posts can contain several
+    videos, so for any video other than the first, its index is appended to
+    the id."""
+    path = urlparse(url).path
+
+    if id_match := re.match(r"^/[^/]+/status/([0-9]+)(?:/video/([0-9]+))?", path):
+        post_id, video_index = id_match.groups()
+        if video_index is None or video_index == "1":
+            return post_id
+        return f"{post_id}/{video_index}"
+
+
+def extract_bilibili_video_id(url: str) -> str | None:
+    """Return the BV id from a bilibili URL. b23.tv share links don't contain
+    the id, so they have to be resolved by following their redirect instead."""
+    url_components = urlparse(url)
+
+    if id_match := re.match(r"^/video/([a-zA-Z0-9]+)", url_components.path):
+        return id_match.group(1)
+    if bvid := parse_qs(url_components.query).get("bvid"):
+        return bvid[0]
+
+
+def extract_instagram_video_id(url: str) -> str | None:
+    """Return the shortcode from an Instagram post or reel URL."""
+    if id_match := re.match(
+        r"^(?:/[^/]+)?/(?:p|reels?|tv)/([a-zA-Z0-9_-]+)", urlparse(url).path
+    ):
+        return id_match.group(1)
+
+
+def extract_tiktok_video_id(url: str) -> str | None:
+    """Return the video id from a TikTok URL."""
+    if id_match := re.match(r"^/@[^/]+/video/([0-9]+)", urlparse(url).path):
+        return id_match.group(1)
+
+
+def extract_bluesky_video_id(url: str) -> str | None:
+    """Return the post id from a Bluesky URL. Post ids are only unique per
+    account, so the account handle is included."""
+    if id_match := re.match(r"^/profile/([^/]+)/post/([a-zA-Z0-9]+)", urlparse(url).path):
+        return f"{id_match.group(1).lower()}/{id_match.group(2)}"
+
+
+def extract_vimeo_video_id(url: str) -> str | None:
+    """Return the video id from a Vimeo URL."""
+    if id_match := re.match(r"^/([0-9]+)", urlparse(url).path):
+        return id_match.group(1)
+
+
+def extract_dailymotion_video_id(url: str) -> str | None:
+    """Return the video id from a Dailymotion or dai.ly URL."""
+    url_components = urlparse(url)
+
+    if get_url_host(url) == "dai.ly":
+        id_match = re.match(r"^/([a-zA-Z0-9]+)", url_components.path)
+    else:
+        id_match = re.match(r"^/video/([a-zA-Z0-9]+)", url_components.path)
+
+    if id_match:
+        return id_match.group(1)
+
+
+def extract_newgrounds_video_id(url: str) -> str | None:
+    """Return the submission id from a Newgrounds URL."""
+    if id_match := re.match(r"^/portal/view/([0-9]+)", urlparse(url).path):
+        return id_match.group(1)
+
+
+def extract_peertube_video_id(url: str) -> str | None:
+    """Return the short video id from a PeerTube URL (as used by pony.tube and
+    pt.thishorsie.rocks)."""
+    if id_match := re.match(r"^/w/([a-zA-Z0-9]+)", urlparse(url).path):
+        return id_match.group(1)
+
+
+# Video id extractors for each platform, indexed by the platform's hosts. Each
+# extractor takes a URL and returns the id of the video on that platform, or
+# None if the id can't be determined from the URL alone.
+video_id_extractors = {
+    "youtube.com": ("youtube", extract_youtube_video_id),
+    "youtu.be": ("youtube", extract_youtube_video_id),
+    "derpibooru.org": ("derpibooru", extract_derpibooru_video_id),
+    "twitter.com": ("twitter", extract_twitter_video_id),
+    "x.com": ("twitter", extract_twitter_video_id),
+    "bilibili.com": ("bilibili", extract_bilibili_video_id),
+    "instagram.com": ("instagram", extract_instagram_video_id),
+    "tiktok.com": ("tiktok", extract_tiktok_video_id),
+    "bsky.app": ("bluesky", extract_bluesky_video_id),
+    "vimeo.com": ("vimeo", extract_vimeo_video_id),
+    "dailymotion.com": ("dailymotion", extract_dailymotion_video_id),
+    "dai.ly": ("dailymotion", extract_dailymotion_video_id),
+    "newgrounds.com": ("newgrounds", extract_newgrounds_video_id),
+    "pony.tube": ("pony.tube", extract_peertube_video_id),
+    "pt.thishorsie.rocks": ("pt.thishorsie.rocks", extract_peertube_video_id),
+}
+
+
+def get_video_identity(url: str) -> tuple[str, str] | None:
+    """Given a video URL, return a (platform, video id) tuple that identifies
+    the video regardless of which variant of the URL was used; eg.
+    "https://x.com/user/status/123" and "https://twitter.com/user/status/123"
+    have the same identity. Returns None if the video can't be identified from
+    the URL."""
+    if "://" not in url:
+        url = f"https://{url}"
+
+    if (host := get_url_host(url)) not in video_id_extractors:
+        return None
+
+    platform, extract_video_id = video_id_extractors[host]
+
+    if (video_id := extract_video_id(url)) is None:
+        return None
+
+    return platform, video_id
@@ -1,19 +1,32 @@
-from functions.services import get_fetcher
+from functions.services import get_shared_fetcher
 from functions.messages import suc, inf, err
 
 
 def fetch_videos_data(yt_api_key: str, urls: list[str]) -> dict[str, dict]:
     """Given a list of video URLs, return a dictionary mapping each URL to its
-    data."""
-    fetcher = get_fetcher(yt_api_key)
+    data. The video data is fetched with the shared fetcher for the API key
+    (see `functions.services.get_shared_fetcher`). The user isn't asked to fill
+    in incomplete video data, so none is set aside for a later run to ask
+    about."""
+    fetcher = get_shared_fetcher(yt_api_key)
+    fetcher.set_prompt_on_missing_data(False)
+    urls = list(urls)
 
+    return get_videos_data_from_fetch_results(urls, fetcher.fetch_many(urls))
+
+
+def get_videos_data_from_fetch_results(
+    urls: list[str], fetch_results: list
+) -> dict[str, dict]:
+    """Given a list of URLs and the fetcher's results for them, return a
+    dictionary mapping each URL to its data, or to None if its fetch failed."""
     videos_data = {}
-    for url in urls:
+    for url, fetch_result in zip(urls, fetch_results):
         video_data = None
-        try:
-            video_data = fetcher.fetch(url)
-        except Exception as e:
+        if isinstance(fetch_result, Exception):
             err(f"WARNING: Could not fetch data for URL {url}")
+        else:
+            video_data = fetch_result
 
         videos_data[url] = video_data
 
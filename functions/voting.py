@@ -1,6 +1,7 @@
 """Functions related to processing the votes CSV."""
 
 import csv
+from collections.abc import Callable
 from pathlib import Path
 from functions.date import parse_votes_csv_timestamp, format_votes_csv_timestamp
 from functions.url import (
@@ -31,12 +32,19 @@ def load_votes_csv(csv_file_path_str: str) -> list[list[str]]:
     return rows
 
 
-def normalize_voting_data(rows: list[list[str]]) -> list[list[str]]:
+def normalize_voting_data(
+    rows: list[list[str]], resolve_short_link: Callable[[str], str] = None
+) -> list[list[str]]:
     """Given a set of data rows from a voting CSV, replace all of the URLs with
     "normalized" forms, such that different forms of the same URL become
     identical. This makes the output neater and prevents accidental
     undercounting.
 
+    If `resolve_short_link` is given, it's used to replace short links (eg.
+    b23.tv share links) with the URLs they redirect to (see
+    `Fetcher.resolve_short_link`). Short links which can't be resolved are left
+    unchanged, so that the error is reported when they're fetched.
+
     The data is assumed to be from the "unshifted" version of the voting data
     (ie. the voting CSV as obtained from Google Forms)."""
     normalized_rows = [[cell.strip() for cell in row] for row in rows]
@@ -49,6 +57,11 @@ def normalize_voting_data(rows: list[list[str]]) -> list[list[str]]:
                 continue
             if "://" not in cell:
                 cell = f"https://{cell}"
+            if resolve_short_link is not None:
+                try:
+                    cell = resolve_short_link(cell)
+                except Exception:
+                    pass
             if is_youtube_url(cell):
                 cell, _ = normalize_youtube_url(cell)
             if is_derpibooru_url(cell):
@@ -96,42 +109,53 @@ def fetch_video_data_for_ballots(
 
     If a video fails to fetch, include the reason for the failure (if known) in
     the fetch result. This helps with annotating the votes later.
+
+    If the fetcher is set to prompt for missing data, the user is asked to fill
+    in any incomplete video data once all of the videos have been fetched.
     """
-    videos = {}
+    urls = [vote.url for ballot in ballots for vote in ballot.votes]
 
-    for ballot in ballots:
-        for vote in ballot.votes:
-            # Skip fetch if we already fetched data for this URL.
-            #
-            # TODO: It's possible for different URLs to resolve to the same
-            # video, which could mean they're fetched more than once. Python's
-            # `urllib.parse` library might be useful for normalizing URLs into a
-            # consistent canonical form.
-            if vote.url in videos:
-                continue
+    # Fetch each URL once, even if it was voted for many times. (Different URLs
+    # for the same video are also only fetched once; the fetcher takes care of
+    # that).
+    unique_urls = list(dict.fromkeys(urls))
+    fetch_results = fetcher.fetch_many(unique_urls)
+    fetch_results = fetcher.complete_fetch_results(unique_urls, fetch_results)
 
-            video = Video()
+    return get_videos_from_fetch_results(unique_urls, fetch_results)
 
-            try:
-                video.data = fetcher.fetch(vote.url)
-            except UnsupportedHostError:
-                video.annotations.add("UNSUPPORTED HOST")
-            except VideoUnavailableError:
-                video.annotations.add("VIDEO UNAVAILABLE")
-            except Exception as e:
-                video.annotations.add("COULD NOT FETCH")
 
-            # Validate the fetched data to ensure it has all the fields we need
-            # for our checks. If it doesn't, this might mean that the fetch
-            # service needs updating to provide all required fields.
-            if video.data is not None:
-                missing_fields = validate_video_data(video.data)
-                if len(missing_fields) > 0:
-                    raise SchemaValidationError(
-                        f'Error when validating video data for URL "{vote.url}"; the following fields are missing: {", ".join(missing_fields)}'
-                    )
+def get_videos_from_fetch_results(
+    urls: list[str], fetch_results: list
+) -> dict[str, Video]:
+    """Given a list of URLs and the fetcher's results for them, return a
+    dictionary mapping each URL to a video, annotated with the reason for the
+    failure if its fetch failed."""
+    videos = {}
 
-            videos[vote.url] = video
+    for url, fetch_result in zip(urls, fetch_results):
+        video = Video()
+
+        if isinstance(fetch_result, UnsupportedHostError):
+            video.annotations.add("UNSUPPORTED HOST")
+        elif isinstance(fetch_result, VideoUnavailableError):
+            video.annotations.add("VIDEO UNAVAILABLE")
+        elif isinstance(fetch_result, Exception):
+            video.annotations.add("COULD NOT FETCH")
+        else:
+            video.data = fetch_result
+
+        # Validate the fetched data to ensure it has all the fields we need
+        # for our checks. If it doesn't, this might mean that the fetch
+        # service needs updating to provide all required fields.
+        if video.data is not None:
+            missing_fields = validate_video_data(video.data)
+            if len(missing_fields) > 0:
+                raise SchemaValidationError(
+                    f'Error when validating video data for URL "{url}"; the following fields are missing: {", ".join(missing_fields)}'
+                )
+
+        videos[url] = video
 
     return videos
 
@@ -0,0 +1,30 @@
+"""Functions run by yt-dlp extraction worker processes (see
+`classes.fetch_services.YoutubeDLProcessPool`). Each worker process imports this
+module when it starts, so it deliberately avoids importing anything else from
+the application; importing `functions.messages`, for example, would reset the
+log file.
+"""
+
+from yt_dlp import YoutubeDL, DownloadError
+
+# The worker process's own YoutubeDL instance, created when the worker starts.
+worker_ydl = None
+
+
+def init_worker(options: dict):
+    """Create the worker process's YoutubeDL instance."""
+    global worker_ydl
+    worker_ydl = YoutubeDL(options)
+
+
+def extract_info(url: str) -> dict:
+    """Extract video info for the given URL, and return it as a plain dictionary
+    that can be sent back to the parent process."""
+    try:
+        info = worker_ydl.extract_info(url, download=False)
+    except Exception as e:
+        # yt-dlp exceptions can hold traceback information that can't be sent
+        # between processes, so only the message is passed back.
+        raise DownloadError(str(e)) from None
+
+    return worker_ydl.sanitize_info(info)
@@ -9,7 +9,7 @@ import aiohttp
 
 from tkinter import filedialog, Event, ttk
 from PIL import ImageTk, Image
-from yt_dlp import YoutubeDL, DownloadError
+from yt_dlp import DownloadError
 from classes.typing import ArchiveRecord, StatusRow
 from classes.enums import VideoState, CSVType
 from classes.gui import GUI
@@ -18,7 +18,9 @@ from functions.archive import (
     load_top_10_master_archive,
     load_honorable_mentions_archive
 )
+from functions.config import load_config_json
 from functions.messages import inf
+from functions.services import get_ydl_pool
 
 
 blocked_everywhere_indicator = "EVERYWHERE EXCEPT:"
@@ -40,7 +42,7 @@ class ArchiveStatusChecker(GUI):
     def reset_vars(self):
         self.processed_rows = 0
         self.starting_row_num = 2
-        self.ydl = None
+        self.ydl_pool = None
         self.output_csv_path = ""
         self.archive_records = []
         self.checking_range = []
@@ -353,7 +355,9 @@ class ArchiveStatusChecker(GUI):
 
         else:
             try:
-                info_dict = self.ydl.extract_info(video_url, download=False)
+                # Extraction runs on a worker thread or process, so that it
+                # doesn't block the event loop.
+                info_dict = await asyncio.to_thread(self.ydl_pool.extract_info, video_url)
 
                 if info_dict.get("upload_date") is None:
                     return None, set([VideoState.UNAVAILABLE]), []
@@ -427,8 +431,8 @@ class ArchiveStatusChecker(GUI):
         if "cookiefile" not in ydl_opts:
             inf("Note: Couldn't find data/cookies.txt file. Some requests may yield no data.")
 
-        if self.ydl is None:
-            self.ydl = YoutubeDL(ydl_opts)
+        if self.ydl_pool is None:
+            self.ydl_pool = get_ydl_pool(load_config_json("config/config.json"))
 
         self.starting_row_num = int(self.entry_checks_row_start.get())
         self.processed_rows = 0
@@ -631,8 +635,8 @@ class ArchiveStatusChecker(GUI):
         )
     
     def quit(self):
-        if self.ydl is not None:
-            self.ydl.close()
+        if self.ydl_pool is not None:
+            self.ydl_pool.close()
         
         self.reset_vars()
 
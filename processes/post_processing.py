@@ -16,6 +16,7 @@ from functions.post_processing import (
     generate_showcase_description,
 )
 from functions.video_data import fetch_videos_data
+from functions.services import write_fetch_metrics
 from functions.top_10_parser import parse_calculated_top_10_csv
 from functions.messages import suc, inf, err
 from classes.gui import GUI
@@ -145,9 +146,19 @@ class PostProcessing(GUI):
             for url in group:
                 history_video_urls.append(url)
 
-        top_10_videos_data = fetch_videos_data(yt_api_key, top_10_video_urls)
-        hm_videos_data = fetch_videos_data(yt_api_key, hm_video_urls)
-        history_videos_data = fetch_videos_data(yt_api_key, history_video_urls)
+        # Fetch the data for all three groups of videos at once, so that videos
+        # which appear in more than one group are only fetched once, and as
+        # many as possible are requested together.
+        all_video_urls = list(
+            dict.fromkeys(top_10_video_urls + hm_video_urls + history_video_urls)
+        )
+        all_videos_data = fetch_videos_data(yt_api_key, all_video_urls)
+
+        top_10_videos_data = {url: all_videos_data[url] for url in top_10_video_urls}
+        hm_videos_data = {url: all_videos_data[url] for url in hm_video_urls}
+        history_videos_data = {
+            url: all_videos_data[url] for url in history_video_urls
+        }
 
         top10_archive_records = generate_top10_archive_records(
             top_10_records, top_10_videos_data
@@ -179,6 +190,7 @@ class PostProcessing(GUI):
             file.write(showcase_desc)
 
         suc(f"Wrote showcase description to {desc_file}.")
+        write_fetch_metrics("post_processing")
         suc("Finished.")
 
         tk.messagebox.showinfo(
@@ -27,6 +27,7 @@ from functions.date import (
 from functions.general import pad_csv_rows
 from functions.archive import load_top_10_master_archive, load_archive, convert_ancient_to_master_format
 from functions.video_data import fetch_videos_data
+from functions.services import write_fetch_metrics
 from functions.messages import suc, inf, err
 from classes.gui import GUI
 
@@ -331,6 +332,7 @@ class Top10Calculator(GUI):
                 output_csv_writer.writerows(output_records)
                 suc(f"* Wrote calculated rankings to {output_csv_path}.")
 
+        write_fetch_metrics("top_10_calculator")
         suc("Finished.")
 
         if len(output_csv_paths) == 1:
@@ -43,11 +43,12 @@ from functions.ballot_rules import (
     check_ballot_uploader_diversity,
 )
 from functions.messages import suc, inf, err
-from functions.services import get_fetcher
+from functions.services import get_shared_fetcher, write_fetch_metrics
 from functions.similarity import detect_cross_platform_uploads
 
 # from classes.ui import CSVEditor
 from classes.gui import GUI
+from classes.prefetch import VotesPrefetch
 
 
 # Application configuration
@@ -61,6 +62,12 @@ window_config = {
 
 
 class VoteProcessing(GUI):
+    def __init__(self):
+        super().__init__()
+
+        # Background prefetch of the video data for the selected votes CSV.
+        self.prefetch: VotesPrefetch = None
+
     def gui(self, root):
         root.title(window_config["title"])
         root.geometry(f'{window_config["width"]}x{window_config["height"]}')
@@ -106,6 +113,9 @@ class VoteProcessing(GUI):
         input_file_entry.grid(column=1, row=0, padx=8, pady=(2, 8))
         browse_button.grid(column=2, row=0, padx=8, pady=(2, 8))
 
+        self.prefetch_label = tk.Label(inputs_frame)
+        self.prefetch_label.pack()
+
         # Create options frame
         options_frame = tk.Frame(main_frame)
         ballot_checks_frame = tk.LabelFrame(options_frame, text="Ballot Checks")
@@ -158,7 +168,11 @@ class VoteProcessing(GUI):
             },
             "ensure_complete_data": {
                 "label": "Ensure Complete Data",
-                "tooltip": "Prompt for manual inputs in the console if a fetched video is missing data.",
+                "tooltip": "Once all videos have been fetched, prompt for manual inputs in the console for any videos that are missing data.",
+            },
+            "prefetch": {
+                "label": "Prefetch Video Data",
+                "tooltip": "Start fetching video data in the background as soon as a votes CSV is chosen.",
             },
             "debug": {
                 "label": "Enable Debug Files (Broken LOL)",
@@ -196,6 +210,10 @@ class VoteProcessing(GUI):
 
         # Auto-set some options
         self.tools_vars["detect_cross_platform"].set(True)
+        self.tools_vars["prefetch"].set(True)
+
+        # Start prefetching whenever a votes CSV is chosen or entered.
+        self.csv_entry_var.trace_add("write", lambda *args: self.start_prefetch())
 
         ballot_checks_frame.grid(row=0, column=0, sticky="N", padx=5, pady=5)
         tools_frame.grid(row=0, column=1, sticky="N", padx=5, pady=5)
@@ -252,6 +270,69 @@ class VoteProcessing(GUI):
         file_path = filedialog.askopenfilename(filetypes=[("CSV Files", "*.csv")])
         self.csv_entry_var.set(file_path)
 
+    def start_prefetch(self):
+        """Start fetching the video data for the selected votes CSV in the
+        background, if prefetching is enabled and the CSV file exists. The video
+        data is cached by the fetcher, so when the checks are run, they don't
+        need to wait for it to be fetched (see `join_prefetch`)."""
+        selected_csv_file = self.csv_entry_var.get().strip()
+
+        if not self.tools_vars["prefetch"].get():
+            return
+        if not Path(selected_csv_file).is_file():
+            return
+
+        # Don't prompt for an API key yet; the checks will do that.
+        youtube_api_key = GUI.get_api_key(show_error=False)
+        if youtube_api_key is None:
+            return
+
+        if self.prefetch is not None and self.prefetch.is_current(
+            selected_csv_file, youtube_api_key
+        ):
+            return
+
+        # The shared fetcher is created on the prefetch thread, as the first
+        # call loads the cache, which would otherwise freeze the GUI.
+        inf(f'Prefetching video data for "{selected_csv_file}" in the background...')
+        self.prefetch = VotesPrefetch(
+            selected_csv_file, youtube_api_key, get_shared_fetcher
+        )
+        self.prefetch.start()
+        self.prefetch_progress_loop()
+
+    def prefetch_progress_loop(self):
+        """Update the prefetch progress label from the main thread until the
+        prefetch is done."""
+        if not self.prefetch_label.winfo_exists():
+            return
+
+        self.prefetch_label.config(text=self.prefetch.get_status())
+
+        if not self.prefetch.is_done():
+            self.root.after(100, self.prefetch_progress_loop)
+
+    def join_prefetch(
+        self, selected_csv_file: str, youtube_api_key: str
+    ) -> list[list[str]]:
+        """If the video data for the selected votes CSV is being (or has been)
+        prefetched, wait for the prefetch to finish, and return the normalized
+        voting data it loaded. Otherwise, return None."""
+        if self.prefetch is None or not self.prefetch.is_current(
+            selected_csv_file, youtube_api_key
+        ):
+            return None
+
+        if not self.prefetch.is_done():
+            inf("Waiting for the background prefetch to finish...")
+        self.prefetch.join()
+
+        # The prefetch may have failed after it was checked above.
+        if self.prefetch.error is not None:
+            return None
+
+        return self.prefetch.normalized_voting_data
+
     def run_checks(self):
         """Handler for the "Run Checks" button. Reads in the selected CSV file, runs
         a battery of checks on the voting data, and outputs an annotated version of
@@ -277,21 +358,30 @@ class VoteProcessing(GUI):
 
         inf(f'Preparing to run checks on "{selected_csv_file}"...')
 
-        fetcher = get_fetcher(youtube_api_key)
-        fetcher.set_prompt_on_missing_data(self.tools_vars["ensure_complete_data"].get())
-
-        # Load all ballots from the CSV file.
-        inf(f'Loading all votes from CSV file "{selected_csv_file}"...')
-        voting_data = load_votes_csv(selected_csv_file)
-        inf(f" * Loaded {len(voting_data)} data rows.")
-
-        inf(" * Performing URL normalization...")
-        try:
-            normalized_voting_data = normalize_voting_data(voting_data)
-        except Exception as e:
-            traceback.print_exc()
-            tk.messagebox.showinfo("Error", f"{e}\nMore details in console")
-            return
+        # If the votes were loaded and normalized by the background prefetch,
+        # reuse them; the video data will be in the fetcher's cache as well.
+        normalized_voting_data = self.join_prefetch(
+            selected_csv_file, youtube_api_key
+        )
+        fetcher = get_shared_fetcher(youtube_api_key)
+
+        if normalized_voting_data is not None:
+            inf(f'Using votes prefetched from CSV file "{selected_csv_file}".')
+        else:
+            # Load all ballots from the CSV file.
+            inf(f'Loading all votes from CSV file "{selected_csv_file}"...')
+            voting_data = load_votes_csv(selected_csv_file)
+            inf(f" * Loaded {len(voting_data)} data rows.")
+
+            inf(" * Performing URL normalization...")
+            try:
+                normalized_voting_data = normalize_voting_data(
+                    voting_data, fetcher.resolve_short_link
+                )
+            except Exception as e:
+                traceback.print_exc()
+                tk.messagebox.showinfo("Error", f"{e}\nMore details in console")
+                return
 
         inf(" * Creating ballots...")
         ballots = process_voting_data(normalized_voting_data)
@@ -359,12 +449,18 @@ class VoteProcessing(GUI):
         # have no data if their fetch failed; however, they're still included in the
         # results as the votes still reference them.
         inf("Fetching data for all videos...")
+        # The fetcher is shared with the other processes, so only prompt for
+        # missing data during this fetch.
+        prompt_on_missing_data = fetcher.get_prompt_on_missing_data()
+        fetcher.set_prompt_on_missing_data(self.tools_vars["ensure_complete_data"].get())
         try:
             videos = fetch_video_data_for_ballots(ballots, fetcher)
         except Exception as e:
             traceback.print_exc()
             tk.messagebox.showinfo("Error", f"{e}\nMore details in console")
             return
+        finally:
+            fetcher.set_prompt_on_missing_data(prompt_on_missing_data)
 
         # Print out a summary of the fetch results (number of successes, failures,
         # etc.)
@@ -508,6 +604,8 @@ class VoteProcessing(GUI):
 
         suc(f'Wrote "shifted cells" data to "{shifted_cells_path}".')
 
+        write_fetch_metrics("vote_processing")
+
         suc("Finished checks.")
 
         proc_complete_msgs = []
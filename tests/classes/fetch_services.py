@@ -1,5 +1,18 @@
+import json, threading, time
+import httplib2
 from unittest import TestCase
-from classes.fetch_services import YouTubeFetchService
+from googleapiclient.errors import HttpError
+from yt_dlp.utils import DownloadError
+from classes.fetch_services import (
+    YouTubeFetchService,
+    YtDlpFetchService,
+    YoutubeDLPool,
+)
+from classes.exceptions import (
+    VideoUnavailableError,
+    FetchRequestError,
+    RateLimitedError,
+)
 
 
 class TestFetchServices(TestCase):
@@ -40,3 +53,173 @@ class TestFetchServices(TestCase):
         url = "https://pony.tube/w/2FCj5YvmdHy8AC2hkEbc9i"
         self.assertFalse(service.can_fetch(url))
         self.assertEqual(None, service.extract_video_id(url))
+
+    def test_YouTubeFetchService_request_batch(self):
+        class MockRequest:
+            def __init__(self, response):
+                self.response = response
+
+            def execute(self):
+                return self.response
+
+        class MockVideos:
+            def __init__(self):
+                self.requested_ids = []
+
+            def list(self, part, id, maxResults):
+                self.requested_ids.append(id)
+                items = [
+                    {
+                        "id": video_id,
+                        "snippet": {
+                            "title": f"Video {video_id}",
+                            "channelTitle": "Uploader",
+                            "publishedAt": "2024-03-01T00:00:00Z",
+                        },
+                        "contentDetails": {"duration": "PT1M30S"},
+                    }
+                    for video_id in id.split(",")
+                    if video_id != "unavailabl1"
+                ]
+                return MockRequest({"items": items})
+
+        class MockYouTubeService:
+            def __init__(self):
+                self.mock_videos = MockVideos()
+
+            def videos(self):
+                return self.mock_videos
+
+        service = YouTubeFetchService()
+        service.yt_service = MockYouTubeService()
+
+        urls = [
+            "https://www.youtube.com/watch?v=9RT4lfvVFhA",
+            "https://youtu.be/9RT4lfvVFhA",
+            "https://www.youtube.com/watch?v=unavailabl1",
+            "https://www.youtube.com/watch?v=bad",
+        ]
+        results = service.request_batch(urls)
+
+        # Both forms of the same video are requested with one id
+        self.assertEqual(
+            ["9RT4lfvVFhA,unavailabl1"], service.yt_service.mock_videos.requested_ids
+        )
+        self.assertEqual("Video 9RT4lfvVFhA", results[urls[0]]["title"])
+        self.assertEqual(90, results[urls[1]]["duration"])
+        self.assertIsInstance(results[urls[2]], VideoUnavailableError)
+        self.assertIsInstance(results[urls[3]], ValueError)
+
+        # Too many ids for one request
+        urls = [f"https://www.youtube.com/watch?v={i:011d}" for i in range(51)]
+        with self.assertRaises(ValueError):
+            service.request_batch(urls)
+
+    def test_YouTubeFetchService_deferred_api_service(self):
+        # The API service isn't created until it's first used
+        service = YouTubeFetchService("api-key")
+        self.assertNotIn("yt_service", service.__dict__)
+
+        yt_service = service.yt_service
+        self.assertIs(yt_service, service.yt_service)
+
+        # Without an API key, using the API service fails
+        service = YouTubeFetchService()
+        with self.assertRaises(FetchRequestError):
+            service.request("https://www.youtube.com/watch?v=9RT4lfvVFhA")
+
+    def test_YouTubeFetchService_error_responses(self):
+        class MockRequest:
+            def __init__(self, status, reason):
+                self.status = status
+                self.reason = reason
+
+            def execute(self):
+                content = {"error": {"errors": [{"reason": self.reason}]}}
+                raise HttpError(
+                    httplib2.Response({"status": self.status}),
+                    json.dumps(content).encode(),
+                )
+
+        service = YouTubeFetchService()
+
+        # Rate limiting can be retried
+        for reason in ["rateLimitExceeded", "userRateLimitExceeded"]:
+            with self.assertRaises(RateLimitedError):
+                service.execute(MockRequest(403, reason), "a video")
+
+        # Running out of quota can't
+        for reason in ["quotaExceeded", "dailyLimitExceeded"]:
+            with self.assertRaises(FetchRequestError) as context:
+                service.execute(MockRequest(403, reason), "a video")
+            self.assertNotIsInstance(context.exception, RateLimitedError)
+
+        # Nor can an invalid API key
+        for status, reason in [(400, "keyInvalid"), (403, "forbidden")]:
+            with self.assertRaises(FetchRequestError) as context:
+                service.execute(MockRequest(status, reason), "a video")
+            self.assertNotIsInstance(context.exception, RateLimitedError)
+
+    def test_YtDlpFetchService_errors(self):
+        class MockYoutubeDLPool:
+            def __init__(self, message):
+                self.message = message
+
+            def extract_info(self, url):
+                raise DownloadError(self.message)
+
+        def request_error(message):
+            service = YtDlpFetchService(["example.com"], MockYoutubeDLPool(message))
+            try:
+                service.request("https://example.com/video/1")
+            except Exception as e:
+                return e
+
+        # Videos that are gone for good are unavailable, so can be
+        # negative-cached
+        for message in [
+            "ERROR: [youtube] abc: Video unavailable",
+            "ERROR: [youtube] abc: Private video. Sign in if you've been granted access",
+            "ERROR: [vimeo] 123: This video has been removed",
+            "ERROR: [generic] Unable to download webpage: HTTP Error 404: Not Found",
+        ]:
+            self.assertIsInstance(request_error(message), VideoUnavailableError)
+
+        # Rate limiting can be retried, and other errors are left as they are
+        self.assertIsInstance(
+            request_error("ERROR: Unable to download: HTTP Error 429: Too Many Requests"),
+            RateLimitedError,
+        )
+        error = request_error("ERROR: Unable to download webpage: timed out")
+        self.assertIsInstance(error, FetchRequestError)
+        self.assertNotIsInstance(error, (VideoUnavailableError, RateLimitedError))
+
+    def test_YoutubeDLPool(self):
+        pool = YoutubeDLPool({"quiet": True}, size=2)
+
+        # Instances are reused once they're returned to the pool
+        with pool.checkout() as ydl_1:
+            pass
+        with pool.checkout() as ydl_2:
+            pass
+        self.assertIs(ydl_1, ydl_2)
+
+        # Instances checked out at the same time are different, and no more than
+        # `size` instances are created
+        checked_out = []
+
+        def hold_instance():
+            with pool.checkout() as ydl:
+                checked_out.append(ydl)
+                time.sleep(0.05)
+
+        threads = [threading.Thread(target=hold_instance) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(4, len(checked_out))
+        self.assertEqual(2, len(set(map(id, checked_out))))
+
+        pool.close()
@@ -1,6 +1,31 @@
+import threading, time
+from datetime import datetime, timezone
 from unittest import TestCase
 from classes.fetcher import Fetcher
-from classes.exceptions import FetchRequestError, FetchParseError, UnsupportedHostError
+from functions.url import is_youtube_url
+from classes.exceptions import (
+    FetchRequestError,
+    FetchParseError,
+    UnsupportedHostError,
+    VideoUnavailableError,
+    RateLimitedError,
+)
+
+
+class DictCache:
+    """Minimal in-memory cache for testing."""
+
+    def __init__(self, items: dict):
+        self.items = items
+
+    def get(self, key):
+        return self.items[key]
+
+    def set(self, key, value):
+        self.items[key] = value
+
+    def has(self, key):
+        return key in self.items
 
 
 class TestFetcher(TestCase):
@@ -92,3 +117,701 @@ class TestFetcher(TestCase):
         fetcher.add_service("success_mock", service)
         video_data = fetcher.fetch("https://example.com")
         self.assertEqual("Example Video", video_data["title"])
+
+    def test_fetch_many(self):
+        # Test that results come back in input order, with exceptions in place
+        # of results for URLs that failed to fetch
+        class MockFetchService:
+            def can_fetch(self, url):
+                return "example.com" in url
+
+            def request(self, url):
+                if "fail" in url:
+                    raise FetchRequestError("Request failed")
+                return {"title": url}
+
+            def parse(self, response):
+                return {"title": response["title"]}
+
+        fetcher = Fetcher()
+        fetcher.add_service("mock", MockFetchService())
+
+        urls = [
+            "https://example.com/1",
+            "https://example.com/fail",
+            "https://unsupported.com/1",
+            "https://example.com/2",
+            "https://example.com/1",
+        ]
+        results = fetcher.fetch_many(urls)
+
+        self.assertEqual(5, len(results))
+        self.assertEqual({"title": "https://example.com/1"}, results[0])
+        self.assertIsInstance(results[1], FetchRequestError)
+        self.assertIsInstance(results[2], UnsupportedHostError)
+        self.assertEqual({"title": "https://example.com/2"}, results[3])
+        self.assertEqual({"title": "https://example.com/1"}, results[4])
+
+        # Test that progress is reported for each distinct video, starting with
+        # the URLs that can't be fetched at all
+        progress = []
+        fetcher.fetch_many(urls, progress=lambda *args: progress.append(args))
+        self.assertEqual((1, 4), progress[0])
+        self.assertEqual([(2, 4), (3, 4), (4, 4)], sorted(progress[1:]))
+
+    def test_fetch_many_concurrency_limit(self):
+        # Test that no more than `max_concurrency` requests are made via a
+        # service at the same time
+        class SlowMockFetchService:
+            max_concurrency = 2
+
+            def __init__(self):
+                self.lock = threading.Lock()
+                self.active = 0
+                self.max_active = 0
+                self.requested = []
+
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                with self.lock:
+                    self.active += 1
+                    self.max_active = max(self.max_active, self.active)
+                    self.requested.append(url)
+                time.sleep(0.01)
+                with self.lock:
+                    self.active -= 1
+                return {"title": url}
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        service = SlowMockFetchService()
+        fetcher.add_service("slow_mock", service)
+
+        urls = [f"https://example.com/{i}" for i in range(10)]
+        results = fetcher.fetch_many(urls, max_workers=8)
+
+        self.assertEqual([{"title": url} for url in urls], results)
+        self.assertEqual(2, service.max_active)
+
+        # Test that cached URLs aren't requested
+        cache = {"slow_mock-https://example.com/0": {"title": "Cached"}}
+        fetcher = Fetcher()
+        service = SlowMockFetchService()
+        fetcher.add_service("slow_mock", service, max_concurrency=4)
+        fetcher.set_cache(DictCache(cache))
+
+        results = fetcher.fetch_many(urls[:3])
+        self.assertEqual("Cached", results[0]["title"])
+        self.assertEqual(sorted(urls[1:3]), sorted(service.requested))
+
+    def test_fetch_many_batches(self):
+        # Test that URLs for a service that supports batch requests are grouped
+        # into batches of at most `batch_size`
+        class BatchMockFetchService:
+            batch_size = 3
+
+            def __init__(self):
+                self.batches = []
+
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                raise AssertionError("Batch-capable service should not be requested singly")
+
+            def request_batch(self, urls):
+                self.batches.append(urls)
+                return {
+                    url: FetchRequestError("Request failed") if "fail" in url else {"title": url}
+                    for url in urls
+                }
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        service = BatchMockFetchService()
+        fetcher.add_service("batch_mock", service)
+        cache = {}
+        fetcher.set_cache(DictCache(cache))
+
+        urls = [f"https://example.com/{i}" for i in range(7)] + ["https://example.com/fail"]
+        results = fetcher.fetch_many(urls)
+
+        self.assertEqual([3, 3, 2], [len(batch) for batch in service.batches])
+        self.assertEqual([{"title": url} for url in urls[:7]], results[:7])
+        self.assertIsInstance(results[7], FetchRequestError)
+        self.assertEqual(7, len(cache))
+
+    def test_fetch_many_deduplicates_videos(self):
+        # Test that different URLs for the same video are only fetched once,
+        # and share a cache entry
+        class MockFetchService:
+            def __init__(self):
+                self.requested = []
+
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                self.requested.append(url)
+                return {"title": "Video"}
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        service = MockFetchService()
+        fetcher.add_service("mock", service)
+        cache = {}
+        fetcher.set_cache(DictCache(cache))
+
+        urls = [
+            "https://x.com/user/status/123",
+            "https://twitter.com/user/status/123",
+            "https://mobile.twitter.com/user/status/123/video/1",
+        ]
+        results = fetcher.fetch_many(urls)
+
+        self.assertEqual(1, len(service.requested))
+        self.assertEqual([{"title": "Video"}] * 3, results)
+        self.assertEqual(["twitter-123"], list(cache))
+
+        # Test that data cached under the URL-based keys is still used
+        fetcher = Fetcher()
+        service = MockFetchService()
+        fetcher.add_service("mock", service)
+        fetcher.set_cache(
+            DictCache({"mock-https://x.com/user/status/456": {"title": "Old"}})
+        )
+
+        self.assertEqual("Old", fetcher.fetch("https://x.com/user/status/456")["title"])
+        self.assertEqual([], service.requested)
+
+    def test_negative_caching(self):
+        class MockFetchService:
+            def __init__(self):
+                self.requested = []
+
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                self.requested.append(url)
+                if "unavailable" in url:
+                    raise VideoUnavailableError("Video unavailable")
+                if "fail" in url:
+                    raise FetchRequestError("Request failed")
+                raise ValueError("Malformed URL")
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        service = MockFetchService()
+        fetcher.add_service("mock", service)
+        fetcher.set_cache(
+            DictCache(
+                {
+                    # A request error cached by an older version
+                    "mock-https://example.com/fail": {
+                        "negative": {
+                            "error": "FetchRequestError",
+                            "message": "Request failed",
+                            "expires": time.time() + 3600,
+                        }
+                    }
+                }
+            )
+        )
+        fetcher.set_negative_ttls(
+            {"VideoUnavailableError": 3600, "FetchRequestError": 3600}
+        )
+
+        urls = [
+            "https://example.com/unavailable",
+            "https://example.com/fail",
+            "https://example.com/malformed",
+        ]
+
+        for _ in range(2):
+            results = fetcher.fetch_many(urls)
+            self.assertIsInstance(results[0], VideoUnavailableError)
+            self.assertIsInstance(results[1], FetchRequestError)
+            self.assertIsInstance(results[2], ValueError)
+
+        # The unavailable video is cached, but request errors (which may be
+        # temporary) and other errors aren't cached at all
+        self.assertEqual(1, service.requested.count(urls[0]))
+        self.assertEqual(2, service.requested.count(urls[1]))
+        self.assertEqual(2, service.requested.count(urls[2]))
+
+        # A recheck bypasses the cached failure once
+        fetcher.recheck(urls[0])
+        with self.assertRaises(VideoUnavailableError):
+            fetcher.fetch(urls[0])
+        with self.assertRaises(VideoUnavailableError):
+            fetcher.fetch(urls[0])
+        self.assertEqual(2, service.requested.count(urls[0]))
+
+    def test_domain_routing(self):
+        class DomainMockFetchService:
+            def __init__(self, domains):
+                self.domains = domains
+
+            def can_fetch(self, url):
+                raise AssertionError("Indexed services should not be queried")
+
+            def request(self, url):
+                return {"title": url}
+
+            def parse(self, response):
+                return response
+
+        class PredicateMockFetchService:
+            def can_fetch(self, url):
+                return url.endswith(".mp4")
+
+            def request(self, url):
+                return {"title": url}
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        fetcher.add_service("tube", DomainMockFetchService(["tube.com", "tu.be"]))
+        fetcher.add_service("predicate", PredicateMockFetchService())
+        fetcher.add_service("catch_all", DomainMockFetchService(["tube.com", "example.com"]))
+
+        self.assertEqual("tube", fetcher.get_service("https://www.tube.com/1")[0])
+        self.assertEqual("tube", fetcher.get_service("https://tu.be/1")[0])
+        self.assertEqual(
+            ["tube", "predicate", "catch_all"],
+            list(fetcher.get_capable_services("https://m.tube.com/1.mp4")),
+        )
+        self.assertEqual("predicate", fetcher.get_service("https://videos.net/1.mp4")[0])
+
+        # Domains in the query string or partial hostname labels don't match
+        with self.assertRaises(UnsupportedHostError):
+            fetcher.get_service("https://videos.net/?ref=tube.com")
+        with self.assertRaises(UnsupportedHostError):
+            fetcher.get_service("https://youtube.com/1")
+
+    def test_metrics(self):
+        class MockFetchService:
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                if "unavailable" in url:
+                    raise VideoUnavailableError("Video unavailable")
+                return {"title": url}
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        fetcher.add_service("mock", MockFetchService())
+        fetcher.set_cache(DictCache({}))
+        fetcher.set_negative_ttls({"VideoUnavailableError": 3600})
+
+        urls = ["https://example.com/1", "https://example.com/unavailable"]
+        fetcher.fetch_many(urls)
+        fetcher.fetch_many(urls)
+
+        summary = fetcher.get_metrics().to_dict()["mock"]
+        self.assertEqual(2, summary["requests"])
+        self.assertEqual(
+            {"hits": 1, "misses": 2, "negative_hits": 1, "hit_ratio": 0.5},
+            summary["cache"],
+        )
+        self.assertEqual({"VideoUnavailableError": 1}, summary["errors"])
+
+    def test_single_flight(self):
+        class BlockingFetchService:
+            def __init__(self):
+                self.started = threading.Event()
+                self.release = threading.Event()
+                self.requests = 0
+
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                self.requests += 1
+                self.started.set()
+                self.release.wait(5)
+                if "fail" in url:
+                    raise FetchRequestError("Request failed")
+                return {"title": url}
+
+            def parse(self, response):
+                return dict(response)
+
+        for url in ["https://example.com/1", "https://example.com/fail"]:
+            fetcher = Fetcher()
+            service = BlockingFetchService()
+            fetcher.add_service("mock", service)
+
+            results = []
+
+            def fetch():
+                results.append(fetcher.fetch_or_exception(url))
+
+            # Start one fetch, and wait until its request is in flight before
+            # starting the others.
+            threads = [threading.Thread(target=fetch) for _ in range(3)]
+            threads[0].start()
+            service.started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            while fetcher.get_metrics().to_dict()["mock"]["coalesced_requests"] < 2:
+                time.sleep(0.01)
+
+            service.release.set()
+            for thread in threads:
+                thread.join()
+
+            # Successes and failures are both shared with the waiting callers.
+            self.assertEqual(1, service.requests)
+            self.assertEqual(3, len(results))
+            if "fail" in url:
+                self.assertTrue(all(isinstance(r, FetchRequestError) for r in results))
+            else:
+                self.assertEqual([{"title": url}] * 3, results)
+
+    def test_rate_limiting(self):
+        class RateLimitedFetchService:
+            def __init__(self, num_failures):
+                self.num_failures = num_failures
+                self.requests = 0
+
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                self.requests += 1
+                if self.requests <= self.num_failures:
+                    raise RateLimitedError("Too many requests", retry_after=0)
+                return {"title": url}
+
+            def parse(self, response):
+                return response
+
+        class RecordingRateLimiter:
+            def __init__(self):
+                self.acquired = 0
+                self.backoffs = []
+
+            def acquire(self):
+                self.acquired += 1
+
+            def back_off(self, retry_after=None):
+                self.backoffs.append(retry_after)
+                return 0
+
+            def recover(self):
+                pass
+
+        # Rate-limited requests are retried after backing off.
+        fetcher = Fetcher()
+        service = RateLimitedFetchService(2)
+        rate_limiter = RecordingRateLimiter()
+        fetcher.add_service("mock", service)
+        fetcher.set_rate_limiter("mock", rate_limiter)
+
+        self.assertEqual({"title": "https://example.com"}, fetcher.fetch("https://example.com"))
+        self.assertEqual(3, service.requests)
+        self.assertEqual(3, rate_limiter.acquired)
+        self.assertEqual([0, 0], rate_limiter.backoffs)
+
+        # Requests are only retried a limited number of times.
+        fetcher = Fetcher()
+        service = RateLimitedFetchService(10)
+        fetcher.add_service("mock", service)
+        fetcher.set_rate_limiter("mock", RecordingRateLimiter())
+
+        with self.assertRaises(RateLimitedError):
+            fetcher.fetch("https://example.com")
+        self.assertEqual(Fetcher.rate_limit_retries + 1, service.requests)
+
+        # Without a rate limiter, requests aren't retried.
+        fetcher = Fetcher()
+        service = RateLimitedFetchService(1)
+        fetcher.add_service("mock", service)
+
+        with self.assertRaises(RateLimitedError):
+            fetcher.fetch("https://example.com")
+        self.assertEqual(1, service.requests)
+
+    def test_short_links(self):
+        class ShortLinkFetchService:
+            domains = ["short.example", "example.com"]
+
+            def __init__(self):
+                self.resolved = []
+                self.requested = []
+
+            def can_fetch(self, url):
+                return True
+
+            def is_short_link(self, url):
+                return "short.example" in url
+
+            def resolve_short_link(self, url):
+                self.resolved.append(url)
+                if "broken" in url:
+                    raise VideoUnavailableError("No video link was returned")
+                return url.replace("short.example", "example.com/video")
+
+            def request(self, url):
+                self.requested.append(url)
+                return {"title": url}
+
+            def parse(self, response):
+                return response
+
+        cache = DictCache({})
+        fetcher = Fetcher()
+        service = ShortLinkFetchService()
+        fetcher.add_service("mock", service)
+        fetcher.set_cache(cache)
+
+        # Short links are resolved, and the canonical URL is fetched and
+        # cached.
+        self.assertEqual(
+            {"title": "https://example.com/video/1"},
+            fetcher.fetch("https://short.example/1"),
+        )
+        self.assertEqual(["https://example.com/video/1"], service.requested)
+        self.assertEqual(
+            {"resolved_url": "https://example.com/video/1"},
+            cache.items["short-link-short.example/1"],
+        )
+        self.assertIn("mock-https://example.com/video/1", cache.items)
+
+        # Resolved links are remembered, so they aren't resolved again.
+        self.assertTrue(fetcher.is_cached("https://short.example/1?share_source=copy"))
+        self.assertEqual(
+            "https://example.com/video/1",
+            fetcher.resolve_short_link("https://short.example/1"),
+        )
+        self.assertEqual(["https://short.example/1"], service.resolved)
+
+        # Resolution errors are raised, and are the error for fetching the
+        # link; the link isn't resolved again, or requested by the service.
+        with self.assertRaises(VideoUnavailableError):
+            fetcher.resolve_short_link("https://short.example/broken")
+        with self.assertRaises(VideoUnavailableError):
+            fetcher.fetch("https://short.example/broken")
+        self.assertEqual(["https://example.com/video/1"], service.requested)
+
+        # Other URLs are never resolved.
+        self.assertEqual(
+            "https://example.com/2", fetcher.resolve_short_link("https://example.com/2")
+        )
+        self.assertEqual(2, len(service.resolved))
+
+    def test_fetch_many_short_link(self):
+        class BilibiliMockFetchService:
+            domains = ["b23.tv", "bilibili.com"]
+
+            def can_fetch(self, url):
+                return True
+
+            def is_short_link(self, url):
+                return "b23.tv" in url
+
+            def resolve_short_link(self, url):
+                return "https://www.bilibili.com/video/BV1xx411c7mD"
+
+            def request(self, url):
+                return {"title": url}
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        fetcher.add_service("mock", BilibiliMockFetchService())
+        fetcher.set_cache(DictCache({}))
+
+        # Resolving the short link while fetching changes the video it's
+        # recognized as, but its result is still found
+        self.assertEqual(
+            [{"title": "https://www.bilibili.com/video/BV1xx411c7mD"}],
+            fetcher.fetch_many(["https://b23.tv/abc123"]),
+        )
+
+    def test_fetch_many_bare_youtube_urls(self):
+        class YouTubeMockFetchService:
+            def can_fetch(self, url):
+                return is_youtube_url(url)
+
+            def request(self, url):
+                raise ValueError(f"Unable to determine video id from {url}")
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        fetcher.add_service("mock", YouTubeMockFetchService())
+        fetcher.set_cache(DictCache({}))
+
+        # URLs without a video id fail to fetch, without stopping the others
+        urls = ["https://www.youtube.com", "https://youtu.be", "https://youtube.com?x=1"]
+        for result in fetcher.fetch_many(urls):
+            self.assertIsInstance(result, ValueError)
+
+    def test_missing_data(self):
+        class IncompleteFetchService:
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                if "complete" in url:
+                    return {"title": url, "duration": 60}
+                return {"title": url, "duration": None}
+
+            def parse(self, response):
+                return dict(response)
+
+        cache = DictCache({})
+        fetcher = Fetcher()
+        fetcher.set_cache(cache)
+        fetcher.add_service("mock", IncompleteFetchService())
+        fetcher.set_prompt_on_missing_data(True)
+
+        # Incomplete video data is set aside while fetching, rather than
+        # prompting for it
+        urls = [
+            "https://www.youtube.com/watch?v=aaaaaaaaaaa",
+            "https://example.com/complete",
+            "https://youtu.be/aaaaaaaaaaa",
+            "https://example.com/2",
+        ]
+        results = fetcher.fetch_many(urls)
+        self.assertIsNone(results[0]["duration"])
+        self.assertTrue(fetcher.has_missing_data())
+
+        # All of the missing data is resolved at once, and the results for
+        # every URL of the same video are completed
+        resolved_batches = []
+
+        def resolve(videos_data):
+            resolved_batches.append(sorted(videos_data))
+            for video_data in videos_data.values():
+                video_data["duration"] = 90
+
+        results = fetcher.complete_fetch_results(urls, results, resolve)
+
+        self.assertEqual(
+            [["https://example.com/2", "https://www.youtube.com/watch?v=aaaaaaaaaaa"]],
+            resolved_batches,
+        )
+        self.assertEqual([90, 60, 90, 90], [result["duration"] for result in results])
+        self.assertFalse(fetcher.has_missing_data())
+
+        # The completed data is cached, so it isn't incomplete next time
+        fetcher.fetch_many(urls)
+        self.assertFalse(fetcher.has_missing_data())
+
+    def test_cache_schema(self):
+        class VersionedFetchService:
+            cache_version = 1
+
+            def __init__(self):
+                self.num_requests = 0
+                self.num_parses = 0
+
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                self.num_requests += 1
+                return {
+                    "title": url,
+                    "uploader": "Uploader",
+                    "upload_date": "2024-03-01T12:00:00Z",
+                    "duration": 60,
+                    "platform": "Example",
+                }
+
+            def parse(self, video_data):
+                self.num_parses += 1
+                return {
+                    **video_data,
+                    "upload_date": datetime.fromisoformat(video_data["upload_date"]),
+                }
+
+        upload_date = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+        cache = DictCache(
+            {
+                # An unversioned entry, holding unparsed video data
+                "mock-https://example.com/old": {
+                    "title": "Old",
+                    "uploader": "Uploader",
+                    "upload_date": "2024-03-01T12:00:00Z",
+                    "duration": 30,
+                    "platform": "Example",
+                }
+            }
+        )
+        service = VersionedFetchService()
+        fetcher = Fetcher()
+        fetcher.set_cache(cache)
+        fetcher.add_service("mock", service)
+
+        # Requested video data is cached parsed, in compact form
+        fetcher.fetch("https://example.com/new")
+        self.assertEqual(
+            {
+                "schema": 2,
+                "service_version": 1,
+                "video_data": [
+                    "https://example.com/new",
+                    "Uploader",
+                    1709294400,
+                    60,
+                    "Example",
+                ],
+            },
+            cache.items["mock-https://example.com/new"],
+        )
+
+        # Cached video data isn't parsed again
+        service.num_parses = 0
+        video_data = fetcher.fetch("https://example.com/new")
+        self.assertEqual(upload_date, video_data["upload_date"])
+        self.assertEqual(0, service.num_parses)
+
+        # Unversioned entries are parsed, and migrated without a request
+        video_data = fetcher.fetch_many(["https://example.com/old"])[0]
+        self.assertEqual(upload_date, video_data["upload_date"])
+        self.assertEqual(1, service.num_requests)
+        old_entry = cache.items["mock-https://example.com/old"]
+        self.assertEqual(2, old_entry["schema"])
+        self.assertEqual(1709294400, old_entry["video_data"][2])
+
+        # Entries from an older version of the service are migrated by it
+        service.cache_version = 2
+        service.migrate = lambda video_data, version: {
+            **video_data,
+            "title": video_data["title"].upper(),
+        }
+        video_data = fetcher.fetch("https://example.com/old")
+        self.assertEqual("OLD", video_data["title"])
+        self.assertEqual(1, service.num_requests)
+
+        fetcher.close()
+        self.assertEqual(2, cache.items["mock-https://example.com/old"]["service_version"])
+
+        # If the service can't migrate them, they're requested again
+        service.cache_version = 3
+        del service.migrate
+        fetcher.fetch("https://example.com/old")
+        self.assertEqual(2, service.num_requests)
+        self.assertEqual(3, cache.items["mock-https://example.com/old"]["service_version"])
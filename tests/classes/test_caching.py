@@ -0,0 +1,546 @@
+import atexit, json, threading
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from classes.caching import (
+    FileCache,
+    JournaledFileCache,
+    SqliteCache,
+    CompressedFileCache,
+    ShardedFileCache,
+    TieredCache,
+    PolicyCache,
+)
+from classes.metrics import FetchMetrics
+
+
+class TestFileCache(TestCase):
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_path = Path(temp_dir.name) / "cache.json"
+
+    def test_merge_on_write(self):
+        # Two caches sharing a file, as separate processes would
+        cache = FileCache(str(self.cache_path))
+        other_cache = FileCache(str(self.cache_path))
+
+        cache.set_many({"a": "Video A", "b": "Video B"})
+        other_cache.set("c", "Video C")
+        other_cache.delete_many(["b"])
+        cache.set("d", "Video D")
+
+        # Neither cache discards the other's changes
+        expected = {"a": "Video A", "c": "Video C", "d": "Video D"}
+        self.assertEqual(expected, dict(cache.iter_items()))
+        self.assertEqual(expected, json.loads(self.cache_path.read_text()))
+        self.assertEqual(expected, dict(FileCache(str(self.cache_path)).iter_items()))
+
+    def test_cleared_cache(self):
+        cache = FileCache(str(self.cache_path))
+        cache.set("a", "Video A")
+
+        self.cache_path.unlink()
+        cache.set("b", "Video B")
+
+        self.assertEqual({"b": "Video B"}, json.loads(self.cache_path.read_text()))
+
+    def test_concurrent_writers(self):
+        def write(writer: int):
+            cache = FileCache(str(self.cache_path))
+            for i in range(25):
+                cache.set(f"{writer}-{i}", {"title": f"Video {i}"})
+
+        threads = [threading.Thread(target=write, args=[writer]) for writer in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(100, len(json.loads(self.cache_path.read_text())))
+
+
+class TestJournaledFileCache(TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.cache_path = Path(self.temp_dir.name) / "cache.json"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def kill(self, cache: JournaledFileCache):
+        """Simulate the application being killed without closing the cache."""
+        cache._journal.close()
+        atexit.unregister(cache.close)
+
+    def test_set_appends_to_journal(self):
+        cache = JournaledFileCache(str(self.cache_path))
+        cache.set("a", {"title": "Video A"})
+        cache.set("b", {"title": "Video B"})
+
+        self.assertTrue(cache.has("a"))
+        self.assertEqual({"title": "Video B"}, cache["b"])
+        self.assertFalse(self.cache_path.exists())
+        self.assertEqual(2, len(cache.journal_path.read_text().splitlines()))
+
+        cache.close()
+
+    def test_journal_replayed_on_load(self):
+        self.cache_path.write_text(json.dumps({"a": {"title": "Old A"}}))
+
+        cache = JournaledFileCache(str(self.cache_path))
+        cache.set("a", {"title": "New A"})
+        cache.set("b", {"title": "Video B"})
+
+        self.kill(cache)
+
+        reloaded = JournaledFileCache(str(self.cache_path))
+        self.assertEqual({"title": "New A"}, reloaded["a"])
+        self.assertEqual({"title": "Video B"}, reloaded["b"])
+        reloaded.close()
+
+    def test_torn_record_discarded(self):
+        journal_path = self.cache_path.with_name("cache.json.journal")
+        journal_path.write_text('["a", {"title": "Video A"}]\n["b", {"tit')
+
+        cache = JournaledFileCache(str(self.cache_path))
+        self.assertTrue(cache.has("a"))
+        self.assertFalse(cache.has("b"))
+
+        # New records must not be appended onto the end of the torn record.
+        cache.set("c", {"title": "Video C"})
+        self.kill(cache)
+
+        reloaded = JournaledFileCache(str(self.cache_path))
+        self.assertTrue(reloaded.has("c"))
+        reloaded.close()
+
+    def test_close_compacts_into_snapshot(self):
+        cache = JournaledFileCache(str(self.cache_path))
+        cache.set("a", {"title": "Video A"})
+        cache.close()
+
+        self.assertEqual("", cache.journal_path.read_text())
+
+        # The snapshot is readable by the plain file cache.
+        file_cache = FileCache(str(self.cache_path))
+        self.assertEqual({"title": "Video A"}, file_cache["a"])
+
+    def test_compaction_threshold(self):
+        cache = JournaledFileCache(str(self.cache_path), compact_threshold=3)
+        for i in range(10):
+            cache.set(str(i), {"title": f"Video {i}"})
+        cache._compaction_thread.join()
+        self.kill(cache)
+
+        reloaded = JournaledFileCache(str(self.cache_path))
+        self.assertTrue(all(reloaded.has(str(i)) for i in range(10)))
+        reloaded.close()
+
+    def test_unserializable_value(self):
+        cache = JournaledFileCache(str(self.cache_path))
+
+        with self.assertRaises(TypeError):
+            cache.set("a", object())
+
+        self.assertFalse(cache.has("a"))
+        cache.close()
+
+    def test_delete_replayed_on_load(self):
+        cache = JournaledFileCache(str(self.cache_path))
+        cache.set_many({"a": {"title": "Video A"}, "b": {"title": "Video B"}})
+        cache.delete_many(["a"])
+        self.kill(cache)
+
+        reloaded = JournaledFileCache(str(self.cache_path))
+        self.assertFalse(reloaded.has("a"))
+        self.assertTrue(reloaded.has("b"))
+        reloaded.close()
+
+
+    def test_shared_file(self):
+        cache = JournaledFileCache(str(self.cache_path))
+        other_cache = JournaledFileCache(str(self.cache_path))
+
+        cache.set("a", {"title": "Video A"})
+        other_cache.set("b", {"title": "Video B"})
+
+        # Compacting one cache keeps the other's records, and the other can
+        # keep appending afterwards
+        cache.close()
+        other_cache.set("c", {"title": "Video C"})
+        other_cache.close()
+
+        reloaded = JournaledFileCache(str(self.cache_path))
+        self.assertEqual(["a", "b", "c"], sorted(key for key, _ in reloaded.iter_items()))
+        reloaded.close()
+
+    def test_writes_during_compaction(self):
+        cache = JournaledFileCache(str(self.cache_path))
+        cache.set("a", {"title": "Video A"})
+        write_snapshot = cache.write_snapshot
+
+        # The snapshot is written without holding any locks, so the cache can
+        # still be written to; records written meanwhile aren't lost
+        def write_snapshot_and_set(items):
+            temp_path = write_snapshot(items)
+            cache.set("b", {"title": "Video B"})
+            cache.delete_many(["a"])
+            return temp_path
+
+        cache.write_snapshot = write_snapshot_and_set
+        cache.compact()
+        cache.write_snapshot = write_snapshot
+
+        self.assertEqual(
+            {"a": {"title": "Video A"}}, json.loads(self.cache_path.read_text())
+        )
+        self.assertEqual("", cache.journal_path.read_text())
+        self.assertEqual(["b"], [key for key, _ in cache.iter_items()])
+        self.kill(cache)
+
+        reloaded = JournaledFileCache(str(self.cache_path))
+        self.assertEqual(["b"], [key for key, _ in reloaded.iter_items()])
+        reloaded.close()
+
+        # Closing compacts the records written meanwhile as well
+        self.assertEqual(
+            {"b": {"title": "Video B"}}, json.loads(self.cache_path.read_text())
+        )
+        self.assertFalse(reloaded.compacting_path.exists())
+
+
+    def test_concurrent_writers(self):
+        def write(writer: int):
+            cache = JournaledFileCache(str(self.cache_path), compact_threshold=10)
+            for i in range(25):
+                cache.set(f"{writer}-{i}", {"title": f"Video {i}"})
+            cache.close()
+
+        threads = [threading.Thread(target=write, args=[writer]) for writer in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        reloaded = JournaledFileCache(str(self.cache_path))
+        self.assertEqual(100, len(list(reloaded.iter_items())))
+        reloaded.close()
+
+
+class TestSqliteCache(TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.cache_path = Path(self.temp_dir.name) / "cache.sqlite3"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_set_has(self):
+        cache = SqliteCache(str(self.cache_path))
+        cache.set("a", {"title": "Video A", "duration": 60})
+
+        self.assertTrue(cache.has("a"))
+        self.assertTrue("a" in cache)
+        self.assertFalse(cache.has("b"))
+        self.assertEqual({"title": "Video A", "duration": 60}, cache.get("a"))
+
+        with self.assertRaises(KeyError):
+            cache.get("b")
+
+        cache.close()
+
+    def test_persistence(self):
+        cache = SqliteCache(str(self.cache_path), commit_every=10)
+        cache.set_many({"a": {"title": "Video A"}, "b": {"title": "Video B"}})
+        cache.set("a", {"title": "New A"})
+        cache.close()
+
+        reloaded = SqliteCache(str(self.cache_path))
+        self.assertEqual(2, len(reloaded))
+        self.assertEqual({"title": "New A"}, reloaded["a"])
+        reloaded.close()
+
+    def test_unserializable_value(self):
+        cache = SqliteCache(str(self.cache_path))
+
+        with self.assertRaises(TypeError):
+            cache.set("a", object())
+
+        self.assertFalse(cache.has("a"))
+        cache.close()
+
+
+class TestShardedFileCache(TestCase):
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_dir = Path(temp_dir.name) / "cache"
+
+    def test_shards_loaded_lazily(self):
+        cache = ShardedFileCache(str(self.cache_dir), num_shards=8)
+        items = {f"key-{i}": {"title": f"Video {i}"} for i in range(100)}
+        cache.set_many(items)
+        cache.close()
+
+        self.assertEqual(8, len(list(self.cache_dir.glob("*.json.gz"))))
+
+        # Only the shard holding the key is loaded
+        cache = ShardedFileCache(str(self.cache_dir), num_shards=8)
+        self.assertEqual({"title": "Video 5"}, cache.get("key-5"))
+        self.assertEqual(1, cache.get_num_loaded_shards())
+        self.assertFalse(cache.has("key-100"))
+
+        # Only the shard holding the key is rewritten
+        shard_path = self.cache_dir / f"shard-{cache.get_shard_index('key-7'):03d}.json.gz"
+        modified_times = {
+            path: path.stat().st_mtime_ns for path in self.cache_dir.iterdir()
+        }
+        cache.set("key-7", {"title": "New 7"})
+        self.assertEqual(
+            [shard_path],
+            [
+                path
+                for path in self.cache_dir.iterdir()
+                if path.stat().st_mtime_ns != modified_times[path]
+            ],
+        )
+
+        cache.delete_many(["key-8"])
+        cache.close()
+
+        cache = ShardedFileCache(str(self.cache_dir), num_shards=8)
+        self.assertEqual({"title": "New 7"}, cache["key-7"])
+        self.assertNotIn("key-8", cache)
+        self.assertEqual(99, len(cache))
+
+    def test_compressed_shards(self):
+        shard = CompressedFileCache(str(self.cache_dir.with_suffix(".json.gz")))
+        shard.set("a", {"title": "Video A"})
+
+        with self.assertRaises(TypeError):
+            shard.set("b", object())
+        self.assertFalse(shard.has("b"))
+
+        reloaded = CompressedFileCache(str(self.cache_dir.with_suffix(".json.gz")))
+        self.assertEqual({"title": "Video A"}, reloaded.get("a"))
+
+    def test_wrapped_shards(self):
+        cache = ShardedFileCache(
+            str(self.cache_dir),
+            num_shards=4,
+            wrap_shard=lambda shard: PolicyCache(shard, max_entries=1),
+        )
+        self.addCleanup(cache.close)
+        cache.set_many({f"key-{i}": {"title": f"Video {i}"} for i in range(20)})
+
+        # Each shard keeps at most one entry, once it's evicted on closing
+        cache.close()
+        self.assertEqual(4, len(cache))
+
+
+class TestTieredCache(TestCase):
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_path = Path(temp_dir.name) / "cache.sqlite3"
+
+    def test_memory_tier(self):
+        store = SqliteCache(str(self.cache_path))
+        store.set_many({"a": {"title": "Video A"}, "b": {"title": "Video B"}})
+
+        metrics = FetchMetrics()
+        cache = TieredCache(store, max_entries=2, metrics=metrics)
+        self.addCleanup(cache.close)
+
+        # The first lookup comes from the store, and later ones from memory
+        self.assertEqual({"title": "Video A"}, cache.get("a"))
+        self.assertEqual({"title": "Video A"}, cache.get("a"))
+        with self.assertRaises(KeyError):
+            cache.get("c")
+
+        self.assertEqual(
+            {
+                "memory": {"hits": 1, "misses": 2, "hit_ratio": 1 / 3},
+                "store": {"hits": 1, "misses": 1, "hit_ratio": 0.5},
+            },
+            metrics.cache_tiers_to_dict(),
+        )
+
+        # Writes go through to the store
+        cache.set("c", {"title": "Video C"})
+        self.assertEqual({"title": "Video C"}, store.get("c"))
+        self.assertTrue(cache.has("b"))
+
+        # The memory tier only keeps the most recently used entries
+        cache.get("b")
+        self.assertEqual(["c", "b"], list(cache._memory))
+
+        cache.delete_many(["b"])
+        self.assertFalse(cache.has("b"))
+        self.assertFalse(store.has("b"))
+
+    def test_with_policy(self):
+        store = SqliteCache(str(self.cache_path))
+        cache = PolicyCache(TieredCache(store, max_entries=10), max_entries=1)
+        self.addCleanup(cache.close)
+
+        cache.set("a", {"title": "Video A"})
+        cache.set("b", {"title": "Video B"})
+        cache.evict()
+
+        self.assertFalse(cache.has("a"))
+        self.assertEqual({"title": "Video B"}, cache.get("b"))
+        self.assertFalse(store.has("a"))
+
+    def test_lookups_use_memory_tier(self):
+        metrics = FetchMetrics()
+        store = SqliteCache(str(self.cache_path))
+        store.set("a", {"title": "Video A"})
+        cache = PolicyCache(TieredCache(store, metrics=metrics), max_entries=10)
+        self.addCleanup(cache.close)
+
+        # A lookup reads the entry from the wrapped cache once
+        self.assertEqual({"title": "Video A"}, cache.get("a"))
+        self.assertEqual(
+            {
+                "memory": {"hits": 0, "misses": 1, "hit_ratio": 0.0},
+                "store": {"hits": 1, "misses": 0, "hit_ratio": 1.0},
+            },
+            metrics.cache_tiers_to_dict(),
+        )
+
+        # Later lookups come from memory, and checking for an entry that's been
+        # looked up doesn't read it again
+        self.assertTrue(cache.has("a"))
+        self.assertEqual({"title": "Video A"}, cache.get("a"))
+        self.assertEqual(
+            {
+                "memory": {"hits": 1, "misses": 1, "hit_ratio": 0.5},
+                "store": {"hits": 1, "misses": 0, "hit_ratio": 1.0},
+            },
+            metrics.cache_tiers_to_dict(),
+        )
+
+
+class TestPolicyCache(TestCase):
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_path = Path(temp_dir.name) / "cache.json"
+        self.now = 1000000.0
+
+    def clock(self):
+        return self.now
+
+    def get_policy_cache(self, cache, **kwargs) -> PolicyCache:
+        policy_cache = PolicyCache(cache, clock=self.clock, **kwargs)
+        self.addCleanup(policy_cache.close)
+        return policy_cache
+
+    def test_ttl(self):
+        cache = self.get_policy_cache(
+            FileCache(str(self.cache_path)),
+            ttls={"youtube": 100, "short-link": 1000},
+            default_ttl=500,
+        )
+        cache.set("youtube-aaaaaaaaaaa", {"title": "Video A"})
+        cache.set("short-link-b23.tv/abc", {"resolved_url": "https://b.com"})
+        cache.set("yt-dlp-https://example.com/1", {"title": "Video 1"})
+
+        # Values are stored in envelopes
+        self.assertEqual(
+            {"value": {"title": "Video A"}, "stored": self.now, "accessed": self.now},
+            json.loads(self.cache_path.read_text())["youtube-aaaaaaaaaaa"],
+        )
+
+        self.now += 200
+        self.assertFalse(cache.has("youtube-aaaaaaaaaaa"))
+        self.assertTrue(cache.has("yt-dlp-https://example.com/1"))
+
+        self.now += 400
+        self.assertFalse(cache.has("yt-dlp-https://example.com/1"))
+        self.assertEqual(
+            {"resolved_url": "https://b.com"}, cache.get("short-link-b23.tv/abc")
+        )
+
+        # Expired entries are removed from the wrapped cache
+        self.assertEqual(
+            ["short-link-b23.tv/abc"], list(json.loads(self.cache_path.read_text()))
+        )
+
+    def test_lru_eviction(self):
+        cache = self.get_policy_cache(FileCache(str(self.cache_path)), max_entries=2)
+        cache.set("a", {"title": "Video A"})
+        cache.set("b", {"title": "Video B"})
+
+        # Accessing "a" makes "b" the least recently accessed entry
+        cache.get("a")
+        cache.set("c", {"title": "Video C"})
+        cache.evict()
+
+        self.assertTrue(cache.has("a"))
+        self.assertFalse(cache.has("b"))
+        self.assertTrue(cache.has("c"))
+        self.assertEqual(2, len(cache))
+
+        # Entries are also evicted to stay within the size limit
+        envelope = PolicyCache.create_envelope({"title": "Video A"}, self.now)
+        cache.max_bytes = len(json.dumps(envelope))
+        cache.evict()
+        self.assertEqual(1, len(cache))
+        self.assertFalse(cache.has("a"))
+
+    def test_access_times_persisted(self):
+        cache = PolicyCache(
+            JournaledFileCache(str(self.cache_path)), max_entries=2, clock=self.clock
+        )
+        cache.set("a", {"title": "Video A"})
+        cache.set("b", {"title": "Video B"})
+
+        self.now += PolicyCache.access_resolution
+        cache.get("a")
+        cache.close()
+
+        # Once reloaded, "b" is still the least recently accessed entry
+        self.now += 1
+        cache = self.get_policy_cache(
+            JournaledFileCache(str(self.cache_path)), max_entries=2
+        )
+        self.assertEqual(self.now - 1, cache.cache.get("a")["accessed"])
+        cache.set("c", {"title": "Video C"})
+        cache.evict()
+        self.assertTrue(cache.has("a"))
+        self.assertFalse(cache.has("b"))
+
+    def test_lazy_lookups(self):
+        cache_dir = self.cache_path.with_suffix("")
+        sharded_cache = ShardedFileCache(str(cache_dir), num_shards=8)
+        sharded_cache.set_many({f"key-{i}": {"title": f"Video {i}"} for i in range(20)})
+        sharded_cache.close()
+
+        # Wrapping the cache doesn't load every shard, and lookups only load
+        # the shards they need
+        sharded_cache = ShardedFileCache(str(cache_dir), num_shards=8)
+        cache = self.get_policy_cache(sharded_cache, max_entries=100)
+        self.assertEqual(0, sharded_cache.get_num_loaded_shards())
+
+        self.assertEqual({"title": "Video 3"}, cache.get("key-3"))
+        self.assertEqual(1, sharded_cache.get_num_loaded_shards())
+
+    def test_unwrapped_values(self):
+        self.cache_path.write_text(json.dumps({"a": {"title": "Video A"}}))
+
+        # Values stored without the policy are treated as just stored, and
+        # wrapped in envelopes when the cache is flushed
+        cache = self.get_policy_cache(FileCache(str(self.cache_path)), default_ttl=100)
+        self.assertEqual({"title": "Video A"}, cache.get("a"))
+
+        cache.flush()
+        self.assertEqual(
+            {"value": {"title": "Video A"}, "stored": self.now, "accessed": self.now},
+            json.loads(self.cache_path.read_text())["a"],
+        )
+
+        self.now += 200
+        self.assertFalse(cache.has("a"))
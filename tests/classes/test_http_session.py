@@ -0,0 +1,64 @@
+from unittest import TestCase
+from unittest.mock import patch
+from classes.http_session import PooledSession
+from classes.fetcher import Fetcher
+
+
+class TestPooledSession(TestCase):
+    def test_resize(self):
+        session = PooledSession(pool_size=2, retries=4)
+        adapter = session.get_adapter("https://derpibooru.org")
+
+        self.assertEqual(2, adapter._pool_maxsize)
+        self.assertEqual(4, adapter.max_retries.total)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertNotIn(429, adapter.max_retries.status_forcelist)
+
+        # Pools only grow.
+        session.resize(8)
+        session.resize(4)
+        self.assertEqual(8, session.get_adapter("https://b23.tv")._pool_maxsize)
+        self.assertEqual(8, session.get_adapter("http://b23.tv")._pool_maxsize)
+
+    def test_timeout(self):
+        session = PooledSession(connect_timeout=3, read_timeout=10)
+
+        with patch("requests.Session.request") as request:
+            session.get("https://derpibooru.org")
+            self.assertEqual((3, 10), request.call_args.kwargs["timeout"])
+
+            session.get("https://derpibooru.org", timeout=1)
+            self.assertEqual(1, request.call_args.kwargs["timeout"])
+
+    def test_fetcher_session(self):
+        class HttpFetchService:
+            max_concurrency = 6
+            http_session = None
+
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                return {}
+
+            def parse(self, response):
+                return response
+
+            def set_http_session(self, http_session):
+                self.http_session = http_session
+
+        fetcher = Fetcher()
+        services = [HttpFetchService(), HttpFetchService()]
+        fetcher.add_service("first", services[0])
+        fetcher.add_service("second", services[1], max_concurrency=12)
+
+        # Services share the fetcher's session, which is sized for them.
+        session = fetcher.get_http_session()
+        self.assertIs(session, services[0].http_session)
+        self.assertIs(session, services[1].http_session)
+        self.assertEqual(12, session.pool_size)
+
+        new_session = PooledSession(pool_size=1)
+        fetcher.set_http_session(new_session)
+        self.assertIs(new_session, services[0].http_session)
+        self.assertEqual(12, new_session.pool_size)
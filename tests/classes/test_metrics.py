@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from classes.metrics import FetchMetrics, percentile
+from classes.exceptions import FetchRequestError
+
+
+class TestFetchMetrics(TestCase):
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+
+        self.assertEqual(50.0, percentile(values, 50))
+        self.assertEqual(90.0, percentile(values, 90))
+        self.assertEqual(1.0, percentile(values, 0))
+        self.assertIsNone(percentile([], 50))
+
+    def test_to_dict(self):
+        metrics = FetchMetrics()
+        metrics.record_request("YouTube", 0.2)
+        metrics.record_request("YouTube", 0.4)
+        metrics.record_cache_hit("YouTube")
+        metrics.record_cache_miss("YouTube")
+        metrics.record_cache_negative_hit("YouTube")
+        metrics.record_cache_miss("YouTube")
+        metrics.record_error("YouTube", FetchRequestError("Request failed"))
+        metrics.record_bytes("Derpibooru", 1024)
+
+        summary = metrics.to_dict()
+
+        self.assertEqual(["Derpibooru", "YouTube"], list(summary))
+        self.assertEqual(2, summary["YouTube"]["requests"])
+        self.assertAlmostEqual(0.3, summary["YouTube"]["latency_seconds"]["mean"])
+        self.assertEqual(0.4, summary["YouTube"]["latency_seconds"]["max"])
+        self.assertEqual(0.5, summary["YouTube"]["cache"]["hit_ratio"])
+        self.assertEqual({"FetchRequestError": 1}, summary["YouTube"]["errors"])
+        self.assertEqual(1024, summary["Derpibooru"]["bytes_received"])
+        self.assertIsNone(summary["Derpibooru"]["latency_seconds"]["p50"])
+
+    def test_to_prometheus(self):
+        metrics = FetchMetrics()
+        metrics.record_request("yt-dlp", 0.07)
+        metrics.record_request("yt-dlp", 3.0)
+        metrics.record_error("yt-dlp", FetchRequestError("Request failed"))
+
+        lines = metrics.to_prometheus().splitlines()
+
+        self.assertIn("# TYPE fetch_request_duration_seconds histogram", lines)
+        self.assertIn('fetch_requests_total{service="yt-dlp"} 2', lines)
+        self.assertIn('fetch_request_duration_seconds_bucket{service="yt-dlp",le="0.05"} 0', lines)
+        self.assertIn('fetch_request_duration_seconds_bucket{service="yt-dlp",le="0.1"} 1', lines)
+        self.assertIn('fetch_request_duration_seconds_bucket{service="yt-dlp",le="+Inf"} 2', lines)
+        self.assertIn('fetch_request_duration_seconds_count{service="yt-dlp"} 2', lines)
+        self.assertIn(
+            'fetch_errors_total{service="yt-dlp",error="FetchRequestError"} 1', lines
+        )
+
+    def test_cache_tiers(self):
+        metrics = FetchMetrics()
+        metrics.record_cache_tier_lookup("memory", True)
+        metrics.record_cache_tier_lookup("memory", False)
+        metrics.record_cache_tier_lookup("store", True)
+
+        self.assertEqual(
+            {"hits": 1, "misses": 1, "hit_ratio": 0.5},
+            metrics.cache_tiers_to_dict()["memory"],
+        )
+
+        lines = metrics.to_prometheus().splitlines()
+        self.assertIn('fetch_cache_tier_lookups_total{tier="store",result="hit"} 1', lines)
+        self.assertIn('fetch_cache_tier_lookups_total{tier="store",result="miss"} 0', lines)
+
+        metrics.reset()
+        self.assertEqual({}, metrics.cache_tiers_to_dict())
+
+    def test_write(self):
+        metrics = FetchMetrics()
+        metrics.record_request("YouTube", 0.1)
+
+        with TemporaryDirectory() as temp_dir:
+            json_path, prometheus_path = metrics.write(f"{temp_dir}/metrics")
+
+            with json_path.open() as file:
+                self.assertEqual(1, json.load(file)["YouTube"]["requests"])
+            self.assertTrue(Path(prometheus_path).read_text().startswith("# HELP"))
@@ -0,0 +1,92 @@
+import csv
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from classes.fetcher import Fetcher
+from classes.prefetch import VotesPrefetch
+
+
+class DictCache:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items[key]
+
+    def set(self, key, value):
+        self.items[key] = value
+
+    def has(self, key):
+        return key in self.items
+
+
+class MockFetchService:
+    def __init__(self):
+        self.requested_urls = []
+
+    def can_fetch(self, url):
+        return "example.com" in url
+
+    def request(self, url):
+        self.requested_urls.append(url)
+        return {"title": url}
+
+    def parse(self, response):
+        return response
+
+
+class TestVotesPrefetch(TestCase):
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.csv_path = f"{temp_dir.name}/votes.csv"
+
+        with open(self.csv_path, "w", newline="", encoding="utf8") as file:
+            csv.writer(file).writerows(
+                [
+                    ["Timestamp", "Vote 1", "Vote 2"],
+                    ["4/1/2024 9:00:00", "example.com/1", "https://example.com/2"],
+                    ["4/1/2024 9:30:00", "https://example.com/2", ""],
+                ]
+            )
+
+    def test_prefetch(self):
+        service = MockFetchService()
+        fetcher = Fetcher()
+        fetcher.set_cache(DictCache())
+        fetcher.add_service("mock", service)
+
+        prefetch = VotesPrefetch(self.csv_path, "key", lambda key: fetcher)
+        self.assertFalse(prefetch.is_done())
+        prefetch.start()
+        prefetch.join()
+
+        self.assertTrue(prefetch.is_done())
+        self.assertIsNone(prefetch.error)
+        self.assertEqual("https://example.com/1", prefetch.normalized_voting_data[1][1])
+        self.assertEqual(
+            "Prefetching complete: 2 videos fetched", prefetch.get_status()
+        )
+
+        # The fetched video data is cached, so fetching it again doesn't make
+        # any requests
+        self.assertEqual(2, len(service.requested_urls))
+        fetcher.fetch_many(["https://example.com/1", "https://example.com/2"])
+        self.assertEqual(2, len(service.requested_urls))
+
+        # The fetcher is created on the prefetch thread
+        self.assertIs(fetcher, prefetch.fetcher)
+
+        # The prefetch is only current for the same file and API key
+        self.assertTrue(prefetch.is_current(self.csv_path, "key"))
+        self.assertFalse(prefetch.is_current(self.csv_path, "other key"))
+        self.assertFalse(prefetch.is_current(f"{self.csv_path}.old", "key"))
+
+    def test_prefetch_error(self):
+        prefetch = VotesPrefetch(
+            f"{self.csv_path}.missing", "key", lambda key: Fetcher()
+        )
+        prefetch.start()
+        prefetch.join()
+
+        self.assertIsInstance(prefetch.error, FileNotFoundError)
+        self.assertTrue(prefetch.get_status().startswith("Prefetching failed"))
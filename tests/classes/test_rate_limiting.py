@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from classes.rate_limiting import TokenBucket, QuotaLedger
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(TestCase):
+    def test_reserve(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+
+        # The burst can be used straight away; after that, requests are spaced
+        # out at the bucket's rate.
+        self.assertEqual([0, 0, 0], [bucket.reserve() for _ in range(3)])
+        self.assertEqual(0.5, bucket.reserve())
+        self.assertEqual(1.0, bucket.reserve())
+
+        # Tokens refill over time, up to the burst size.
+        clock.now += 100
+        self.assertEqual([0, 0, 0], [bucket.reserve() for _ in range(3)])
+        self.assertEqual(0.5, bucket.reserve())
+
+    def test_back_off(self):
+        clock = FakeClock()
+        bucket = TokenBucket(
+            rate=10, burst=10, initial_backoff=5, max_backoff=12, clock=clock
+        )
+
+        self.assertEqual(5, bucket.back_off())
+        self.assertEqual(5, bucket.reserve())
+        self.assertEqual(10, bucket.back_off())
+        self.assertEqual(12, bucket.back_off())
+        self.assertEqual(30, bucket.back_off(retry_after=30))
+
+        clock.now += 30
+        self.assertEqual(0, bucket.reserve())
+
+        # The backoff delay shrinks again after successful requests.
+        bucket.recover()
+        self.assertEqual(6, bucket.backoff)
+        bucket.recover()
+        self.assertEqual(0, bucket.backoff)
+
+
+class TestQuotaLedger(TestCase):
+    def test_quota_ledger(self):
+        with TemporaryDirectory() as temp_dir:
+            ledger_path = Path(temp_dir) / "quota.json"
+            ledger = QuotaLedger(str(ledger_path), daily_budget=100)
+
+            self.assertEqual(100, ledger.get_remaining())
+            self.assertFalse(ledger.would_exceed(100))
+
+            ledger.spend(60)
+            ledger.spend(30)
+            self.assertEqual(10, ledger.get_remaining())
+            self.assertTrue(ledger.would_exceed(11))
+
+            # The ledger is persisted, and reloaded by new instances.
+            with ledger_path.open() as file:
+                self.assertEqual({ledger.get_day(): 90}, json.load(file))
+
+            self.assertEqual(90, QuotaLedger(str(ledger_path), 100).get_spent())
+
+    def test_days_kept(self):
+        with TemporaryDirectory() as temp_dir:
+            ledger_path = Path(temp_dir) / "quota.json"
+            old_days = {f"2020-01-{day:02}": 1 for day in range(1, 31)}
+            ledger_path.write_text(json.dumps(old_days))
+
+            ledger = QuotaLedger(str(ledger_path), daily_budget=100)
+            ledger.spend(5)
+
+            self.assertEqual(30, len(ledger.days))
+            self.assertNotIn("2020-01-01", ledger.days)
+            self.assertEqual(5, ledger.days[ledger.get_day()])
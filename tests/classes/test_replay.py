@@ -0,0 +1,109 @@
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from classes.fetcher import Fetcher
+from classes.replay import FixtureStore, RecordingFetchService, ReplayFetchService
+from classes.exceptions import FetchRequestError, VideoUnavailableError
+
+
+class MockFetchService:
+    domains = ["example.com", "short.example"]
+    max_concurrency = 3
+
+    def __init__(self):
+        self.requests = 0
+
+    def can_fetch(self, url):
+        return True
+
+    def request(self, url):
+        self.requests += 1
+        if "unavailable" in url:
+            raise VideoUnavailableError("Video unavailable")
+        return {"title": url}
+
+    def request_batch(self, urls):
+        self.requests += 1
+        return {
+            url: (
+                VideoUnavailableError("Video unavailable")
+                if "unavailable" in url
+                else {"title": url}
+            )
+            for url in urls
+        }
+
+    def is_short_link(self, url):
+        return "short.example" in url
+
+    def resolve_short_link(self, url):
+        self.requests += 1
+        return url.replace("short.example", "example.com")
+
+    def parse(self, video_data):
+        return {"title": video_data["title"].upper()}
+
+
+class TestReplay(TestCase):
+    def test_record_and_replay(self):
+        urls = ["https://example.com/1", "https://example.com/unavailable"]
+
+        with TemporaryDirectory() as fixture_dir:
+            service = MockFetchService()
+            recording_service = RecordingFetchService(
+                service, FixtureStore(fixture_dir, "mock")
+            )
+
+            # The recording service passes through to the real service.
+            self.assertEqual(3, recording_service.max_concurrency)
+
+            fetcher = Fetcher()
+            fetcher.add_service("mock", recording_service)
+            recorded_results = fetcher.fetch_many(
+                urls + ["https://short.example/2", "https://example.com/3"]
+            )
+            self.assertEqual(3, service.requests)
+
+            # The replaying service serves the same results, without making
+            # any requests.
+            service = MockFetchService()
+            fetcher = Fetcher()
+            fetcher.add_service(
+                "mock", ReplayFetchService(service, FixtureStore(fixture_dir, "mock"))
+            )
+            replayed_results = fetcher.fetch_many(
+                urls + ["https://short.example/2", "https://example.com/3"]
+            )
+
+            self.assertEqual(0, service.requests)
+            self.assertEqual(recorded_results[0], replayed_results[0])
+            self.assertEqual({"title": "HTTPS://EXAMPLE.COM/1"}, replayed_results[0])
+            self.assertIsInstance(replayed_results[1], VideoUnavailableError)
+            self.assertEqual({"title": "HTTPS://EXAMPLE.COM/2"}, replayed_results[2])
+            self.assertEqual({"title": "HTTPS://EXAMPLE.COM/3"}, replayed_results[3])
+
+            # URLs with no recorded response fail.
+            with self.assertRaises(FetchRequestError):
+                fetcher.fetch("https://example.com/4")
+
+    def test_synthetic_errors(self):
+        with TemporaryDirectory() as fixture_dir:
+            fixture_store = FixtureStore(fixture_dir, "mock")
+            fixture_store.save("request", "https://example.com/1", {"title": "1"})
+
+            def replay(seed):
+                service = ReplayFetchService(
+                    MockFetchService(), fixture_store, error_rate=0.5, seed=seed
+                )
+                results = []
+                for _ in range(20):
+                    try:
+                        results.append(service.request("https://example.com/1"))
+                    except FetchRequestError as e:
+                        results.append(None)
+                return results
+
+            # Errors are random, but repeatable with the same seed.
+            results = replay(1)
+            self.assertIn(None, results)
+            self.assertIn({"title": "1"}, results)
+            self.assertEqual(results, replay(1))
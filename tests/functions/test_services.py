@@ -0,0 +1,114 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+from classes.fetcher import Fetcher
+from classes.caching import FileCache, SqliteCache, TieredCache, PolicyCache
+from functions import services, video_data
+
+
+class TestFunctionsServices(TestCase):
+    def setUp(self):
+        services.close_shared_fetchers()
+        self.addCleanup(services.close_shared_fetchers)
+
+    def test_get_shared_fetcher(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        cache = FileCache(f"{temp_dir.name}/cache.json")
+        created = []
+
+        def get_fetcher(youtube_api_key=None, config=None, cache=None):
+            fetcher = Fetcher()
+            fetcher.set_cache(cache)
+            created.append((youtube_api_key, cache))
+            return fetcher
+
+        with (
+            patch.object(services, "get_fetcher", get_fetcher),
+            patch.object(services, "get_cache", lambda config: cache),
+        ):
+            fetcher = services.get_shared_fetcher("key-1")
+            self.assertFalse(fetcher._prompt_on_missing_data)
+            fetcher.set_prompt_on_missing_data(True)
+
+            # The same fetcher is returned for the same key, and getting it
+            # again (eg. from a prefetch thread) leaves its settings alone
+            self.assertIs(fetcher, services.get_shared_fetcher("key-1"))
+            self.assertTrue(fetcher._prompt_on_missing_data)
+
+            # A different key gets its own fetcher, sharing the same cache
+            other_fetcher = services.get_shared_fetcher("key-2")
+            self.assertIsNot(fetcher, other_fetcher)
+            self.assertEqual([("key-1", cache), ("key-2", cache)], created)
+
+            # Closing the shared fetchers means new ones are created next time
+            services.close_shared_fetchers()
+            self.assertIsNot(fetcher, services.get_shared_fetcher("key-1"))
+            self.assertEqual(3, len(created))
+
+    def test_fetch_videos_data_does_not_prompt(self):
+        class IncompleteFetchService:
+            def can_fetch(self, url):
+                return True
+
+            def request(self, url):
+                return {"title": url, "duration": None}
+
+            def parse(self, response):
+                return dict(response)
+
+        fetcher = Fetcher()
+        fetcher.add_service("mock", IncompleteFetchService())
+
+        # Prompting left enabled by another process (eg. vote processing) is
+        # turned off, so incomplete data isn't set aside for a later run
+        fetcher.set_prompt_on_missing_data(True)
+        with patch.object(video_data, "get_shared_fetcher", lambda key: fetcher):
+            videos_data = video_data.fetch_videos_data("key", ["https://a.example"])
+
+        self.assertIsNone(videos_data["https://a.example"]["duration"])
+        self.assertFalse(fetcher.has_missing_data())
+
+    def test_get_cache_disabled(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        # A null cache path disables caching for every backend, without
+        # creating any files
+        for backend in ["file", "journal", "sqlite", "sharded"]:
+            config = {
+                "paths": {
+                    "cache": None,
+                    "sqlite_cache": f"{temp_dir.name}/cache.sqlite3",
+                    "sharded_cache": f"{temp_dir.name}/cache",
+                },
+                "cache": {"backend": backend, "memory_tier": {"max_entries": 10}},
+            }
+            self.assertIsNone(services.get_cache(config), backend)
+            self.assertIsNone(services.get_cache_backend(config), backend)
+
+        self.assertEqual([], os.listdir(temp_dir.name))
+
+    def test_wrap_cache(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        cache_config = {
+            "memory_tier": {"max_entries": 10},
+            "policy": {"max_entries": 100},
+        }
+
+        # Backends which read entries from disk get a memory tier
+        sqlite_cache = SqliteCache(f"{temp_dir.name}/cache.sqlite3")
+        cache = services.wrap_cache(sqlite_cache, cache_config)
+        self.addCleanup(cache.close)
+        self.assertIsInstance(cache, PolicyCache)
+        self.assertIsInstance(cache.cache, TieredCache)
+        self.assertIs(sqlite_cache, cache.cache.store)
+
+        # Backends which keep their entries in memory (including the shards of
+        # the sharded backend) don't
+        file_cache = FileCache(f"{temp_dir.name}/cache.json")
+        cache = services.wrap_cache(file_cache, cache_config, num_shards=4)
+        self.addCleanup(cache.close)
+        self.assertIs(file_cache, cache.cache)
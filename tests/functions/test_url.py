@@ -1,6 +1,13 @@
 import pytest
 from unittest import TestCase
-from functions.url import is_youtube_url, normalize_youtube_url, normalize_derpibooru_url
+from functions.url import (
+    is_youtube_url,
+    normalize_youtube_url,
+    normalize_derpibooru_url,
+    get_video_identity,
+    get_domain_suffixes,
+    is_url_on_domain,
+)
 
 
 class TestFunctionsUrl(TestCase):
@@ -51,6 +58,15 @@ class TestFunctionsUrl(TestCase):
         with self.assertRaises(ValueError):
             normalize_youtube_url("https://www.youtube.com/shorts?v=Q8k4UTf8jiI")
 
+        # URLs without a path raise a ValueError, rather than an IndexError
+        for url in [
+            "https://www.youtube.com",
+            "https://youtu.be",
+            "https://youtube.com?x=1",
+        ]:
+            with self.assertRaises(ValueError):
+                normalize_youtube_url(url)
+
         # Non-YouTube links should raise a ValueError
         with self.assertRaises(ValueError):
             normalize_youtube_url("https://www.bilibili.com/video/BV1HC411H7Po/")
@@ -70,3 +86,48 @@ def test_normalize_derpibooru_url():
 
     with pytest.raises(ValueError):
         assert normalize_derpibooru_url("https://derpibooru.org")
+
+
+def test_get_video_identity():
+    # Variants of the same video share an identity
+    assert get_video_identity("https://youtu.be/9RT4lfvVFhA?si=WXC57zYboHEsKd-C") == ("youtube", "9RT4lfvVFhA")
+    assert get_video_identity("https://m.youtube.com/watch?v=9RT4lfvVFhA") == ("youtube", "9RT4lfvVFhA")
+
+    assert get_video_identity("https://x.com/user/status/1234567890") == ("twitter", "1234567890")
+    assert get_video_identity("https://twitter.com/user/status/1234567890/video/1") == ("twitter", "1234567890")
+    assert get_video_identity("https://twitter.com/user/status/1234567890/video/2") == ("twitter", "1234567890/2")
+
+    assert get_video_identity("https://www.instagram.com/reel/C1a2b3c4d5e/") == ("instagram", "C1a2b3c4d5e")
+    assert get_video_identity("https://instagram.com/p/C1a2b3c4d5e?igsh=abc") == ("instagram", "C1a2b3c4d5e")
+
+    assert get_video_identity("https://www.bilibili.com/video/BV1HC411H7Po/") == ("bilibili", "BV1HC411H7Po")
+    assert get_video_identity("https://m.bilibili.com/video/BV1HC411H7Po?p=1") == ("bilibili", "BV1HC411H7Po")
+
+    assert get_video_identity("https://derpibooru.org/images/1130155?sd=desc") == ("derpibooru", "1130155")
+    assert get_video_identity("https://dai.ly/x8abcde") == get_video_identity("https://www.dailymotion.com/video/x8abcde")
+    assert get_video_identity("pony.tube/w/bYSyWpjg6r6zo68o1imK5t") == ("pony.tube", "bYSyWpjg6r6zo68o1imK5t")
+
+    # Share links and unknown sites can't be identified from the URL alone
+    assert get_video_identity("https://b23.tv/AbCdEf1") is None
+    assert get_video_identity("https://example.com/video/1") is None
+    assert get_video_identity("https://www.youtube.com/watch?vQ8k4UTf8jiI") is None
+    assert get_video_identity("https://www.youtube.com") is None
+    assert get_video_identity("https://youtu.be") is None
+    assert get_video_identity("https://youtube.com?x=1") is None
+
+
+def test_get_domain_suffixes():
+    assert get_domain_suffixes("https://www.youtube.com/watch?v=9RT4lfvVFhA") == ["www.youtube.com", "youtube.com", "com"]
+    assert get_domain_suffixes("pt.thishorsie.rocks/w/abc") == ["pt.thishorsie.rocks", "thishorsie.rocks", "rocks"]
+    assert get_domain_suffixes("https:///path") == []
+
+
+def test_is_url_on_domain():
+    domains = {"x.com", "thishorsie.rocks"}
+
+    assert is_url_on_domain("https://x.com/user/status/123", domains)
+    assert is_url_on_domain("https://pt.thishorsie.rocks/w/abc", domains)
+
+    # Domains only match whole hostname labels, and only in the hostname
+    assert not is_url_on_domain("https://box.com/file", domains)
+    assert not is_url_on_domain("https://example.com/?ref=x.com", domains)
@@ -6,11 +6,14 @@ from functions.voting import (
     process_voting_data,
     process_votes_csv_row,
     validate_video_data,
+    fetch_video_data_for_ballots,
     generate_annotated_csv_data,
     shift_cells,
     shift_columns,
 )
 from classes.voting import Ballot, Vote, Video
+from classes.fetcher import Fetcher
+from classes.exceptions import FetchRequestError, VideoUnavailableError
 
 
 class TestFunctionsVoting(TestCase):
@@ -81,6 +84,34 @@ class TestFunctionsVoting(TestCase):
         self.assertEqual("https://example.com/2", norm_voting_data[2][1])
         self.assertEqual("", norm_voting_data[2][2])
 
+    def test_normalize_voting_data_short_links(self):
+        voting_data = [
+            ["Timestamp", "", ""],
+            ["4/1/2024 9:00:00", "b23.tv/abc123", "https://www.youtube.com/watch?v=9RT4lfvVFhA"],
+        ]
+        voting_data.append(["4/2/2024 9:00:00", "b23.tv/broken", ""])
+        resolved_links = {
+            "https://b23.tv/abc123": "https://www.bilibili.com/video/BV1HC411H7Po"
+        }
+
+        def resolve_short_link(url):
+            if "broken" in url:
+                raise VideoUnavailableError("No video link was returned")
+            return resolved_links.get(url, url)
+
+        norm_voting_data = normalize_voting_data(voting_data, resolve_short_link)
+        self.assertEqual(
+            [
+                "4/1/2024 9:00:00",
+                "https://www.bilibili.com/video/BV1HC411H7Po",
+                "https://www.youtube.com/watch?v=9RT4lfvVFhA",
+            ],
+            norm_voting_data[1],
+        )
+
+        # Links which can't be resolved are left for the fetcher to report
+        self.assertEqual("https://b23.tv/broken", norm_voting_data[2][1])
+
     def test_process_voting_data(self):
         tz = timezone("Etc/UTC")
 
@@ -177,6 +208,68 @@ class TestFunctionsVoting(TestCase):
         self.assertEqual("https://example.com/6", ballot.votes[5].url)
         self.assertEqual("https://example.com/7", ballot.votes[6].url)
 
+    def test_fetch_video_data_for_ballots(self):
+        class MockFetchService:
+            def __init__(self):
+                self.requested = []
+
+            def can_fetch(self, url):
+                return "example.com" in url
+
+            def request(self, url):
+                self.requested.append(url)
+                if "unavailable" in url:
+                    raise VideoUnavailableError("Video unavailable")
+                if "fail" in url:
+                    raise FetchRequestError("Request failed")
+                return {
+                    "title": url,
+                    "uploader": "Uploader",
+                    "upload_date": None,
+                    "duration": 60,
+                    "platform": "Example",
+                }
+
+            def parse(self, response):
+                return response
+
+        fetcher = Fetcher()
+        service = MockFetchService()
+        fetcher.add_service("mock", service)
+
+        timestamp = datetime(2024, 4, 1)
+        ballots = [
+            Ballot(
+                timestamp,
+                [
+                    Vote("https://example.com/1"),
+                    Vote("https://example.com/unavailable"),
+                ],
+            ),
+            Ballot(
+                timestamp,
+                [
+                    Vote("https://example.com/1"),
+                    Vote("https://example.com/fail"),
+                    Vote("https://unsupported.com/1"),
+                ],
+            ),
+        ]
+
+        videos = fetch_video_data_for_ballots(ballots, fetcher)
+
+        self.assertEqual(4, len(videos))
+        self.assertEqual(3, len(service.requested))
+        self.assertEqual("https://example.com/1", videos["https://example.com/1"]["title"])
+        self.assertTrue(videos["https://example.com/1"].annotations.has_none())
+        self.assertTrue(
+            videos["https://example.com/unavailable"].annotations.has("VIDEO UNAVAILABLE")
+        )
+        self.assertTrue(videos["https://example.com/fail"].annotations.has("COULD NOT FETCH"))
+        self.assertTrue(
+            videos["https://unsupported.com/1"].annotations.has("UNSUPPORTED HOST")
+        )
+
     def test_validate_video_data(self):
         data = {
             "title": "Example Video 1",